@@ -0,0 +1,195 @@
+###
+# Copyright (c) 2013, Alec Leamas
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice,
+#     this list of conditions, and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice,
+#     this list of conditions, and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#   * Neither the name of the author of this software nor the name of
+#     contributors to this software may be used to endorse or promote products
+#     derived from this software without specific prior written consent.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+'''
+asyncio listener backend, an alternative to the twisted io_process
+selected by the backend option. It runs the same listener.Listener and
+listener.Client on an asyncio event loop, and thus has the same
+framing, authentication, blacklisting and spooling. Requires Python 3,
+imported only in the io_process.
+'''
+
+import asyncio
+import signal
+import sys
+
+from supybot import log
+
+from . import listener
+
+
+class AsyncioProtocol(listener.Client, asyncio.Protocol):
+    ''' The asyncio transport for a listener.Client. '''
+
+    def __init__(self, listener_):
+        listener.Client.__init__(self, listener_)
+        self.transport = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.opened(listener.peer_host(transport.get_extra_info('socket')))
+
+    def connection_lost(self, exc):
+        self.closed()
+
+    def abort(self):
+        self.transport.abort()
+
+    def close(self):
+        self.transport.close()
+
+    def pause(self):
+        self.transport.pause_reading()
+
+    def resume(self):
+        self.transport.resume_reading()
+
+    def write(self, data):
+        self.transport.write(data)
+
+
+class AsyncioHttpProtocol(listener.HttpClient, AsyncioProtocol):
+    ''' The asyncio transport for a listener.HttpClient. '''
+
+    def __init__(self, listener_):
+        listener.HttpClient.__init__(self, listener_)
+        self.transport = None
+
+
+class AsyncioDatagrams(listener.Datagrams):
+    '''
+    Reads a UDP socket for listener.Datagrams. Plain loop readers rather
+    than a DatagramTransport, which can't pause reading.
+    '''
+
+    MaxPacket = 65535
+    MaxBurst = 64         # Max datagrams read per event loop iteration.
+
+    def __init__(self, listener_, sock):
+        listener.Datagrams.__init__(self, listener_)
+        self.sock = sock
+        self.resume()
+        self.started()
+
+    def _read(self):
+        ''' Handle datagrams available on socket. '''
+        for i in range(self.MaxBurst):          # pylint: disable=W0612
+            try:
+                data, addr = self.sock.recvfrom(self.MaxPacket)
+            except (BlockingIOError, InterruptedError):
+                return
+            self.datagram_received(data, addr[0])
+
+    def pause(self):
+        self.listener.loop.remove_reader(self.sock.fileno())
+
+    def resume(self):
+        self.listener.loop.add_reader(self.sock.fileno(), self._read)
+
+
+class AsyncioListener(listener.Listener):
+    ''' Runs the listener.Listener on an asyncio event loop. '''
+
+    def __init__(self, pipe, loop):
+        self.loop = loop
+        listener.Listener.__init__(self, pipe)
+        loop.add_reader(pipe[0].fileno(), self._read_config)
+        loop.call_later(self.TickInterval, self._tick)
+
+    def call_later(self, delay, func):
+        return self.loop.call_later(delay, func)
+
+    def call_from_thread(self, func):
+        self.loop.call_soon_threadsafe(func)
+
+    def _read_config(self):
+        ''' Apply updates from main process, stop if it's gone. '''
+        if not self.read_config():
+            self.loop.remove_reader(self.pipe[0].fileno())
+            self.loop.stop()
+
+    def _tick(self):
+        ''' Run tick(), reschedule. '''
+        self.tick()
+        self.loop.call_later(self.TickInterval, self._tick)
+
+    def build_protocol(self):
+        ''' Protocol factory for loop.create_server(). '''
+        return AsyncioProtocol(self)
+
+    def build_http_protocol(self):
+        ''' Protocol factory for the HTTP port. '''
+        return AsyncioHttpProtocol(self)
+
+
+def _serve(listener_, kind, sock):
+    ''' Return a coroutine serving the listening sock of kind. '''
+    if kind == 'unix':
+        kwargs = {}
+        if sys.version_info >= (3, 13):
+            kwargs['cleanup_socket'] = False    # Path used by main process.
+        return listener_.loop.create_unix_server(listener_.build_protocol,
+                                                 sock = sock, **kwargs)
+    if kind == 'http':
+        return listener_.loop.create_server(listener_.build_http_protocol,
+                                            sock = sock)
+    return listener_.loop.create_server(listener_.build_protocol, sock = sock)
+
+
+def io_process(socks, pipe, inherited = ()):
+    '''
+    Run the asyncio-governed data flow from the listening socks, a list
+    of (kind, socket), -> irc, as twistedio.io_process().
+    '''
+    for conn in [pipe[1]] + list(inherited):
+        conn.close()
+    logger = log.getPluginLogger('irccat.io')
+    logger.debug("Starting asyncio IO process on %s"
+                 % ', '.join([str(s[1].getsockname()) for s in socks]))
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    listener_ = AsyncioListener(pipe, loop)
+    servers = []
+    for kind, sock in socks:
+        if kind == 'udp':
+            AsyncioDatagrams(listener_, sock)
+        else:
+            servers.append(loop.run_until_complete(
+                _serve(listener_, kind, sock)))
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, loop.stop)
+    try:
+        loop.run_forever()
+    except Exception as ex:                          # pylint: disable=W0703
+        logger.error("Exception in io_process: " + str(ex), exc_info = True)
+    for server in servers:
+        server.close()
+    listener_.flush()
+    loop.close()
+    logger.info(" io_process: exiting")
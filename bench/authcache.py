@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+'''
+Lines per second through IrccatProtocol.line_received with the password
+verification cache enabled and disabled.
+
+Usage: bench/authcache.py [lines] [salt]
+
+The salt selects the crypt scheme, e.g. '$6$rounds=5000$abcdefgh' for
+a strong SHA-512 scheme. Default is the traditional two-char DES salt
+used by sectiondata.
+'''
+
+import crypt
+import sys
+
+import benchlib
+
+
+class _Config(object):
+    ''' Single section config, without connection limits. '''
+
+    limits = (0, 0, 0, 0, 0)
+    longlines = (0, 'truncate')
+
+    def __init__(self, salt):
+        self.cipher = crypt.crypt('benchpw', salt)
+
+    def get(self, section_name):
+        ''' Return (password, channels) as _Config.get(). '''
+        if section_name != 'bench':
+            raise KeyError(section_name)
+        return self.cipher, ['#bench']
+
+
+def run(lines, salt, cachesize):
+    ''' Return lines/s for given cache size. '''
+    listener = benchlib.load_plugin('listener')
+    metrics = benchlib.load_plugin('metrics')
+    twistedio = benchlib.load_plugin('twistedio')
+    state = benchlib.FakeListener(_Config(salt),
+                                  listener.Blacklist(),
+                                  benchlib.NullConn(),
+                                  listener.AuthCache(cachesize),
+                                  metrics.Metrics())
+    protocol = twistedio.IrccatProtocol(state)
+    protocol.makeConnection(benchlib.FakeTransport())
+    line = b'bench;benchpw;Build 4711 completed OK'
+    return benchlib.timeit(lambda: protocol.line_received(line), lines)
+
+
+def main():
+    ''' Indeed: main function. '''
+    lines = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    salt = sys.argv[2] if len(sys.argv) > 2 else 'ab'
+    benchlib.report('authcache', {
+        'lines': lines,
+        'salt': salt,
+        'cache off (lines/s)': round(run(lines, salt, 0)),
+        'cache on (lines/s)': round(run(lines, salt, 256)),
+    })
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+'''
+Compares the listener backends: throughput, memory used by the
+listener process and load time.
+
+Usage: bench/backends.py [clients] [lines per client]
+
+For each backend a listener process is started as the plugin does.
+Startup is the time until a first line is delivered to the main
+process end of the pipe, throughput is lines/s delivered there, and
+RSS is the listener's after the run. Import times are measured in a
+fresh interpreter: the plugin, as loaded in the main process, and the
+backend module, imported by the listener process.
+
+The password cache is enabled, as for clients sending many lines to
+one section.
+'''
+
+import crypt
+import multiprocessing
+import os
+import os.path
+import select
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import benchlib
+
+PORT = 23497
+BACKENDS = {'twisted': 'twistedio', 'asyncio': 'aio'}
+
+
+def client(lines):
+    ''' Send lines lines in one connection. '''
+    s = socket.create_connection(('127.0.0.1', PORT))
+    s.sendall(b'bench;benchpw;Build 4711 completed OK\n' * lines)
+    s.close()
+
+
+def import_time(module, after = None):
+    '''
+    Return time (s) to import plugin module in a new python, once the
+    module after is imported.
+    '''
+    code = ['import importlib, sys, time',
+            'sys.path.insert(0, %r)' % os.path.dirname(benchlib.PLUGIN_DIR)]
+    if after:
+        code.append('importlib.import_module(%r)'
+                    % (benchlib.PACKAGE + '.' + after))
+    code += ['start = time.time()',
+             'importlib.import_module(%r)' % (benchlib.PACKAGE + '.' + module),
+             'print("import %f" % (time.time() - start))']
+    output = subprocess.check_output([sys.executable, '-c', '; '.join(code)])
+    for line in output.decode().splitlines():
+        if line.startswith('import '):
+            return float(line.split()[1])
+    raise RuntimeError("No import time in: " + output.decode())
+
+
+def run(plugin, module, clients, lines):
+    '''
+    Return (startup s, lines/s, rss kB) for an io_process running the
+    backend module.
+    '''
+    sock = plugin._listen_socket('tcp', ('127.0.0.1', PORT))
+    pipe = multiprocessing.Pipe()
+    pipe[1].send(plugin._Config())
+    start = time.time()
+    process = multiprocessing.Process(
+        target = plugin._io_process,
+        args = (module, [('tcp', sock)], pipe, ()))
+    process.start()
+    client(1)
+    while pipe[1].recv()[0] != 'lines':
+        pass
+    startup = time.time() - start
+
+    senders = [multiprocessing.Process(target = client, args = (lines,))
+                   for i in range(clients)]
+    start = time.time()
+    for sender in senders:
+        sender.start()
+    received = 0
+    while received < clients * lines:
+        if not select.select([pipe[1]], [], [], 10)[0]:
+            raise RuntimeError("Listener stalled at %d lines" % received)
+        kind, data = pipe[1].recv()
+        if kind == 'lines':
+            received += len(data[1])
+    elapsed = time.time() - start
+    rss = benchlib.proc_stats(process.pid)[1]
+    for sender in senders:
+        sender.join()
+    process.terminate()
+    process.join()
+    sock.close()
+    return startup, clients * lines / elapsed, rss
+
+
+def main():
+    ''' Indeed: main function. '''
+    clients = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    lines = int(sys.argv[2]) if len(sys.argv) > 2 else 5000
+    plugin = benchlib.load_plugin()
+    config = benchlib.load_plugin('config')
+    path = os.path.join(tempfile.mkdtemp(), 'sections.pickle')
+    config.global_option('sectionspath').setValue(path)
+    plugin._Config().update('bench', crypt.crypt('benchpw', 'ab'),
+                            ['#bench'])
+    results = {'clients': clients, 'lines per client': lines,
+               'plugin import (ms)': round(import_time('plugin') * 1000, 1)}
+    for backend in sorted(BACKENDS.keys()):
+        module = BACKENDS[backend]
+        startup, rate, rss = run(plugin, module, clients, lines)
+        results[backend + ' startup (ms)'] = round(startup * 1000, 1)
+        results[backend + ' lines/s'] = round(rate)
+        results[backend + ' rss (kB)'] = rss
+        results[backend + ' import (ms)'] = \
+            round(import_time(module, 'plugin') * 1000, 1)
+    benchlib.report('backends', results)
+
+
+if __name__ == '__main__':
+    main()
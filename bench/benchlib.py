@@ -0,0 +1,136 @@
+''' Common helpers for the benchmark scripts in this directory. '''
+
+import importlib
+import json
+import os
+import os.path
+import socket
+import sys
+import time
+
+PLUGIN_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PACKAGE = os.path.basename(PLUGIN_DIR)
+
+
+def load_plugin(module = 'plugin'):
+    ''' Import and return a module from the plugin package. '''
+    sys.path.insert(0, os.path.dirname(PLUGIN_DIR))
+    return importlib.import_module(PACKAGE + '.' + module)
+
+
+class FakePeer(object):
+    ''' Stands in for a twisted IAddress. '''
+
+    def __init__(self, host = '127.0.0.1'):
+        self.host = host
+
+
+class FakeSocket(object):
+    ''' A connected TCP socket, as far as listener.peer_host() cares. '''
+
+    family = socket.AF_INET
+
+    def __init__(self, host = '127.0.0.1'):
+        self.host = host
+
+    def getpeername(self):
+        ''' Return the fake peer address. '''
+        return (self.host, 4711)
+
+
+class FakeTransport(object):
+    ''' Minimal twisted transport, just enough for IrccatProtocol. '''
+
+    def __init__(self, host = '127.0.0.1'):
+        self.peer = FakePeer(host)
+        self.handle = FakeSocket(host)
+        self.aborted = False
+
+    def getPeer(self):
+        ''' Return the fake peer. '''
+        return self.peer
+
+    def getHandle(self):
+        ''' Return the fake socket. '''
+        return self.handle
+
+    def abortConnection(self):
+        ''' Record the abort. '''
+        self.aborted = True
+
+    def loseConnection(self):
+        ''' Record the close. '''
+        self.aborted = True
+
+
+class FakeListener(object):
+    '''
+    The listener.Listener state a listener.Client uses. config must
+    have the limits and longlines of plugin._Config.
+    '''
+
+    def __init__(self, config, blacklist, batcher, authcache, metrics):
+        self.config = config
+        self.blacklist = blacklist
+        self.batcher = batcher
+        self.authcache = authcache
+        self.metrics = metrics
+        self.connections = set()
+        self.streams = 0
+        self.hosts = {}
+        self.buffered = {}
+        self.paused = False
+        self.resumed = 0.0
+        self.dropping = False
+
+
+class NullConn(object):
+    ''' A multiprocessing Connection stand-in which counts sends. '''
+
+    def __init__(self):
+        self.count = 0
+
+    def send(self, obj):
+        ''' Count obj and drop it. '''
+        self.count += 1
+
+
+def proc_stats(pid):
+    ''' Return (cpu seconds, rss kB) for pid from /proc. '''
+    with open('/proc/%d/stat' % pid) as f:
+        fields = f.read().rsplit(')', 1)[1].split()
+    cpu = (int(fields[11]) + int(fields[12])) \
+        / float(os.sysconf('SC_CLK_TCK'))
+    rss = 0
+    with open('/proc/%d/status' % pid) as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                rss = int(line.split()[1])
+    return cpu, rss
+
+
+def wait_for_port(port, timeout):
+    ''' Wait until something listens to port. '''
+    start = time.time()
+    while time.time() - start < timeout:
+        try:
+            socket.create_connection(('127.0.0.1', port)).close()
+            return
+        except socket.error:
+            time.sleep(0.1)
+    raise RuntimeError("Plugin doesn't listen to port %d" % port)
+
+
+def timeit(func, count):
+    ''' Run func() count times, return calls per second. '''
+    start = time.time()
+    for i in range(count):                      # pylint: disable=W0612
+        func()
+    return count / (time.time() - start)
+
+
+def report(name, results):
+    ''' Print results dict as text and as a json line. '''
+    for key in sorted(results.keys()):
+        print("%-30s %s" % (key, results[key]))
+    print(json.dumps({'benchmark': name, 'results': results}))
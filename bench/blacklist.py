@@ -0,0 +1,39 @@
+#!/usr/bin/env python
+'''
+Memory used by Blacklist under a flood of bad lines from distinct
+source addresses, as seen from an internet-facing scanner.
+
+Usage: bench/blacklist.py [addresses]
+'''
+
+import sys
+import time
+import tracemalloc
+
+import benchlib
+
+
+def main():
+    ''' Indeed: main function. '''
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    listener = benchlib.load_plugin('listener')
+    blacklist = listener.Blacklist()
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    results = {'addresses': count}
+    start = time.time()
+    for i in range(1, count + 1):
+        host = '%d.%d.%d.%d' % (i >> 24, (i >> 16) & 255, (i >> 8) & 255,
+                                i & 255)
+        if not blacklist.onList(host):
+            blacklist.register(host, False)
+        if i % (count // 5) == 0:
+            key = 'memory after %7d (kB)' % i
+            results[key] = (tracemalloc.get_traced_memory()[0] - base) // 1024
+    results['lines/s'] = round(count / (time.time() - start))
+    results['tracked hosts'] = len(blacklist)
+    benchlib.report('blacklist', results)
+
+
+if __name__ == '__main__':
+    main()
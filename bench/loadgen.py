@@ -0,0 +1,302 @@
+#!/usr/bin/env python
+'''
+End-to-end load generator: runs a supybot instance with the plugin
+against a local fake irc server, drives it with concurrent clients and
+reports throughput, latency, CPU and memory.
+
+Usage: bench/loadgen.py [options], see --help.
+
+The plugin must be installed i. e., have an __init__.py as created by
+git-hooks/post-commit. Each line sent by a client carries its send
+time; the fake irc server computes the latency when the bot delivers
+it. CPU time and RSS are sampled from /proc for the bot's main
+process and its children, the io_process(es).
+
+Results are printed and saved as json (--output), so runs on different
+commits can be compared.
+'''
+
+import argparse
+import crypt
+import json
+import multiprocessing
+import os
+import os.path
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import benchlib
+
+CHANNEL = '#bench'
+NICK = 'irccatbench'
+
+
+class FakeIrcServer(object):
+    '''
+    Just enough of an irc server for supybot to connect and join
+    CHANNEL. Records the latency of each line the bot sends to it, and
+    when the last one arrived.
+    '''
+
+    def __init__(self):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind(('127.0.0.1', 0))
+        self.sock.listen(1)
+        self.port = self.sock.getsockname()[1]
+        self.joined = threading.Event()
+        self.latencies = []
+        self.messages = 0
+        self.last = None
+        self.lock = threading.Lock()
+        thread = threading.Thread(target = self._serve)
+        thread.daemon = True
+        thread.start()
+
+    def _serve(self):
+        ''' Handle the bot connection until it closes. '''
+        conn = self.sock.accept()[0]
+        conn.settimeout(None)
+        buf = b''
+        while True:
+            data = conn.recv(65536)
+            if not data:
+                return
+            buf += data
+            lines = buf.split(b'\r\n')
+            buf = lines.pop()
+            now = time.time()
+            for line in lines:
+                self._handle(conn, line.decode('utf-8', 'replace'), now)
+
+    def _handle(self, conn, line, now):
+        ''' Handle one line from the bot. '''
+        words = [w.lstrip(':') for w in line.split(' ')]
+        if words[0] == 'USER':
+            conn.sendall(((':fake 001 %s :Welcome\r\n'
+                          ':fake 376 %s :End of MOTD\r\n')
+                         % (NICK, NICK)).encode())
+        elif words[0] == 'PING':
+            conn.sendall((':fake PONG fake %s\r\n' % words[1]).encode())
+        elif words[0] == 'JOIN':
+            conn.sendall((':%s!bench@localhost JOIN %s\r\n'
+                          % (NICK, words[1])).encode())
+            if words[1] == CHANNEL:
+                self.joined.set()
+        elif words[0] in ('PRIVMSG', 'NOTICE') and words[1] == CHANNEL:
+            text = line.split(' :', 1)[1]
+            with self.lock:
+                self.messages += 1
+                self.last = now
+                for part in text.split(' | '):
+                    try:
+                        self.latencies.append(now - float(part.split()[0]))
+                    except (IndexError, ValueError):
+                        pass
+
+    def take(self):
+        ''' Return and reset (messages, latencies, last arrival time). '''
+        with self.lock:
+            data = (self.messages, self.latencies, self.last)
+            self.messages = 0
+            self.latencies = []
+            self.last = None
+        return data
+
+
+def client(port, auth, rate, size, duration, total):
+    '''
+    Send lines of size bytes at rate lines/s during duration s, add
+    number of sent lines to the shared total.
+    '''
+    s = socket.create_connection(('127.0.0.1', port))
+    if auth:
+        s.sendall(b'AUTH bench benchpw\n')
+    prefix = b'' if auth else b'bench;benchpw;'
+    start = time.time()
+    sent = 0
+    while time.time() - start < duration:
+        due = start + sent / float(rate) if rate else 0
+        if due > time.time():
+            time.sleep(due - time.time())
+        text = ('%.6f ' % time.time()).encode()
+        s.sendall(prefix + text + b'x' * max(size - len(text), 0) + b'\n')
+        sent += 1
+    s.close()
+    with total.get_lock():
+        total.value += sent
+
+
+def children(pid):
+    ''' Return list of child pids of pid. '''
+    pids = []
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open('/proc/%s/stat' % entry) as f:
+                if int(f.read().rsplit(')', 1)[1].split()[1]) == pid:
+                    pids.append(int(entry))
+        except (IOError, OSError):
+            pass
+    return pids
+
+
+def write_config(tmpdir, args, ircport):
+    ''' Write supybot config, return its path. '''
+    plugins = os.path.join(tmpdir, 'plugins')
+    os.mkdir(plugins)
+    os.symlink(benchlib.PLUGIN_DIR, os.path.join(plugins, 'Irccat'))
+    options = {
+        'supybot.nick': NICK,
+        'supybot.networks': 'fake',
+        'supybot.networks.fake.servers': '127.0.0.1:%d' % ircport,
+        'supybot.networks.fake.channels': CHANNEL,
+        'supybot.networks.fake.ssl': 'False',
+        'supybot.directories.conf': os.path.join(tmpdir, 'conf'),
+        'supybot.directories.data': os.path.join(tmpdir, 'data'),
+        'supybot.directories.log': os.path.join(tmpdir, 'logs'),
+        'supybot.directories.backup': os.path.join(tmpdir, 'backup'),
+        'supybot.directories.plugins': plugins,
+        'supybot.log.stdout': 'False',
+        'supybot.protocols.irc.throttleTime': '0',
+        'supybot.drivers.poll': str(args.poll),
+        'supybot.plugins': 'Irccat',
+        'supybot.plugins.Irccat': 'True',
+        'supybot.plugins.Irccat.port': str(args.port),
+        'supybot.plugins.Irccat.sectionspath':
+            os.path.join(tmpdir, 'sections.pickle'),
+    }
+    for option in args.set:
+        key, value = option.split('=', 1)
+        options['supybot.plugins.Irccat.' + key] = value
+    path = os.path.join(tmpdir, 'bench.conf')
+    with open(path, 'w') as f:
+        for key in sorted(options.keys()):
+            f.write('%s: %s\n' % (key, options[key]))
+    return path
+
+
+def percentile(values, q):
+    ''' Return the q-quantile of sorted values. '''
+    if not values:
+        return 0.0
+    return values[min(int(q * len(values)), len(values) - 1)]
+
+
+def run(args):
+    ''' Run the benchmark, return results dict. '''
+    if not os.path.exists(os.path.join(benchlib.PLUGIN_DIR, '__init__.py')):
+        sys.exit("No __init__.py, run git-hooks/post-commit first.")
+    store = benchlib.load_plugin('store')
+    tmpdir = tempfile.mkdtemp()
+    sections = store.open_store(
+        'sqlite', os.path.join(tmpdir, 'sections.pickle'))
+    sections.put('bench', {'password': crypt.crypt('benchpw', 'ab'),
+                           'channels': [CHANNEL]})
+    sections.close()
+    server = FakeIrcServer()
+    cmd = [args.supybot, write_config(tmpdir, args, server.port)]
+    if os.getuid() == 0:
+        cmd.insert(1, '--allow-root')
+    bot = subprocess.Popen(cmd, cwd = tmpdir)
+    try:
+        if not server.joined.wait(30):
+            raise RuntimeError("Bot didn't join " + CHANNEL)
+        benchlib.wait_for_port(args.port, 30)
+        server.take()
+        pids = [bot.pid] + children(bot.pid)
+        before = dict([(pid, benchlib.proc_stats(pid)) for pid in pids])
+        total = multiprocessing.Value('i', 0)
+        clients = [multiprocessing.Process(
+                       target = client,
+                       args = (args.port, args.auth, args.rate, args.size,
+                               args.duration, total))
+                   for i in range(args.clients)]
+        start = time.time()
+        for c in clients:
+            c.start()
+        for c in clients:
+            c.join()
+        time.sleep(args.drain)
+        after = dict([(pid, benchlib.proc_stats(pid)) for pid in pids])
+        messages, latencies, last = server.take()
+    finally:
+        bot.terminate()
+        for i in range(100):                    # pylint: disable=W0612
+            if bot.poll() is not None:
+                break
+            time.sleep(0.1)
+        else:
+            bot.kill()
+            bot.wait()
+        shutil.rmtree(tmpdir, True)
+    latencies.sort()
+    elapsed = last - start if last else 0     # Not counting idle drain.
+    results = {
+        'clients': args.clients,
+        'rate': args.rate,
+        'size': args.size,
+        'duration': args.duration,
+        'auth': args.auth,
+        'settings': args.set,
+        'poll': args.poll,
+        'sent': total.value,
+        'lines': len(latencies),
+        'irc messages': messages,
+        'lines/s': round(len(latencies) / elapsed, 1) if elapsed else 0,
+        'latency p50 (ms)': round(percentile(latencies, 0.5) * 1000, 2),
+        'latency p99 (ms)': round(percentile(latencies, 0.99) * 1000, 2),
+        'latency max (ms)':
+            round(latencies[-1] * 1000, 2) if latencies else 0,
+    }
+    for pid in pids:
+        name = 'main' if pid == bot.pid else 'io_process %d' % pid
+        results[name + ' cpu (s)'] = round(after[pid][0] - before[pid][0], 2)
+        results[name + ' rss (kB)'] = after[pid][1]
+    return results
+
+
+def main():
+    ''' Indeed: main function. '''
+    parser = argparse.ArgumentParser(
+        description = 'End-to-end irccat load generator.')
+    parser.add_argument('--clients', type = int, default = 4,
+                        help = 'Number of concurrent clients.')
+    parser.add_argument('--rate', type = float, default = 100,
+                        help = 'Lines/s sent by each client, 0: no limit.')
+    parser.add_argument('--size', type = int, default = 80,
+                        help = 'Line size in bytes.')
+    parser.add_argument('--duration', type = float, default = 10,
+                        help = 'Time (s) clients send.')
+    parser.add_argument('--drain', type = float, default = 2,
+                        help = 'Time (s) waiting for lines in flight.')
+    parser.add_argument('--auth', action = 'store_true',
+                        help = 'Use AUTH handshake instead of per-line'
+                               ' passwords.')
+    parser.add_argument('--poll', type = float, default = 1.0,
+                        help = 'supybot.drivers.poll, bounds the time'
+                               ' lines wait in the bot\'s irc queue.')
+    parser.add_argument('--port', type = int, default = 23498,
+                        help = 'Port the plugin listens to.')
+    parser.add_argument('--set', action = 'append', default = [],
+                        metavar = 'OPTION=VALUE',
+                        help = 'Set plugins.irccat option, repeatable.')
+    parser.add_argument('--supybot', default = 'supybot',
+                        help = 'supybot executable.')
+    parser.add_argument('--output', help = 'Save results as json here.')
+    args = parser.parse_args()
+    results = run(args)
+    benchlib.report('loadgen', results)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent = 4, sort_keys = True)
+
+
+if __name__ == '__main__':
+    main()
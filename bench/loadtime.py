@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+'''
+Plugin load and reload time, and the memory used by the bot's main
+process.
+
+Usage: bench/loadtime.py [reloads] [backend]
+
+The plugin runs without a bot. Load is the time to import the plugin
+in a fresh process, create the plugin instance and get a first line
+through the listener process into the main process. Reload repeats
+this as @reload does: die(), reload(plugin) and a new instance, with
+the line sent as soon as the old instance is gone. RSS is the main
+process' after loading, minus the one before importing the plugin
+i. e., what the plugin adds to the bot. Likewise for the number of
+imported modules.
+'''
+
+import crypt
+import importlib
+import os
+import os.path
+import socket
+import sys
+import threading
+import tempfile
+import time
+
+import benchlib
+
+PORT = 23496
+
+
+def send_line():
+    ''' Send a line to the plugin, retrying while the port is closed. '''
+    start = time.time()
+    while time.time() - start < 10:
+        try:
+            s = socket.create_connection(('127.0.0.1', PORT))
+            s.sendall(b'bench;benchpw;Build 4711 completed OK\n')
+            s.close()
+            return
+        except socket.error:
+            time.sleep(0.01)
+    raise RuntimeError("Plugin doesn't listen to port %d" % PORT)
+
+
+def wait_queued(callback, count):
+    ''' Wait until callback has queued count lines. '''
+    start = time.time()
+    while callback.metrics.count('queued', 'bench') < count:
+        if time.time() - start > 10:
+            raise RuntimeError("No line from listener process")
+        time.sleep(0.001)
+
+
+def main():
+    ''' Indeed: main function. '''
+    reloads = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    backend = sys.argv[2] if len(sys.argv) > 2 else 'twisted'
+    for module in ('supybot.callbacks', 'supybot.commands', 'supybot.conf'):
+        importlib.import_module(module)         # Loaded by the bot.
+    rss_before = benchlib.proc_stats(os.getpid())[1]
+    modules_before = len(sys.modules)
+    start = time.time()
+    config = benchlib.load_plugin('config')
+    config.global_option('port').setValue(PORT)
+    config.global_option('interface').setValue('127.0.0.1')
+    config.global_option('backend').setValue(backend)
+    config.global_option('sectionspath').setValue(
+        os.path.join(tempfile.mkdtemp(), 'sections.pickle'))
+    plugin = benchlib.load_plugin()
+    import_time = time.time() - start
+    plugin._Config().update('bench', crypt.crypt('benchpw', 'ab'),
+                            ['#bench'])
+    callback = plugin.Class(None)
+    send_line()
+    wait_queued(callback, 1)
+    load_time = time.time() - start
+    rss = benchlib.proc_stats(os.getpid())[1] - rss_before
+    modules = len(sys.modules) - modules_before
+
+    times = []
+    for i in range(reloads):                    # pylint: disable=W0612
+        start = time.time()
+        callback.die()
+        sender = threading.Thread(target = send_line)
+        sender.start()
+        importlib.reload(plugin)
+        callback = plugin.Class(None)
+        wait_queued(callback, 1)
+        times.append(time.time() - start)
+        sender.join()
+    callback.die()
+    times.sort()
+    benchlib.report('loadtime', {
+        'backend': backend,
+        'import (ms)': round(import_time * 1000, 1),
+        'load (ms)': round(load_time * 1000, 1),
+        'reload p50 (ms)': round(times[len(times) // 2] * 1000, 1),
+        'reload max (ms)': round(times[-1] * 1000, 1),
+        'main rss (kB)': rss,
+        'main modules': modules,
+    })
+
+
+if __name__ == '__main__':
+    main()
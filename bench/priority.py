@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+'''
+Alert latency while bulk traffic saturates the relay.
+
+Usage: bench/priority.py [seconds] [send rate] [ircqueue]
+
+The plugin runs without a bot, as in loadtime.py, with a fake network
+whose send queue drains at send rate messages/s as supybot's
+throttleTime does. Eight bulk sections send lines on persistent
+connections at twice the send rate, while an alert section sends a
+line each 0.2s in a new connection. Alert latency is the time from
+sending an alert until the network takes it from its send queue.
+
+The phases are: no bulk traffic; bulk with ircqueue 0, i. e., all
+messages queued to the bot at once; bulk with alerts sharing the bulk
+sections' 'normal' priority; and bulk with 'high' priority alerts.
+The last two use the given ircqueue, 5 by default.
+Bulk lines/s is what the network sent of the bulk sections, showing
+that they use the capacity left by the alerts.
+'''
+
+import crypt
+import os
+import os.path
+import socket
+import sys
+import tempfile
+import threading
+import time
+
+import benchlib
+
+from supybot import irclib
+from supybot import world
+
+PORT = 23493
+BULK = ['bulk%d' % i for i in range(8)]
+
+
+class FakeState(object):
+    ''' The irc state used for routing. '''
+
+    channels = {'#bench': None}
+
+
+class FakeIrc(threading.Thread):
+    '''
+    A network draining its send queue at rate messages/s, through the
+    plugin's outFilter. Records when alerts are sent, and the number
+    of other messages.
+    '''
+
+    def __init__(self, callback, rate):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.callback = callback
+        self.rate = rate
+        self.queue = irclib.IrcMsgQueue()
+        self.state = FakeState()
+        self.alerts = {}
+        self.bulk = 0
+        self.stopped = False
+
+    def queueMsg(self, msg):
+        ''' Add msg to send queue, as irclib.Irc. '''
+        self.queue.enqueue(msg)
+
+    def run(self):
+        while not self.stopped:
+            time.sleep(1.0 / self.rate)
+            msg = self.queue.dequeue()
+            if not msg:
+                continue
+            self.callback.outFilter(self, msg)
+            if msg.args[1].startswith('alert '):
+                self.alerts[msg.args[1]] = time.time()
+            else:
+                self.bulk += 1
+
+
+def send_bulk(stopped, rate):
+    ''' Send rate lines/s to each bulk section until stopped is set. '''
+    socks = []
+    for section in BULK:
+        s = socket.create_connection(('127.0.0.1', PORT))
+        s.sendall(('AUTH %s benchpw\n' % section).encode())
+        socks.append(s)
+    i = 0
+    start = time.time()
+    while not stopped.is_set():
+        for s in socks:
+            s.sendall(('Compiling module %d\n' % i).encode())
+        i += 1
+        time.sleep(max(start + i / float(rate) - time.time(), 0))
+    for s in socks:
+        s.close()
+
+
+def phase(plugin, seconds, send_rate, bulk, ircqueue, priority):
+    '''
+    Run the plugin for seconds with bulk traffic or not, return (alert
+    latencies, bulk lines/s).
+    '''
+    config = benchlib.load_plugin('config')
+    config.global_option('ircqueue').setValue(ircqueue)
+    cfg = plugin._Config()
+    cfg.update('alert', crypt.crypt('benchpw', 'ab'), ['#bench'],
+               priority = priority)
+    for section in BULK:
+        cfg.update(section, crypt.crypt('benchpw', 'ab'), ['#bench'])
+    cfg.close()
+    callback = plugin.Class(None)
+    irc = FakeIrc(callback, send_rate)
+    world.ircs.append(irc)
+    irc.start()
+    stopped = threading.Event()
+    sender = threading.Thread(target = send_bulk,
+                              args = (stopped, 2 * send_rate / len(BULK)))
+    if bulk:
+        sender.start()
+    sent = {}
+    start = time.time()
+    while time.time() - start < seconds:
+        text = 'alert %d' % len(sent)
+        sent[text] = time.time()
+        s = socket.create_connection(('127.0.0.1', PORT))
+        s.sendall(('alert;benchpw;%s\n' % text).encode())
+        s.close()
+        time.sleep(0.2)
+    bulk_rate = irc.bulk / (time.time() - start)
+    stopped.set()
+    if bulk:
+        sender.join()
+    while len(irc.alerts) < len(sent):
+        if time.time() - start > seconds + 120:
+            raise RuntimeError("Alerts not sent")
+        time.sleep(0.1)
+    callback.die()
+    irc.stopped = True
+    world.ircs.remove(irc)
+    return sorted([irc.alerts[t] - sent[t] for t in sent]), bulk_rate
+
+
+def main():
+    ''' Indeed: main function. '''
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 5
+    send_rate = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+    ircqueue = int(sys.argv[3]) if len(sys.argv) > 3 else 5
+    config = benchlib.load_plugin('config')
+    config.global_option('port').setValue(PORT)
+    config.global_option('interface').setValue('127.0.0.1')
+    config.global_option('sectionspath').setValue(
+        os.path.join(tempfile.mkdtemp(), 'sections.pickle'))
+    plugin = benchlib.load_plugin()
+    results = {'seconds': seconds, 'send rate': send_rate,
+               'ircqueue': ircqueue}
+    for name, bulk, queue, priority in [
+            ('idle', False, ircqueue, 'normal'),
+            ('ircqueue 0', True, 0, 'normal'),
+            ('normal', True, ircqueue, 'normal'),
+            ('high', True, ircqueue, 'high')]:
+        latencies, bulk_rate = \
+            phase(plugin, seconds, send_rate, bulk, queue, priority)
+        results[name + ' alert p50 (ms)'] = \
+            round(latencies[len(latencies) // 2] * 1000, 1)
+        results[name + ' alert max (ms)'] = round(latencies[-1] * 1000, 1)
+        if bulk:
+            results[name + ' bulk lines/s'] = round(bulk_rate)
+    benchlib.report('priority', results)
+
+
+if __name__ == '__main__':
+    main()
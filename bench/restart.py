@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+'''
+Relay downtime when the listener process dies under load.
+
+Usage: bench/restart.py [kills] [backend]
+
+The plugin runs without a bot, as in loadtime.py. A client thread
+sends a line every millisecond, each on a new connection. The
+listener process is killed repeatedly, each time once it has been up
+long enough to be restarted without backoff. The downtime is the time
+from the kill until the plugin's main process gets the first line sent
+after it. Lines accepted by the killed process but not yet sent to
+main are lost, and counted.
+'''
+
+import crypt
+import os
+import os.path
+import signal
+import socket
+import sys
+import tempfile
+import threading
+import time
+
+import benchlib
+
+PORT = 23494
+
+
+class Sender(threading.Thread):
+    ''' Send numbered lines until stopped, recording when. '''
+
+    def __init__(self):
+        threading.Thread.__init__(self)
+        self.sent = {}
+        self.stopped = False
+
+    def run(self):
+        i = 0
+        while not self.stopped:
+            text = 'line %d' % i
+            self.sent[text] = time.time()
+            try:
+                s = socket.create_connection(('127.0.0.1', PORT))
+                s.sendall(('bench;benchpw;%s\n' % text).encode())
+                s.close()
+            except socket.error:
+                pass
+            i += 1
+            time.sleep(0.001)
+
+
+def main():
+    ''' Indeed: main function. '''
+    kills = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    backend = sys.argv[2] if len(sys.argv) > 2 else 'twisted'
+    config = benchlib.load_plugin('config')
+    config.global_option('port').setValue(PORT)
+    config.global_option('interface').setValue('127.0.0.1')
+    config.global_option('backend').setValue(backend)
+    config.global_option('sectionspath').setValue(
+        os.path.join(tempfile.mkdtemp(), 'sections.pickle'))
+    plugin = benchlib.load_plugin()
+    plugin._Config().update('bench', crypt.crypt('benchpw', 'ab'),
+                            ['#bench'])
+    callback = plugin.Class(None)
+    received = {}
+
+    def schedule(section, msg, channels, stamp):
+        ''' Record when msg arrives, instead of sending it to irc. '''
+        received[msg] = time.time()
+
+    callback._schedule = schedule
+    sender = Sender()
+    sender.start()
+    downtimes = []
+    for i in range(kills):                      # pylint: disable=W0612
+        time.sleep(plugin._Worker.StableTime + 1)
+        killed = time.time()
+        os.kill(callback.processes[0].pid, signal.SIGKILL)
+        while len(downtimes) <= i:
+            if time.time() - killed > 30:
+                raise RuntimeError("No line after restart")
+            after = [t for msg, t in received.copy().items()
+                     if sender.sent[msg] > killed]
+            if after:
+                downtimes.append(min(after) - killed)
+            time.sleep(0.001)
+    sender.stopped = True
+    sender.join()
+    time.sleep(1)
+    callback.die()
+    downtimes.sort()
+    benchlib.report('restart', {
+        'backend': backend,
+        'kills': kills,
+        'downtime p50 (ms)': round(downtimes[len(downtimes) // 2] * 1000, 1),
+        'downtime max (ms)': round(downtimes[-1] * 1000, 1),
+        'lines sent': len(sender.sent),
+        'lines lost': len(sender.sent) - len(received),
+    })
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,186 @@
+#!/usr/bin/env python
+'''
+Per-message cost of the listener transports: a TCP connection per
+message as sent by irccat, a Unix socket connection per message and a
+UDP datagram per message, and HTTP webhook requests on a kept-alive
+connection with one and with 100 lines each. A persistent TCP
+connection, one line per message, is included as reference.
+
+Usage: bench/transports.py [messages] [backend]
+
+One listener process serves all transports, with batching disabled.
+For each transport the messages are sent one at a time, waiting for
+each to be delivered to the main process end of the pipe before
+sending the next. Reported per message are this round trip time, and
+the CPU time used by the listener and by the main process i. e., the
+sender. UDP messages not delivered within a second are counted as lost.
+'''
+
+import crypt
+import json
+import multiprocessing
+import os
+import os.path
+import select
+import socket
+import sys
+import tempfile
+import time
+
+import benchlib
+
+try:
+    from http.client import HTTPConnection
+except ImportError:
+    from httplib import HTTPConnection
+
+PORT = 23495
+LINE = b'bench;benchpw;Build 4711 completed OK\n'
+
+
+class Tcp(object):
+    ''' Send a message in a new TCP connection, as irccat does. '''
+
+    lines = 1             # Messages per send().
+
+    def send(self):
+        ''' Send a message. '''
+        s = socket.create_connection(('127.0.0.1', PORT))
+        s.sendall(LINE)
+        s.close()
+
+    def close(self):
+        ''' Release resources. '''
+
+
+class TcpSession(Tcp):
+    ''' Send a line in a persistent TCP connection. '''
+
+    def __init__(self):
+        self.sock = socket.create_connection(('127.0.0.1', PORT))
+
+    def send(self):
+        self.sock.sendall(LINE)
+
+    def close(self):
+        self.sock.close()
+
+
+class Unix(Tcp):
+    ''' Send a message in a new Unix socket connection. '''
+
+    def __init__(self, path):
+        self.path = path
+
+    def send(self):
+        s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        s.connect(self.path)
+        s.sendall(LINE)
+        s.close()
+
+
+class Udp(TcpSession):
+    ''' Send a message as a datagram. '''
+
+    def __init__(self):                    # pylint: disable=W0231
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def send(self):
+        self.sock.sendto(LINE, ('127.0.0.1', PORT))
+
+
+class Http(Tcp):
+    ''' Send lines messages per webhook request. '''
+
+    def __init__(self, lines):
+        self.lines = lines
+        self.conn = HTTPConnection('127.0.0.1', PORT + 1)
+        text = LINE.decode().split(';')[2]
+        self.body = json.dumps({'section': 'bench', 'token': 'benchpw',
+                                'lines': [text] * lines})
+
+    def send(self):
+        self.conn.request('POST', '/', self.body)
+        self.conn.getresponse().read()
+
+    def close(self):
+        self.conn.close()
+
+
+def run(pipe, pid, sender, messages):
+    '''
+    Return (round trip, listener cpu, sender cpu) s per message and the
+    number of lost messages when sending using sender.
+    '''
+    cpu_before = benchlib.proc_stats(pid)[0]
+    times_before = os.times()
+    start = time.time()
+    lost = 0
+    for i in range(messages // sender.lines):   # pylint: disable=W0612
+        sender.send()
+        received = 0
+        while received < sender.lines:
+            if not select.select([pipe[1]], [], [], 1)[0]:
+                lost += sender.lines - received
+                break
+            kind, data = pipe[1].recv()
+            if kind == 'lines':
+                received += len(data[1])
+    elapsed = time.time() - start
+    times = os.times()
+    sender.close()
+    cpu = benchlib.proc_stats(pid)[0] - cpu_before
+    sender_cpu = times[0] + times[1] - times_before[0] - times_before[1]
+    return elapsed / messages, cpu / messages, sender_cpu / messages, lost
+
+
+def main():
+    ''' Indeed: main function. '''
+    messages = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    backend = sys.argv[2] if len(sys.argv) > 2 else 'twisted'
+    plugin = benchlib.load_plugin()
+    config = benchlib.load_plugin('config')
+    tmpdir = tempfile.mkdtemp()
+    path = os.path.join(tmpdir, 'irccat.sock')
+    config.global_option('sectionspath').setValue(
+        os.path.join(tmpdir, 'sections.pickle'))
+    config.global_option('batchwindow').setValue(0)
+    cfg = plugin._Config()
+    cfg.update('bench', crypt.crypt('benchpw', 'ab'), ['#bench'])
+    socks = [('tcp', plugin._listen_socket('tcp', ('127.0.0.1', PORT))),
+             ('unix', plugin._listen_socket('unix', path)),
+             ('udp', plugin._listen_socket('udp', ('127.0.0.1', PORT))),
+             ('http', plugin._listen_socket('http',
+                                            ('127.0.0.1', PORT + 1)))]
+    pipe = multiprocessing.Pipe()
+    pipe[1].send(cfg)
+    process = multiprocessing.Process(target = plugin._io_process,
+                                      args = (plugin._BACKENDS[backend],
+                                              socks, pipe, ()))
+    process.start()
+    benchlib.wait_for_port(PORT, 10)
+
+    results = {'messages': messages, 'backend': backend}
+    for name, sender in [('tcp', Tcp()),
+                         ('tcp session', TcpSession()),
+                         ('unix', Unix(path)),
+                         ('udp', Udp()),
+                         ('http', Http(1)),
+                         ('http batch', Http(100))]:
+        elapsed, cpu, sender_cpu, lost = \
+            run(pipe, process.pid, sender, messages)
+        results[name + ' round trip (us)'] = round(elapsed * 1e6, 1)
+        results[name + ' listener cpu (us)'] = round(cpu * 1e6, 1)
+        results[name + ' sender cpu (us)'] = round(sender_cpu * 1e6, 1)
+        if name == 'udp':
+            results[name + ' lost'] = lost
+    process.terminate()
+    process.join()
+    for kind, sock in socks:                    # pylint: disable=W0612
+        sock.close()
+    os.unlink(path)
+    benchlib.report('transports', results)
+
+
+if __name__ == '__main__':
+    main()
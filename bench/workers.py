@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+'''
+Throughput of the listener processes as function of the number of
+workers sharing the listening socket.
+
+Usage: bench/workers.py [clients] [lines per client] [max workers]
+
+The password cache is disabled, so each line costs a crypt() call
+as for a client using many different sections. Lines not received
+within TIMEOUT seconds are reported as lost.
+'''
+
+import crypt
+import multiprocessing
+import os
+import select
+import shutil
+import socket
+import sys
+import tempfile
+import time
+
+import benchlib
+
+PORT = 23499
+BACKEND = 'twistedio'
+TIMEOUT = 60          # Max time waiting for all lines.
+
+
+def client(lines):
+    ''' Send lines lines in one connection. '''
+    s = socket.create_connection(('127.0.0.1', PORT))
+    s.sendall(b'bench;benchpw;Build 4711 completed OK\n' * lines)
+    s.close()
+
+
+def run(plugin, workers, clients, lines):
+    '''
+    Return (lines/s, lines lost) using given number of workers. Lines
+    not received within TIMEOUT are lost.
+    '''
+    cfg = plugin._Config()
+    sock = plugin._listen_socket('tcp', ('127.0.0.1', PORT))
+    pipes = []
+    processes = []
+    received = 0
+    try:
+        for i in range(workers):
+            pipe = multiprocessing.Pipe()
+            pipe[1].send(cfg)
+            process = multiprocessing.Process(
+                target = plugin._io_process,
+                args = (BACKEND, [('tcp', sock)], pipe, ()))
+            process.start()
+            pipes.append(pipe)
+            processes.append(process)
+        time.sleep(1)
+
+        start = time.time()
+        for i in range(clients):
+            sender = multiprocessing.Process(target = client, args = (lines,))
+            sender.start()
+            processes.append(sender)
+        conns = [pipe[1] for pipe in pipes]
+        deadline = start + TIMEOUT
+        while received < clients * lines and time.time() < deadline:
+            for conn in select.select(conns, [], [], 1)[0]:
+                kind, data = conn.recv()
+                if kind == 'lines':
+                    received += len(data[1])
+        elapsed = time.time() - start
+    finally:
+        for process in processes:
+            process.terminate()
+            process.join()
+        for pipe in pipes:
+            for conn in pipe:
+                conn.close()
+        sock.close()
+        cfg.close()
+    return received / elapsed, clients * lines - received
+
+
+def main():
+    ''' Indeed: main function. '''
+    clients = int(sys.argv[1]) if len(sys.argv) > 1 else 16
+    lines = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+    maxworkers = int(sys.argv[3]) if len(sys.argv) > 3 \
+        else multiprocessing.cpu_count()
+    plugin = benchlib.load_plugin()
+    config = benchlib.load_plugin('config')
+    tmpdir = tempfile.mkdtemp()
+    try:
+        config.global_option('sectionspath').setValue(
+            os.path.join(tmpdir, 'sections.pickle'))
+        config.global_option('authcache').setValue(0)
+        cfg = plugin._Config()
+        try:
+            cfg.update('bench', crypt.crypt('benchpw', 'ab'), ['#bench'])
+        finally:
+            cfg.close()
+        results = {'clients': clients, 'lines per client': lines}
+        workers = 1
+        while workers <= maxworkers:
+            rate, lost = run(plugin, workers, clients, lines)
+            results['%d workers (lines/s)' % workers] = round(rate)
+            results['%d workers (lines lost)' % workers] = lost
+            workers *= 2
+    finally:
+        shutil.rmtree(tmpdir, True)
+    benchlib.report('workers', results)
+
+
+if __name__ == '__main__':
+    main()
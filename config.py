@@ -53,10 +53,54 @@ def global_option(option):
 # conf.registerGlobalValue(Irccat, 'someConfigVariableName',
 #     registry.Boolean(False, """Help for someConfigVariableName."""))
 
+class OverflowPolicy(registry.OnlySomeStrings):
+    ''' What to do when a section's backlog is full. '''
+    validStrings = ('drop', 'summarize')
+
+
+class SpoolPolicy(registry.OnlySomeStrings):
+    ''' What to do when the listener's spool is full. '''
+    validStrings = ('pause', 'drop')
+
+
+class Backend(registry.OnlySomeStrings):
+    ''' Listener implementation. '''
+    validStrings = ('twisted', 'asyncio')
+
+
+class FileMode(registry.String):
+    ''' Octal file permissions, e. g. 0660. '''
+    errormsg = 'Value must be octal file permissions, not %r.'
+
+    def setValue(self, v):
+        try:
+            int(v, 8)
+        except ValueError:
+            self.error(v)
+        registry.String.setValue(self, v)
+
+
+class LongLinePolicy(registry.OnlySomeStrings):
+    ''' What to do with lines longer than maxlinelength. '''
+    validStrings = ('reject', 'truncate')
+
+
+class SectionStore(registry.OnlySomeStrings):
+    ''' Section store backend. '''
+    validStrings = ('sqlite', 'journal')
+
+
 Irccat = conf.registerPlugin('Irccat')
 
 conf.registerGlobalValue(Irccat, 'sectionspath',
-    registry.String('sections.pickle', 'Pickled section data'))
+    registry.String('sections.pickle',
+                    "Section data path. A .pickle suffix is replaced by"
+                    " the store's own one, legacy pickled data found here"
+                    " is migrated to the store."))
+
+conf.registerGlobalValue(Irccat, 'sectionstore',
+    SectionStore('sqlite', "How section data is stored: in a sqlite"
+                           " database or in an append-only journal."))
 
 conf.registerGlobalValue(Irccat, 'port',
     registry.NonNegativeInteger(12345,
@@ -66,7 +110,186 @@ conf.registerGlobalValue(Irccat, 'interface',
     registry.String("127.0.0.1",
                     "The address irccat will bind to."))
 
+conf.registerGlobalValue(Irccat, 'unixsocket',
+    registry.String('',
+                    "Path of a Unix socket irccat also listens to, for"
+                    " senders on the same host. Empty disables."))
+
+conf.registerGlobalValue(Irccat, 'unixsocketmode',
+    FileMode('0660', "Permissions of the Unix socket, controlling which"
+                     " local users may send."))
+
+conf.registerGlobalValue(Irccat, 'udpport',
+    registry.NonNegativeInteger(0,
+                                "UDP port on interface irccat also listens"
+                                " to, one line per datagram. 0 disables."))
+
+conf.registerGlobalValue(Irccat, 'httpport',
+    registry.NonNegativeInteger(0,
+                                "Port on interface irccat also listens to"
+                                " for HTTP webhooks with JSON bodies. 0"
+                                " disables."))
+
+conf.registerGlobalValue(Irccat, 'httpmaxbody',
+    registry.PositiveInteger(1048576,
+                             "Max size (bytes) of a webhook request body."))
+
+conf.registerGlobalValue(Irccat, 'workers',
+    registry.PositiveInteger(1,
+                             "Number of listener processes sharing the"
+                             " listening socket."))
+
+conf.registerGlobalValue(Irccat, 'backend',
+    Backend('twisted', "Listener process implementation: twisted or, on"
+                       " Python 3, asyncio."))
+
+conf.registerGlobalValue(Irccat, 'maxconnections',
+    registry.NonNegativeInteger(1000,
+                                "Max number of connections to each listener"
+                                " process. 0 means no limit."))
+
+conf.registerGlobalValue(Irccat, 'maxhostconnections',
+    registry.NonNegativeInteger(100,
+                                "Max number of connections from one host or,"
+                                " on the Unix socket, user to each listener"
+                                " process. 0 means no limit."))
+
+conf.registerGlobalValue(Irccat, 'idletimeout',
+    registry.NonNegativeInteger(600,
+                                "Time (s) after which a connection without"
+                                " input is closed. 0 disables."))
+
+conf.registerGlobalValue(Irccat, 'handshaketimeout',
+    registry.NonNegativeInteger(10,
+                                "Time (s) a client has after connecting to"
+                                " send a first valid line, AUTH handshake or"
+                                " webhook request. 0 disables."))
+
+conf.registerGlobalValue(Irccat, 'maxlinelength',
+    registry.PositiveInteger(16384,
+                             "Max length (bytes) of an input line."))
+
+conf.registerGlobalValue(Irccat, 'longlines',
+    LongLinePolicy('reject', "What to do with lines longer than"
+                             " maxlinelength: reject them, closing the"
+                             " connection, or truncate them."))
+
+conf.registerGlobalValue(Irccat, 'hostbuffer',
+    registry.NonNegativeInteger(4194304,
+                                "Max bytes buffered by a listener process"
+                                " for incomplete lines and requests from one"
+                                " host. Connections from a host exceeding it"
+                                " are closed. 0 means no limit."))
+
+conf.registerGlobalValue(Irccat, 'metricsport',
+    registry.NonNegativeInteger(0,
+                                "Local port serving metrics in Prometheus"
+                                " format at http://127.0.0.1:<port>/metrics."
+                                " 0 disables."))
+
+conf.registerGlobalValue(Irccat, 'tracing',
+    registry.Boolean(False, "Trace each message until it's sent to the irc"
+                            " server, keeping per-stage latencies and a log"
+                            " of the slowest messages (see sectionslow)."))
+
+conf.registerGlobalValue(Irccat, 'slowlog',
+    registry.PositiveInteger(10, "Number of messages kept in the slow"
+                                 " message log when tracing."))
+
 conf.registerGlobalValue(Irccat, 'privmsg',
     registry.Boolean(False, 'Use privmsgs instead of the default notices'))
 
+conf.registerGlobalValue(Irccat, 'failmax',
+    registry.PositiveInteger(8, "Number of consecutive bad lines from a"
+                                " host before it's blacklisted."))
+
+conf.registerGlobalValue(Irccat, 'blocktime',
+    registry.PositiveInteger(500, "Time (s) a host is blacklisted."))
+
+conf.registerGlobalValue(Irccat, 'subnetmax',
+    registry.NonNegativeInteger(4, "Number of blacklisted hosts in a /24"
+                                   " (IPv4) or /64 (IPv6) subnet before the"
+                                   " whole subnet is blacklisted. 0 disables"
+                                   " subnet blacklisting."))
+
+conf.registerGlobalValue(Irccat, 'authcache',
+    registry.NonNegativeInteger(256,
+                                "Max number of cached password"
+                                " verifications, 0 disables the cache."))
+
+conf.registerGlobalValue(Irccat, 'batchwindow',
+    registry.NonNegativeInteger(5,
+                                "Max time (ms) the listener holds a message"
+                                " to send it together with others to the"
+                                " main process. 0 disables batching."))
+
+conf.registerGlobalValue(Irccat, 'spoolsize',
+    registry.PositiveInteger(10000,
+                             "Max number of lines a listener process holds"
+                             " waiting to be sent to the main process, see"
+                             " spoolpolicy."))
+
+conf.registerGlobalValue(Irccat, 'spoolpolicy',
+    SpoolPolicy('pause', "What to do when a listener's spool is full: stop"
+                         " reading from clients until half of it is sent,"
+                         " or drop new lines."))
+
+conf.registerGlobalValue(Irccat, 'diskspool',
+    registry.String('', "Directory where messages for non-joined channels"
+                        " are kept until the channel is joined, also over"
+                        " restarts. Empty disables, dropping them."))
+
+conf.registerGlobalValue(Irccat, 'diskspoolsize',
+    registry.PositiveInteger(10, "Max size (MB) of the disk spool for each"
+                                 " channel, oldest messages are dropped"
+                                 " first."))
+
+conf.registerGlobalValue(Irccat, 'diskspoolage',
+    registry.PositiveInteger(86400, "Max time (s) a message is kept in the"
+                                    " disk spool."))
+
+conf.registerGlobalValue(Irccat, 'replayrate',
+    registry.PositiveFloat(1.0, "Max number of messages/s replayed from the"
+                                " disk spool, when no live messages are"
+                                " waiting."))
+
+conf.registerGlobalValue(Irccat, 'sectionrate',
+    registry.Float(0, "Max number of messages/s sent for each section,"
+                      " 0 means unlimited."))
+
+conf.registerGlobalValue(Irccat, 'sectionburst',
+    registry.PositiveInteger(10, "Number of messages a section can send"
+                                 " in a burst before sectionrate applies."))
+
+conf.registerGlobalValue(Irccat, 'channelrate',
+    registry.Float(0, "Max number of messages/s sent to each channel,"
+                      " 0 means unlimited."))
+
+conf.registerGlobalValue(Irccat, 'channelburst',
+    registry.PositiveInteger(10, "Number of messages sent to a channel"
+                                 " in a burst before channelrate applies."))
+
+conf.registerGlobalValue(Irccat, 'coalesce',
+    registry.SpaceSeparatedListOfStrings([],
+        "Sections whose lines are joined into fewer irc messages when"
+        " sent in bursts. Overlong lines in these sections are split."))
+
+conf.registerGlobalValue(Irccat, 'backlog',
+    registry.PositiveInteger(1000, "Max number of messages queued for a"
+                                   " section waiting for flood control."))
+
+conf.registerGlobalValue(Irccat, 'overflow',
+    OverflowPolicy('summarize', "What to do with messages when a section's"
+                                " backlog is full: drop them silently, or"
+                                " summarize them with a 'N more lines"
+                                " suppressed' message."))
+
+conf.registerGlobalValue(Irccat, 'ircqueue',
+    registry.NonNegativeInteger(0, "Max number of our messages waiting in"
+                                   " the bot's send queue for each network,"
+                                   " e. g. 5. Further messages for that"
+                                   " network wait in the backlog, where"
+                                   " higher priority sections go first. 0"
+                                   " means unlimited."))
+
 # vim:set shiftwidth=4 tabstop=4 expandtab textwidth=79:
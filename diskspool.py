@@ -0,0 +1,212 @@
+###
+# Copyright (c) 2013, Alec Leamas
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice,
+#     this list of conditions, and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice,
+#     this list of conditions, and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#   * Neither the name of the author of this software nor the name of
+#     contributors to this software may be used to endorse or promote products
+#     derived from this software without specific prior written consent.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+'''
+Durable per-channel spool for messages which can't be delivered, kept
+on disk until the channel is joined and they are replayed.
+
+Each channel has a directory holding append-only segment files, named
+by sequence number, with one json record [time, section, msg] per
+line. A cursor file records how far the replay has come. Segments are
+removed when replayed, and the oldest ones when the channel's size
+exceeds maxbytes. Records older than maxage are never replayed.
+
+Records are flushed to the OS when written, and fsync()'d when a
+segment is closed. A truncated last line after a crash is skipped.
+'''
+
+import binascii
+import json
+import os
+import os.path
+import time
+
+
+class DiskSpool(object):
+    ''' Spooled messages for all channels in a directory. '''
+
+    SegmentSize = 1024 * 1024       # Segment size (bytes) before rotating.
+
+    def __init__(self, path, maxbytes, maxage):
+        self.path = path
+        self.maxbytes = maxbytes
+        self.maxage = maxage
+        self._writers = {}
+        self._sizes = {}
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+    def _dir(self, channel):
+        ''' Return directory for channel. '''
+        name = binascii.hexlify(channel.encode('utf-8')).decode('ascii')
+        return os.path.join(self.path, name)
+
+    def _segments(self, channel):
+        ''' Return sorted list of segment numbers for channel. '''
+        try:
+            names = os.listdir(self._dir(channel))
+        except OSError:
+            return []
+        return sorted([int(n[:-4]) for n in names if n.endswith('.log')])
+
+    def _segment(self, channel, seq):
+        ''' Return path to segment seq of channel. '''
+        return os.path.join(self._dir(channel), '%010d.log' % seq)
+
+    def _size(self, channel):
+        ''' Return total size of channel's segments. '''
+        if channel not in self._sizes:
+            self._sizes[channel] = sum(
+                [os.path.getsize(self._segment(channel, seq))
+                     for seq in self._segments(channel)])
+        return self._sizes[channel]
+
+    def _close_writer(self, channel):
+        ''' Sync and close channel's current segment, if any. '''
+        writer = self._writers.pop(channel, None)
+        if writer:
+            writer[1].flush()
+            os.fsync(writer[1].fileno())
+            writer[1].close()
+
+    def _remove(self, channel, seq):
+        ''' Remove segment seq of channel. '''
+        if channel in self._writers and self._writers[channel][0] == seq:
+            self._close_writer(channel)
+        path = self._segment(channel, seq)
+        self._sizes[channel] = self._size(channel) - os.path.getsize(path)
+        os.unlink(path)
+
+    def _trim(self, channel):
+        ''' Remove oldest segments while channel is too big or too old. '''
+        segments = self._segments(channel)
+        limit = time.time() - self.maxage
+        for seq in segments[:-1]:
+            path = self._segment(channel, seq)
+            if self._size(channel) <= self.maxbytes \
+                    and os.path.getmtime(path) >= limit:
+                break
+            self._remove(channel, seq)
+
+    def append(self, channel, section, msg, when):
+        ''' Spool msg from section, received at time when, for channel. '''
+        if channel not in self._writers:
+            segments = self._segments(channel)
+            seq = segments[-1] + 1 if segments else 0
+            if not segments and not os.path.isdir(self._dir(channel)):
+                os.mkdir(self._dir(channel))
+            self._writers[channel] = \
+                (seq, open(self._segment(channel, seq), 'a'))
+        seq, f = self._writers[channel]
+        record = json.dumps([when, section, msg]) + '\n'
+        f.write(record)
+        f.flush()
+        self._sizes[channel] = self._size(channel) + len(record)
+        if f.tell() >= min(self.SegmentSize, self.maxbytes // 4 + 1):
+            self._close_writer(channel)
+        if self._size(channel) > self.maxbytes:
+            self._trim(channel)
+
+    def _cursor(self, channel):
+        ''' Return replay position (segment, offset) for channel. '''
+        try:
+            with open(os.path.join(self._dir(channel), 'cursor')) as f:
+                seq, offset = f.read().split()
+            return int(seq), int(offset)
+        except (IOError, OSError, ValueError):
+            return -1, 0
+
+    def _save_cursor(self, channel, seq, offset):
+        ''' Atomically store replay position for channel. '''
+        path = os.path.join(self._dir(channel), 'cursor')
+        with open(path + '.tmp', 'w') as f:
+            f.write('%d %d\n' % (seq, offset))
+        os.rename(path + '.tmp', path)
+
+    def take(self, channel, count):
+        '''
+        Return up to count of the oldest (time, section, msg) spooled
+        for channel, removing them from the spool.
+        '''
+        self._trim(channel)
+        limit = time.time() - self.maxage
+        cursor, offset = self._cursor(channel)
+        taken = []
+        for seq in self._segments(channel):
+            if seq < cursor:
+                self._remove(channel, seq)
+                continue
+            if seq > cursor:
+                offset = 0
+            with open(self._segment(channel, seq)) as f:
+                f.seek(offset)
+                while len(taken) < count:
+                    line = f.readline()
+                    if not line.endswith('\n'):
+                        break
+                    offset += len(line)
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue
+                    if record[0] >= limit:
+                        taken.append(tuple(record))
+            cursor = seq
+            if len(taken) >= count:
+                break
+            self._remove(channel, seq)
+        if self._segments(channel):
+            self._save_cursor(channel, cursor, offset)
+        else:
+            self._clear(channel)
+        return taken
+
+    def _clear(self, channel):
+        ''' Remove the directory of a channel without segments. '''
+        self._close_writer(channel)
+        self._sizes.pop(channel, None)
+        path = self._dir(channel)
+        for name in os.listdir(path):
+            os.unlink(os.path.join(path, name))
+        os.rmdir(path)
+
+    def channels(self):
+        ''' Return list of channels with spooled messages. '''
+        channels = []
+        for name in os.listdir(self.path):
+            try:
+                channel = binascii.unhexlify(name.encode('ascii'))
+                channels.append(channel.decode('utf-8'))
+            except (binascii.Error, TypeError, ValueError):
+                pass                            # Not ours.
+        return sorted(channels)
+
+    def close(self):
+        ''' Sync and close all open segments. '''
+        for channel in list(self._writers.keys()):
+            self._close_writer(channel)
@@ -0,0 +1,906 @@
+###
+# Copyright (c) 2013, Alec Leamas
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice,
+#     this list of conditions, and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice,
+#     this list of conditions, and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#   * Neither the name of the author of this software nor the name of
+#     contributors to this software may be used to endorse or promote products
+#     derived from this software without specific prior written consent.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+'''
+The transport independent parts of the io_process, shared by the
+listener backends: line framing, section authentication, blacklisting
+and the spool of lines to the main process.
+
+A backend subclasses Listener, implementing call_later() and
+call_from_thread() on its event loop, and mixes Client into its
+protocol class, implementing abort(), close(), pause() and resume()
+on its transport. It feeds received data to Client.data_received(),
+and applies config updates from main process using read_config().
+Likewise, Datagrams handles a UDP socket, fed by datagram_received().
+HttpClient, a Client serving webhooks, also requires write().
+'''
+
+import collections
+import crypt
+import hashlib
+import hmac
+import json
+import os
+import socket
+import struct
+import sys
+import threading
+import time
+
+from supybot import log
+from supybot import world
+
+from . import metrics
+
+
+class Blacklist(object):
+    '''
+    Handles blacklisting of faulty  clients.
+
+    Only hosts with failures are tracked, in insertion-ordered dicts
+    which also are ordered by expiry time. Expired entries are dropped
+    from the front, and the oldest ones are evicted when there are more
+    than MaxHosts. Hosts are blocked after FailMax consecutive failures,
+    and a subnet (/24 or /64) when SubnetMax of its hosts are blocked.
+    '''
+
+    FailMax = 8   # Max # of times
+    BlockTime = 500  # Time we wait in blacklisted state (seconds).
+    SubnetMax = 4    # Blocked hosts in a subnet before blocking it.
+    MaxHosts = 10000  # Max # of tracked hosts.
+
+    def __init__(self, failmax = None, blocktime = None, subnetmax = None):
+        if failmax:
+            self.FailMax = failmax
+        if blocktime:
+            self.BlockTime = blocktime
+        if subnetmax is not None:
+            self.SubnetMax = subnetmax
+        self._fails = collections.OrderedDict()    # host -> (count, when)
+        self._blocked = collections.OrderedDict()  # host -> when
+        self._nets = collections.OrderedDict()     # subnet -> when
+        self._netcount = {}                         # subnet -> # blocked
+        self.log = log.getPluginLogger('irccat.blacklist')
+
+    @staticmethod
+    def _subnet(host):
+        ''' Return the /24 or /64 subnet containing host. '''
+        if ':' in host:
+            try:
+                return socket.inet_pton(socket.AF_INET6, host)[:8]
+            except (socket.error, ValueError):
+                return host
+        return host.rpartition('.')[0]
+
+    def _expire(self, now):
+        ''' Drop expired and excess entries from the dicts' fronts. '''
+        for table in (self._fails, self._blocked, self._nets):
+            while table:
+                key, value = next(iter(table.items()))
+                when = value[1] if table is self._fails else value
+                if now - when < self.BlockTime and \
+                        len(table) <= self.MaxHosts:
+                    break
+                del table[key]
+                if table is self._blocked:
+                    self._unblock(key)
+
+    def _unblock(self, host):
+        ''' Update subnet count for host which is no longer blocked. '''
+        net = self._subnet(host)
+        count = self._netcount.pop(net, 0) - 1
+        if count > 0:
+            self._netcount[net] = count
+
+    def _block(self, host, now):
+        ''' Block host, and it's subnet if it has too many blocked. '''
+        self.log.warning("Blacklisting: " + host)
+        self._blocked[host] = now
+        net = self._subnet(host)
+        self._netcount[net] = self._netcount.get(net, 0) + 1
+        if self.SubnetMax and self._netcount[net] == self.SubnetMax:
+            self.log.warning("Blacklisting subnet of: " + host)
+            self._nets[net] = now
+
+    def register(self, host, status):
+        ''' Register an event coming from host (address) being OK/Fail. '''
+        if status:
+            if self._fails:
+                self._fails.pop(host, None)
+            return
+        now = time.time()
+        count = self._fails.pop(host, (0, now))[0] + 1
+        if count >= self.FailMax:
+            if not host in self._blocked:
+                self._block(host, now)
+        else:
+            self._fails[host] = (count, now)
+        self._expire(now)
+
+    def onList(self, host):
+        ''' Return True if host is blacklisted i. e., should be blocked.'''
+        if not self._blocked:
+            return False
+        if not host in self._blocked and \
+                not (self._nets and self._subnet(host) in self._nets):
+            return False
+        self._expire(time.time())
+        return host in self._blocked or self._subnet(host) in self._nets
+
+    def __len__(self):
+        return len(self._fails) + len(self._blocked)
+
+
+class AuthCache(object):
+    '''
+    Bounded LRU cache of successful password verifications.
+
+    crypt() is by design slow, and running it for each line is the main
+    cost in the io_process. Entries are keyed by section and a keyed
+    digest of the cleartext password so no cleartext is kept in memory.
+    Each entry holds the cipher it was verified against, a changed
+    password thus never hits a stale entry.
+    '''
+
+    def __init__(self, size):
+        self.size = size
+        self._key = os.urandom(16)
+        self._entries = collections.OrderedDict()
+
+    def _digest(self, cleartext_pw):
+        ''' Return keyed digest of cleartext_pw. '''
+        return hmac.new(self._key,
+                        cleartext_pw.encode('utf-8'),
+                        hashlib.sha256).digest()
+
+    def verify(self, section, cleartext_pw, cipher_pw):
+        ''' Return True if cleartext_pw matches cipher_pw for section. '''
+        if self.size <= 0:
+            return crypt.crypt(cleartext_pw, cipher_pw) == cipher_pw
+        key = (section, self._digest(cleartext_pw))
+        if self._entries.get(key) == cipher_pw:
+            value = self._entries.pop(key)
+            self._entries[key] = value
+            return True
+        if crypt.crypt(cleartext_pw, cipher_pw) != cipher_pw:
+            return False
+        self._entries[key] = cipher_pw
+        while len(self._entries) > self.size:
+            self._entries.popitem(last = False)
+        return True
+
+    def clear(self):
+        ''' Drop all entries. '''
+        self._entries.clear()
+
+    def discard(self, section):
+        ''' Drop all entries for section, invoked when it's updated. '''
+        for key in [k for k in self._entries.keys() if k[0] == section]:
+            del self._entries[key]
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class Spool(object):
+    '''
+    Bounded queue between the reactor and the pipe to main process. A
+    sender thread does the possibly blocking Connection.send(), so the
+    reactor never blocks on a full pipe. on_full() is invoked when
+    size lines are queued, on_drained() in the sender thread when half
+    of them are sent; the Listener uses them to pause reading or drop
+    lines, and to resume. If the main process is gone the sender thread
+    stops, and later messages pile up until on_full() is invoked.
+    '''
+
+    def __init__(self, conn, size, on_full, on_drained):
+        self.conn = conn
+        self.size = size
+        self.on_full = on_full
+        self.on_drained = on_drained
+        self.lines = 0
+        self.full = False
+        self._queue = collections.deque()
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target = self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    @staticmethod
+    def _count(msg):
+        ''' Return number of lines in a pipe message. '''
+        return len(msg[1][1]) if msg and msg[0] == 'lines' else 0
+
+    def send(self, msg):
+        ''' Queue msg for sending, None stops the sender thread. '''
+        with self._cond:
+            self._queue.append(msg)
+            self.lines += self._count(msg)
+            filled = not self.full and self.lines >= self.size
+            if filled:
+                self.full = True
+            self._cond.notify()
+        if filled:
+            self.on_full()
+
+    def _run(self):
+        ''' Sender thread: send queued messages until None. '''
+        while True:
+            with self._cond:
+                while not self._queue:
+                    self._cond.wait()
+                msg = self._queue.popleft()
+            if msg is None:
+                return
+            try:
+                self.conn.send(msg)
+            except (EOFError, IOError, OSError):
+                return                            # Main process is gone.
+            with self._cond:
+                self.lines -= self._count(msg)
+                drained = self.full and self.lines <= self.size // 2
+                if drained:
+                    self.full = False
+            if drained:
+                self.on_drained()
+
+    def close(self, timeout = None):
+        ''' Send what's queued, then stop the sender thread. '''
+        self.send(None)
+        self._thread.join(timeout)
+
+
+class Batcher(object):
+    '''
+    Collects messages in the io_process and passes them as one list,
+    together with the time sent, to conn, the Spool. A batch is flushed when it
+    has MaxBatch messages, or when the first message in it has waited
+    window milliseconds, using call_later(delay, func) returning a
+    cancellable timer. A window of 0 sends each message at once. Lines
+    of a webhook request go in send_many(), which flushes them together
+    with any partial batch, keeping their order.
+    '''
+
+    MaxBatch = 256
+
+    def __init__(self, conn, window, call_later):
+        self.conn = conn
+        self.window = window / 1000.0
+        self.call_later = call_later
+        self._batch = []
+        self._timer = None
+
+    def send(self, msg):
+        ''' Queue msg, eventually sending it to main process. '''
+        self._batch.append(msg)
+        if len(self._batch) >= self.MaxBatch or self.window <= 0:
+            self.flush()
+        elif not self._timer:
+            self._timer = self.call_later(self.window, self._expired)
+
+    def _expired(self):
+        ''' Timer callback: flush the batch. '''
+        self._timer = None
+        self.flush()
+
+    def send_many(self, msgs):
+        ''' Queue msgs and send them all in one message, now. '''
+        self._batch.extend(msgs)
+        self.flush()
+
+    def flush(self):
+        ''' Send all queued messages. '''
+        if self._timer:
+            self._timer.cancel()
+        self._timer = None
+        if self._batch:
+            batch, self._batch = self._batch, []
+            self.conn.send(('lines', (time.time(), batch)))
+
+
+def peer_host(sock):
+    '''
+    Return the peer of connected stream sock as used by the blacklist:
+    the IP address or, on a Unix socket, the sender's uid:<uid>.
+    '''
+    if sock.family in (socket.AF_INET, socket.AF_INET6):
+        return sock.getpeername()[0]
+    try:
+        creds = sock.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED,
+                                struct.calcsize('3i'))
+    except (AttributeError, socket.error):     # Not Linux.
+        return 'local'
+    return 'uid:%d' % struct.unpack('3i', creds)[1]
+
+
+class Client(object):
+    '''
+    Line protocol: parse line, forward to channel(s).
+
+    Each line is either <section>;<password>;<text> or, as the first
+    line, an AUTH <section> <password> handshake. After a successful
+    handshake all lines are sent verbatim to the section's channels.
+
+    Resource limits are in the listener's config: lines longer than
+    maxlinelength close the connection or are truncated, and a host's
+    connections are closed when buffering too much data. Listener
+    closes clients which are idle or don't authenticate in time.
+    '''
+
+    def __init__(self, listener):
+        self.listener = listener
+        self.host = None
+        self.session = None
+        self.closing = False
+        self.since = None           # Time connected, None if not counted.
+        self.last = None            # Time of last input.
+        self.greeted = False        # Authenticated once.
+        self._buffer = b''
+        self._buffered = 0          # Part of host's buffered bytes.
+        self._skipping = False      # Discarding rest of truncated line.
+        self.log = log.getPluginLogger('irccat.protocol')
+
+    def abort(self):
+        ''' Drop the connection at once. '''
+        raise NotImplementedError
+
+    def close(self):
+        ''' Close the connection after sending pending output. '''
+        raise NotImplementedError
+
+    def pause(self):
+        ''' Stop reading from the connection. '''
+        raise NotImplementedError
+
+    def resume(self):
+        ''' Resume reading after pause(). '''
+        raise NotImplementedError
+
+    def write(self, data):
+        ''' Send data to client, required by HttpClient only. '''
+        raise NotImplementedError
+
+    def opened(self, host):
+        '''
+        Handle new connection from host, unless blacklisted or there are
+        too many connections.
+        '''
+        self.host = host
+        if self.listener.blacklist.onList(host):
+            self.listener.metrics.inc('rejected', 'blacklist')
+            self.closing = True
+            self.abort()
+            return
+        maxconnections, maxhost = self.listener.config.limits[:2]
+        hosts = self.listener.hosts
+        if (maxconnections and self.listener.streams >= maxconnections) \
+                or (maxhost and hosts.get(host, 0) >= maxhost):
+            self.listener.metrics.inc('rejected', 'connections')
+            self.log.warning('Too many connections, refusing: ' + host)
+            self.closing = True
+            self.abort()
+            return
+        hosts[host] = hosts.get(host, 0) + 1
+        self.listener.streams += 1
+        self.since = self.last = time.time()
+        self.listener.connections.add(self)
+        if self.listener.paused:
+            self.pause()
+
+    def closed(self):
+        ''' Handle a connection which is gone. '''
+        self.listener.connections.discard(self)
+        if self.since is not None:
+            buffered = self.listener.buffered
+            if self._buffered:
+                buffered[self.host] -= self._buffered
+                if not buffered[self.host]:
+                    del buffered[self.host]
+            hosts = self.listener.hosts
+            hosts[self.host] -= 1
+            if not hosts[self.host]:
+                del hosts[self.host]
+            self.listener.streams -= 1
+            self.since = None
+        self.host = None
+        self.session = None
+
+    def _account(self, size):
+        '''
+        Record size bytes as buffered for this connection. Close it if its
+        host has too much buffered, returning False.
+        '''
+        buffered = self.listener.buffered
+        total = buffered.get(self.host, 0) + size - self._buffered
+        self._buffered = size
+        if total:
+            buffered[self.host] = total
+        else:
+            buffered.pop(self.host, None)
+        limit = self.listener.config.limits[4]
+        if limit and total > limit:
+            self.listener.metrics.inc('rejected', 'buffer')
+            self.log.warning('Too much data buffered from: ' + self.host)
+            self._close()
+            return False
+        return True
+
+    def _greeted(self):
+        ''' Handle successful authentication. '''
+        self.greeted = True
+        self.listener.blacklist.register(self.host, True)
+
+    def _close(self):
+        ''' Close connection, ignoring further input. '''
+        self.closing = True
+        self.close()
+
+    def _too_long(self):
+        ''' Handle a too long line, return False if closing. '''
+        if self.listener.config.longlines[1] == 'truncate':
+            self.listener.metrics.inc('truncated')
+            return True
+        self.listener.metrics.inc('rejected', 'toolong')
+        self.log.warning('Too long line from: ' + str(self.host))
+        self._close()
+        return False
+
+    def data_received(self, data):
+        ''' Split data into newline-terminated lines, handle each. '''
+        self.last = time.time()
+        maxlength = self.listener.config.longlines[0]
+        lines = (self._buffer + data).split(b'\n')
+        self._buffer = lines.pop()
+        if self._skipping:
+            if not lines:
+                self._buffer = b''
+                return
+            lines.pop(0)                    # Rest of a truncated line.
+            self._skipping = False
+        for line in lines:
+            if self.closing:
+                return
+            if len(line) > maxlength:
+                if not self._too_long():
+                    return
+                line = line[:maxlength]
+            self.line_received(line)
+        if len(self._buffer) > maxlength and not self.closing:
+            if not self._too_long():
+                return
+            self.line_received(self._buffer[:maxlength])
+            self._buffer = b''
+            self._skipping = True
+        if self._buffered or self._buffer:
+            self._account(len(self._buffer))
+
+    def _warning(self, what, reason, blame = True):
+        '''
+        Log, count and register bad input warning. Unless blame, e. g.
+        when caused by the server, it's not a blacklist failure.
+        '''
+        self.listener.metrics.inc('rejected', reason)
+        if self.host:
+            what += ' from: ' + str(self.host)
+        self.log.warning(what)
+        if world.testing:
+            self.listener.batcher.send((None, what, ['#test'], time.time()))
+        if self.host and blame:
+            self.listener.blacklist.register(self.host, False)
+
+    def _lookup(self, section, cleartext_pw):
+        ''' Return channels for authenticated section, or None. '''
+        try:
+            cipher_pw, channels = self.listener.config.get(section)
+        except KeyError:
+            self._warning("No such section: " + section, 'section')
+            return None
+        if not self.listener.authcache.verify(section, cleartext_pw,
+                                              cipher_pw):
+            self._warning('Bad password: ' + cleartext_pw, 'password')
+            return None
+        if not channels:
+            self._warning('Empty channel list: ' + section, 'channels')
+        return channels
+
+    def _authenticate(self, text):
+        ''' Handle the AUTH <section> <password> handshake. '''
+        try:
+            section, cleartext_pw = text.split(' ', 2)[1:]
+        except ValueError:
+            self._warning('Illegal AUTH format: ' + text, 'format')
+            self._close()
+            return
+        if self._lookup(section, cleartext_pw) is None:
+            self._close()
+            return
+        self.session = (section, self.listener.config.get(section)[0])
+        self._greeted()
+
+    def _send(self, section, data, channels, stamp):
+        ''' Forward data received at time stamp to main process. '''
+        if self.listener.dropping:
+            self.listener.metrics.inc('spooldropped', section)
+            return
+        self.listener.metrics.inc('sent', section)
+        self.listener.batcher.send((section, data, channels, stamp))
+
+    def _session_line(self, data, stamp):
+        ''' Forward a line on an authenticated connection. '''
+        section, cipher_pw = self.session
+        try:
+            current_pw, channels = self.listener.config.get(section)
+        except KeyError:
+            current_pw = None
+        if current_pw != cipher_pw:
+            self._warning('Section removed or updated: ' + section,
+                          'section', blame = False)
+            self._close()
+            return
+        self._send(section, data, channels, stamp)
+
+    def line_received(self, text):
+        ''' Handle one line of input from client. '''
+
+        stamp = time.time()
+        self.listener.metrics.inc('received')
+        try:
+            if sys.version_info[0] >= 3:
+                text = text.decode()
+        except UnicodeDecodeError:
+            self._warning('Invalid encoding: ' + repr(text), 'encoding')
+            return
+
+        if self.session:
+            self._session_line(text, stamp)
+            return
+        if text.startswith('AUTH '):
+            self._authenticate(text)
+            return
+        try:
+            section, cleartext_pw, data = text.split(';', 2)
+        except ValueError:
+            self._warning('Illegal format: ' + text, 'format')
+            return
+        channels = self._lookup(section, cleartext_pw)
+        if channels is None:
+            return
+        self.log.debug("Sending %s to: %s", data, channels)
+        self._send(section, data, channels, stamp)
+        self._greeted()
+
+
+class Datagrams(Client):
+    '''
+    Line protocol on a UDP socket: each datagram is one line, the
+    trailing newline optional, other newlines rejected. There are no
+    sessions, so each line is <section>;<password>;<text>. Senders can
+    be spoofed, so bad datagrams are dropped and counted but not
+    recorded in the blacklist, which still blocks hosts listed by
+    stream clients.
+    pause() and resume() stop and restart reading the socket, leaving
+    the kernel to drop datagrams while paused.
+    '''
+
+    def abort(self):
+        pass
+
+    def close(self):
+        pass
+
+    def started(self):
+        ''' Handle the socket being ready for reading. '''
+        self.listener.connections.add(self)
+        if self.listener.paused:
+            self.pause()
+
+    def datagram_received(self, data, host):
+        ''' Handle one datagram from host. '''
+        self.host = host
+        if self.listener.blacklist.onList(host):
+            self.listener.metrics.inc('rejected', 'blacklist')
+            return
+        if data.endswith(b'\n'):
+            data = data[:-1]
+        if b'\n' in data:
+            self._warning('Multiple lines in datagram', 'format')
+            return
+        self.line_received(data)
+
+    def _authenticate(self, text):
+        self._warning('AUTH on datagram: ' + text, 'format')
+
+    def _greeted(self):
+        pass
+
+    def _warning(self, what, reason, blame = True):
+        Client._warning(self, what, reason, blame = False)
+
+
+class HttpClient(Client):
+    '''
+    Webhook protocol: HTTP/1.x POST requests with a JSON body
+    {"section": <name>, "token": <password>, "lines": [<text>, ...]}.
+
+    Each request is authenticated once, and all its lines are sent to
+    main process in one message. Texts containing newlines are split
+    into several lines. Connections are kept alive unless the client
+    asks otherwise. Requests failing authentication, and malformed or
+    too large ones, close the connection after the error response.
+    Bodies are limited by the httpmaxbody option, request headers by
+    MaxHeader. Chunked bodies are not supported.
+    '''
+
+    MaxHeader = 16384
+
+    Reasons = {100: 'Continue', 200: 'OK', 400: 'Bad Request',
+               403: 'Forbidden', 405: 'Method Not Allowed',
+               411: 'Length Required', 413: 'Payload Too Large',
+               431: 'Request Header Fields Too Large',
+               503: 'Service Unavailable'}
+
+    def __init__(self, listener):
+        Client.__init__(self, listener)
+        self._request = None    # (body length, keep alive) of request read.
+
+    def _respond(self, status, keep_alive, result = None):
+        ''' Send a response with JSON body result, close unless keep_alive. '''
+        body = json.dumps(result or {'error': self.Reasons[status]})
+        head = 'HTTP/1.1 %d %s\r\nContent-Type: application/json\r\n' \
+               'Content-Length: %d\r\n' % (status, self.Reasons[status],
+                                            len(body))
+        if not keep_alive:
+            head += 'Connection: close\r\n'
+        self.write((head + '\r\n' + body).encode())
+        if not keep_alive:
+            self._close()
+
+    def _error(self, status, what, reason):
+        ''' Warn about a bad request, respond with status and close. '''
+        self._warning(what, reason)
+        self._respond(status, False)
+
+    def data_received(self, data):
+        ''' Split data into requests, handle each. '''
+        self.last = time.time()
+        self._buffer += data
+        self._requests()
+        if not self.closing:
+            self._account(len(self._buffer))
+
+    def _requests(self):
+        ''' Handle all complete requests in buffer. '''
+        while not self.closing:
+            if self._request is None:
+                end = self._buffer.find(b'\r\n\r\n')
+                if end > self.MaxHeader or \
+                        (end < 0 and len(self._buffer) > self.MaxHeader):
+                    self._error(431, 'Too large HTTP header', 'size')
+                    return
+                if end < 0:
+                    return
+                head = self._buffer[:end]
+                self._buffer = self._buffer[end + 4:]
+                self._request = self._parse_head(head)
+                if self._request is None:
+                    return
+            length, keep_alive = self._request
+            if len(self._buffer) < length:
+                return
+            body = self._buffer[:length]
+            self._buffer = self._buffer[length:]
+            self._request = None
+            self._handle(body, keep_alive)
+
+    def _parse_head(self, head):
+        ''' Return (body length, keep alive) for request head, or None. '''
+        lines = head.decode('latin-1').split('\r\n')
+        try:
+            method, target, version = lines[0].split(' ')
+            headers = dict([(k.strip().lower(), v.strip()) for k, v
+                            in [line.split(':', 1) for line in lines[1:]]])
+        except ValueError:
+            self._error(400, 'Illegal HTTP request: ' + lines[0], 'format')
+            return None
+        connection = headers.get('connection', '').lower()
+        keep_alive = connection == 'keep-alive' or \
+            (version == 'HTTP/1.1' and connection != 'close')
+        if method != 'POST':
+            self._error(405, 'Bad HTTP method: ' + method, 'format')
+            return None
+        try:
+            if 'transfer-encoding' in headers:
+                raise ValueError('chunked')
+            length = int(headers['content-length'])
+        except (KeyError, ValueError):
+            self._error(411, 'No HTTP content length', 'format')
+            return None
+        if length > self.listener.config.httpmaxbody or length < 0:
+            self._error(413, 'Too large HTTP body: %d' % length, 'size')
+            return None
+        if headers.get('expect', '').lower() == '100-continue':
+            self.write(b'HTTP/1.1 100 Continue\r\n\r\n')
+        return length, keep_alive
+
+    def _handle(self, body, keep_alive):
+        ''' Handle the JSON body of a request. '''
+        stamp = time.time()
+        try:
+            request = json.loads(body.decode('utf-8'))
+            section, token = request['section'], request['token']
+            if not isinstance(request['lines'], list):
+                raise TypeError('lines')
+            texts = []
+            for text in request['lines']:
+                texts.extend(text.splitlines())
+            if not isinstance(section + token, type(u'')):
+                raise TypeError('section or token')
+            for text in [section, token] + texts:
+                text.encode('utf-8')        # Lone surrogates raise.
+        except (ValueError, KeyError, TypeError, AttributeError,
+                UnicodeError):
+            self._error(400, 'Illegal webhook body: ' + repr(body[:80]),
+                        'format')
+            return
+        self.listener.metrics.inc('received', count = len(texts))
+        channels = self._lookup(section, token)
+        if channels is None:
+            self._respond(403, False)
+            return
+        self._greeted()
+        if self.listener.dropping:
+            self.listener.metrics.inc('spooldropped', section, len(texts))
+            self._respond(503, keep_alive)
+            return
+        if texts:
+            self.listener.metrics.inc('sent', section, len(texts))
+            self.listener.batcher.send_many(
+                [(section, text, channels, stamp) for text in texts])
+        self._respond(200, keep_alive, {'lines': len(texts)})
+
+
+class Listener(object):
+    '''
+    State shared by all clients in an io_process. The config is updated
+    in place when the main process sends section updates.
+
+    When the spool to the main process is full all connections stop
+    reading, or new lines are dropped, depending on the spool policy.
+
+    The backend runs tick() each TickInterval, sending metrics and
+    closing idle clients.
+    '''
+
+    TickInterval = 1.0        # Time between tick() calls.
+    FlushTimeout = 5.0        # Max time sending queued lines when exiting.
+
+    def __init__(self, pipe):
+        self.pipe = pipe
+        assert self.pipe[0].poll(), "No initial config!"
+        self.config = self.pipe[0].recv()
+        self.blacklist = Blacklist(*self.config.blacklist)
+        self.authcache = AuthCache(self.config.authcache)
+        self.connections = set()
+        self.streams = 0            # Connected clients, not Datagrams.
+        self.hosts = {}             # Host -> number of connections.
+        self.buffered = {}          # Host -> bytes buffered.
+        self.paused = False
+        self.resumed = 0.0          # Time of last resume after pause.
+        self.dropping = False
+        self.spool = Spool(
+            self.pipe[0], self.config.spool[0], self.spool_full,
+            lambda: self.call_from_thread(self.spool_drained))
+        self.batcher = Batcher(self.spool, self.config.batchwindow,
+                               self.call_later)
+        self.metrics = metrics.Metrics()
+
+    def call_later(self, delay, func):
+        ''' Run func after delay s, return timer with a cancel(). '''
+        raise NotImplementedError
+
+    def call_from_thread(self, func):
+        ''' Run func in the event loop, thread-safe. '''
+        raise NotImplementedError
+
+    def read_config(self):
+        '''
+        Apply all pending updates from main process. Return False if
+        main process is gone.
+        '''
+        try:
+            while self.pipe[0].poll():
+                self.update(self.pipe[0].recv())
+        except (EOFError, IOError, OSError):
+            return False
+        return True
+
+    def update(self, delta):
+        ''' Apply a section update from _Config.delta(). '''
+        self.config.apply(delta)
+        self.authcache.discard(delta[0])
+
+    def send_metrics(self):
+        ''' Send metrics collected since last time to main process. '''
+        if self.metrics.counters:
+            self.spool.send(('metrics', self.metrics.take()))
+
+    def tick(self):
+        ''' Periodic work: send metrics, expire clients. '''
+        self.send_metrics()
+        self.expire()
+
+    def expire(self):
+        '''
+        Close clients idle for idletimeout, or not authenticated within
+        handshaketimeout. Clients aren't idle while paused.
+        '''
+        idle, handshake = self.config.limits[2:4]
+        if self.paused or not (idle or handshake):
+            return
+        now = time.time()
+        for client in list(self.connections):
+            if client.since is None or client.closing:
+                continue
+            if idle and now - max(client.last, self.resumed) > idle:
+                reason = 'idle'
+            elif handshake and not client.greeted \
+                    and now - max(client.since, self.resumed) > handshake:
+                reason = 'handshake'
+            else:
+                continue
+            self.metrics.inc('rejected', reason)
+            client.log.info('Closing %s connection from %s'
+                            % (reason, client.host))
+            client._close()             # pylint: disable=W0212
+
+    def spool_full(self):
+        ''' Pause reading from clients or start dropping lines. '''
+        self.metrics.inc('spoolfull')
+        if self.config.spool[1] == 'drop':
+            self.dropping = True
+            return
+        self.paused = True
+        for connection in self.connections:
+            connection.pause()
+
+    def spool_drained(self):
+        ''' Resume normal operation after spool_full(). '''
+        if self.spool.full:
+            return                  # Filled up again before we got here.
+        self.dropping = False
+        if self.paused:
+            self.paused = False
+            self.resumed = time.time()
+            for connection in self.connections:
+                connection.resume()
+
+    def flush(self):
+        ''' Send what's queued to main process, when exiting. '''
+        self.batcher.flush()
+        self.spool.close(self.FlushTimeout)
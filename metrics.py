@@ -0,0 +1,262 @@
+###
+# Copyright (c) 2013, Alec Leamas
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice,
+#     this list of conditions, and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice,
+#     this list of conditions, and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#   * Neither the name of the author of this software nor the name of
+#     contributors to this software may be used to endorse or promote products
+#     derived from this software without specific prior written consent.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+'''
+Counters and latency histograms for the relay pipeline, and a small
+http server exporting them in the Prometheus text format.
+
+Each metric is labelled by either section, channel or reject reason as
+listed in Labels. The io_process counts in its own Metrics and sends
+them to the main process using take(); main merge()s them.
+'''
+
+import bisect
+import heapq
+import threading
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+
+
+Labels = {
+    'received': None,        # Lines read from clients.
+    'rejected': 'reason',    # Lines or connections refused.
+    'truncated': None,       # Too long lines truncated.
+    'sent': 'section',       # Lines sent to main process.
+    'batches': None,         # Pipe messages sent to main process.
+    'restarts': None,        # Dead io_processes restarted.
+    'spoolfull': None,       # Times the listener's spool filled up.
+    'spooldropped': 'section',  # Lines dropped when spool is full.
+    'queued': 'section',     # Lines received from the pipe.
+    'dispatched': 'channel',  # Messages queued to irc.
+    'dropped': 'channel',    # Messages dropped by flood control etc.
+    'repeated': 'channel',   # Repeated messages suppressed.
+    'spooled': 'channel',    # Messages saved in the disk spool.
+    'replayed': 'channel',   # Messages replayed from the disk spool.
+    'pipe': None,            # Latency: batch sent -> received.
+    'latency': 'section',    # Latency: line received -> queued to irc.
+    'listener': 'section',   # Tracing: line read -> batch sent.
+    'queue': 'section',      # Tracing: batch received -> queued to irc.
+    'irc': 'section',        # Tracing: queued to irc -> sent to server.
+    'total': 'section',      # Tracing: line read -> sent to server.
+}
+
+Stages = ('listener', 'pipe', 'queue', 'irc')
+
+
+class Histogram(object):
+    ''' Latency histogram with fixed, roughly logarithmic buckets. '''
+
+    Buckets = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5,
+               1.0, 5.0, 10.0, 60.0)
+
+    def __init__(self):
+        self.counts = [0] * (len(self.Buckets) + 1)
+        self.total = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        ''' Add a value. '''
+        self.counts[bisect.bisect_left(self.Buckets, value)] += 1
+        self.total += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def merge(self, other):
+        ''' Add all values in other histogram. '''
+        for i, count in enumerate(other.counts):
+            self.counts[i] += count
+        self.total += other.total
+        self.sum += other.sum
+        self.max = max(self.max, other.max)
+
+    def percentile(self, q):
+        ''' Return upper bound of bucket holding the q-quantile, or max. '''
+        wanted = q * self.total
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if seen >= wanted and count:
+                if i < len(self.Buckets):
+                    return min(self.Buckets[i], self.max)
+                return self.max
+        return 0.0
+
+
+class Metrics(object):
+    ''' Counters and histograms keyed by (name, label value). '''
+
+    def __init__(self):
+        self.counters = {}
+        self.histograms = {}
+
+    def inc(self, name, label = None, count = 1):
+        ''' Increment counter name for label. '''
+        key = (name, label)
+        self.counters[key] = self.counters.get(key, 0) + count
+
+    def observe(self, name, label, value):
+        ''' Add value to histogram name for label. '''
+        key = (name, label)
+        try:
+            self.histograms[key].observe(value)
+        except KeyError:
+            self.histograms[key] = Histogram()
+            self.histograms[key].observe(value)
+
+    def take(self):
+        ''' Return (counters, histograms) and reset them. '''
+        data = (self.counters, self.histograms)
+        self.counters = {}
+        self.histograms = {}
+        return data
+
+    def merge(self, data):
+        ''' Add (counters, histograms) from take(). '''
+        counters, histograms = data
+        for key, count in counters.items():
+            self.counters[key] = self.counters.get(key, 0) + count
+        for key, histogram in histograms.items():
+            if key not in self.histograms:
+                self.histograms[key] = Histogram()
+            self.histograms[key].merge(histogram)
+
+    def count(self, name, label = None):
+        ''' Return counter value, summed over all labels if None. '''
+        if label is not None:
+            return self.counters.get((name, label), 0)
+        return sum([v for k, v in self.counters.copy().items()
+                    if k[0] == name])
+
+    def labels(self, name):
+        ''' Return dict label -> value for counter name. '''
+        return dict([(k[1], v) for k, v in self.counters.copy().items()
+                     if k[0] == name])
+
+    def histogram(self, name, label = None):
+        ''' Return histogram for name and label, possibly empty. '''
+        return self.histograms.get((name, label), Histogram())
+
+    def prometheus(self):
+        ''' Return all metrics in Prometheus text format. '''
+
+        def labels(name, value, extra = ''):
+            ''' Format label set. '''
+            items = []
+            if Labels[name] and value is not None:
+                value = str(value).replace('\\', '\\\\') \
+                    .replace('"', '\\"').replace('\n', '\\n')
+                items.append('%s="%s"' % (Labels[name], value))
+            if extra:
+                items.append(extra)
+            return '{' + ','.join(items) + '}' if items else ''
+
+        lines = []
+        for (name, value), count in sorted(self.counters.copy().items(),
+                                           key = str):
+            lines.append('irccat_%s_total%s %d'
+                         % (name, labels(name, value), count))
+        for (name, value), hist in sorted(self.histograms.copy().items(),
+                                          key = str):
+            metric = 'irccat_%s_seconds' % name
+            cumulative = 0
+            for i, bound in enumerate(Histogram.Buckets + ('+Inf',)):
+                cumulative += hist.counts[i]
+                lines.append('%s_bucket%s %d' % (
+                    metric, labels(name, value, 'le="%s"' % bound),
+                    cumulative))
+            lines.append('%s_sum%s %f' % (metric, labels(name, value),
+                                          hist.sum))
+            lines.append('%s_count%s %d' % (metric, labels(name, value),
+                                            hist.total))
+        return '\n'.join(lines) + '\n'
+
+
+class SlowLog(object):
+    ''' Keeps the size slowest traced messages. '''
+
+    def __init__(self, size):
+        self.size = size
+        self._heap = []
+        self._seq = 0
+        self._lock = threading.Lock()
+
+    def add(self, total, entry):
+        ''' Add entry which took total seconds. '''
+        with self._lock:
+            self._seq += 1
+            item = (total, self._seq, entry)
+            if len(self._heap) < self.size:
+                heapq.heappush(self._heap, item)
+            elif total > self._heap[0][0]:
+                heapq.heapreplace(self._heap, item)
+
+    def entries(self):
+        ''' Return list of (total, entry), slowest first. '''
+        with self._lock:
+            items = sorted(self._heap, reverse = True)
+        return [(total, entry) for total, seq, entry in items]
+
+
+def serve(metrics, port):
+    '''
+    Serve metrics on http://127.0.0.1:port/metrics in a daemon thread.
+    Returns the server, use shutdown() to stop it.
+    '''
+
+    class Handler(BaseHTTPRequestHandler):
+        ''' GET /metrics handler. '''
+
+        def do_GET(self):                      # pylint: disable=C0103
+            ''' Return metrics, or 404. '''
+            if self.path != '/metrics':
+                self.send_error(404)
+                return
+            body = metrics.prometheus().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):          # pylint: disable=W0221
+            ''' Don't log each request. '''
+
+    server = HTTPServer(('127.0.0.1', port), Handler)
+    thread = threading.Thread(target = server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
@@ -34,10 +34,12 @@ The main process has a separate listener_thread.
 
 The io_process gets data from a port and forwards it to the
 main process. The main process handles user commands. A separate
-thread gets data from the io_process and forwards to irc.
+thread gets data from the io_process and forwards to irc. The
+io_process runs a backend module, twistedio or aio, imported only
+there.
 
 Somewhat messy. Design effected by need to run twisted in a process
-so it vcan be restarted, and that the irc state can't be shared
+so it can be restarted, and that the irc state can't be shared
 i. e., the separate process can't shuffle data to irc.
 
 Here are no critical zones, this is pure message passing. The
@@ -45,88 +47,313 @@ io_process gets updated configurations from main. Main gets data
 to print from io_process.
  '''
 
+import collections
 import crypt
+import functools
+import importlib
 import multiprocessing
+import multiprocessing.util
+import os
 import pickle
 import random
+import select
+import socket
+import stat
 import sys
 import time
 
-from twisted.internet import reactor, protocol
-from twisted.protocols import basic
-
 from supybot import callbacks
 from supybot import ircmsgs
+from supybot import ircutils
 from supybot import log
 from supybot import world
 from supybot.commands import commalist
+from supybot.commands import optional
 from supybot.commands import threading
 from supybot.commands import wrap
 
 from . import config
+from . import diskspool
+from . import metrics
+from . import ratelimit
+from . import store
 
 
 _HELP_URL = "https://github.com/leamas/supybot-irccat"
 
+# Listening sockets kept open while reloading, (kind, address) ->
+# (socket, close timer). Survives reload(plugin), see _park_socket().
+_parked = globals().get('_parked', {})
 
-def io_process(port, interface, pipe):
-    ''' Run the twisted-governed data flow from port -> irc. '''
-    # pylint: disable=E1101
+# io_processes kept running while reloading, at most one entry:
+# (state, workers, section deltas, stop timer). See _park_workers().
+_parked_workers = globals().get('_parked_workers', [])
 
-    logger = log.getPluginLogger('irccat.io')
-    logger.debug("Starting IO process on %d" % port)
-    reactor.listenTCP(port=port, interface=interface, factory=IrccatFactory(pipe))
-    try:
-        reactor.run()
-    except Exception as ex:                          # pylint: disable=W0703
-        logger.error("Exception in io_process: " + str(ex), exc_info = True)
-    logger.info(" io_process: exiting")
+# Fork keeps the bot's logging setup in the io_process, and the plugin
+# can't be imported by name there. Python 3.14 defaults to forkserver.
+_mp = multiprocessing.get_context('fork') \
+    if hasattr(multiprocessing, 'get_context') else multiprocessing
 
+_BACKENDS = {'twisted': 'twistedio', 'asyncio': 'aio'}   # Option -> module.
 
-class _Blacklist(object):
-    ''' Handles blacklisting of faulty  clients. '''
 
-    FailMax = 8   # Max # of times
-    BlockTime = 500  # Time we wait in blacklisted state (seconds).
+def _listen_socket(kind, address):
+    '''
+    Return a non-blocking socket listening to address, shared by all
+    io_processes. kind is 'tcp', 'http', 'udp' or 'unix', where address
+    is a path. Reuses the one parked by a plugin instance just reloaded.
+    '''
+    parked = _parked.pop((kind, address), None)
+    if parked:
+        parked[1].cancel()
+        return parked[0]
+    if kind == 'unix':
+        if os.path.exists(address) and \
+                stat.S_ISSOCK(os.stat(address).st_mode):
+            os.unlink(address)                  # Stale, left by a crash.
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.bind(address)
+    else:
+        family = socket.AF_INET6 if ':' in address[0] else socket.AF_INET
+        type_ = socket.SOCK_DGRAM if kind == 'udp' else socket.SOCK_STREAM
+        sock = socket.socket(family, type_)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind(address)
+    if kind != 'udp':
+        sock.listen(50)
+    sock.setblocking(False)
+    return sock
+
+
+def _listen_sockets(config_):
+    '''
+    Return [((kind, address), socket)] for the TCP listener and the
+    optional Unix, UDP and HTTP ones in config_.
+    '''
+    addresses = [('tcp', (config_.interface, config_.port))]
+    if config_.httpport:
+        addresses.append(('http', (config_.interface, config_.httpport)))
+    path, mode = config_.unixsocket
+    if path:
+        addresses.append(('unix', path))
+    if config_.udpport:
+        addresses.append(('udp', (config_.interface, config_.udpport)))
+    socks = [(key, _listen_socket(*key)) for key in addresses]
+    if path:
+        os.chmod(path, int(mode, 8))
+    return socks
+
+
+def _park_socket(sock, kind, address, timeout):
+    '''
+    Keep listening sock open for the next plugin instance, so clients
+    connecting during reload wait in the backlog instead of being
+    refused. Closed after timeout unless reused, e. g. after unload.
+    '''
+    key = (kind, address)
 
-    def __init__(self):
-        self._state = {}
-        self.log = log.getPluginLogger('irccat.blacklist')
+    def expire():
+        ''' Close sock, unless reused. '''
+        if _parked.get(key, (None,))[0] is sock:
+            del _parked[key]
+            sock.close()
+            if kind == 'unix' and os.path.exists(address):
+                os.unlink(address)
+
+    timer = threading.Timer(timeout, expire)
+    timer.daemon = True
+    _parked[key] = (sock, timer)
+    timer.start()
 
-    def register(self, host, status):
-        ''' Register an event coming from host (address) being OK/Fail. '''
-        if not host in self._state:
-            self._state[host] = (1, status, time.time())
+
+def _worker_state(config_, module_name, socks):
+    '''
+    Return what io_processes run with, which must be unchanged for a
+    new plugin instance to adopt them: the backend module, the socks,
+    config_ apart from the sections, and the plugin's code on disk.
+    '''
+    state = config_.__getstate__()
+    del state['_data']
+    directory = os.path.dirname(os.path.abspath(__file__))
+    code = [(name, os.path.getmtime(os.path.join(directory, name)))
+            for name in sorted(os.listdir(directory))
+            if name.endswith('.py')]
+    return module_name, [sock for key, sock in socks], state, code
+
+
+def _stop_workers(workers):
+    ''' Terminate workers' io_processes, dropping what they send. '''
+    for worker in workers:
+        worker.process.terminate()
+        for conn in worker.pipe:
+            conn.close()
+    for worker in workers:
+        worker.process.join()
+
+
+def _drain_workers(workers, handle, timeout):
+    '''
+    Terminate the io_processes of workers, passing what's still in
+    their pipes to handle(message) for at most timeout seconds. The
+    io_processes flush first.
+    '''
+    for worker in workers:
+        if not worker.due:
+            worker.process.terminate()
+    deadline = time.time() + timeout
+    for worker in workers:
+        conn, process = worker.pipe[1], worker.process
+        try:
+            while time.time() < deadline and \
+                    (conn.poll(0.1) or process.is_alive()):
+                if conn.poll():
+                    handle(conn.recv())
+        except (EOFError, IOError, OSError):
+            pass
+        for conn in worker.pipe:
+            conn.close()
+        process.join(max(deadline - time.time(), 0))
+
+
+def _retire_workers(workers, spool, timeout):
+    '''
+    Stop workers when no plugin instance takes over, saving lines in
+    their pipes in the disk spool (path, size in MB, age) if enabled.
+    '''
+    path, size, age = spool[:3]
+    try:
+        spool_ = diskspool.DiskSpool(path, size * 1024 * 1024, age) \
+            if path else None
+    except (IOError, OSError) as ex:
+        log.getPluginLogger('irccat.irccat').error(
+            "Can't open spool %s: %s" % (path, str(ex)))
+        spool_ = None
+    if not spool_:
+        _stop_workers(workers)
+        return
+
+    def handle(message):
+        ''' Append each line to the spool for all its channels. '''
+        kind, data = message
+        if kind != 'lines':
             return
-        count, oldstate, when = self._state[host]
-        if oldstate == status:
-            self._state[host] = (count + 1, oldstate, when)
-            if not status and count + 1 == self.FailMax:
-                self.log.warning("Blacklisting: " + host)
+        for section, msg, channels, stamp in data[1]:
+            for channel in channels:
+                spool_.append(ircutils.toLower(channel), section, msg,
+                              stamp)
+
+    try:
+        _drain_workers(workers, handle, timeout)
+    finally:
+        spool_.close()
+
+
+def _park_workers(state, workers, sections, timeout, retire):
+    '''
+    Keep the io_processes of workers running for the next plugin
+    instance, which adopts them if state is unchanged. Reloading thus
+    doesn't fork new io_processes which import the backend again.
+    After timeout unless adopted, e. g. after unload, retire(workers).
+    '''
+    def expire():
+        ''' Retire workers, unless adopted. '''
+        if _parked_workers and _parked_workers[0][1] is workers:
+            del _parked_workers[:]
+            retire(workers)
+
+    timer = threading.Timer(timeout, expire)
+    timer.daemon = True
+    _parked_workers[:] = [(state, workers, sections, timer)]
+    timer.start()
+
+
+def _unpark_workers():
+    ''' Return (state, workers, section deltas) parked, or None. '''
+    if not _parked_workers:
+        return None
+    state, workers, sections, timer = _parked_workers.pop()
+    timer.cancel()
+    return state, workers, sections
+
+
+def _io_process(module_name, socks, pipe, inherited):
+    '''
+    io_process entry: import the backend module, which thus is loaded
+    in the forked process only, and run its io_process() on the
+    [(kind, socket)] socks.
+    '''
+    module = importlib.import_module('.' + module_name, __package__)
+    module.io_process(socks, pipe, inherited)
+
+
+class _Worker(object):
+    '''
+    An io_process, its pipe and restart state. A worker dying within
+    StableTime after being started is restarted with exponential
+    backoff, otherwise at once.
+    '''
+
+    StableTime = 10.0     # Uptime after which a worker isn't crashing.
+    MinBackoff = 0.5      # First restart delay when crashing.
+    MaxBackoff = 30.0     # Max restart delay.
+
+    def __init__(self, module_name, socks):
+        self.module_name = module_name
+        self.socks = socks
+        self.pipe = None
+        self.process = None
+        self.started = None
+        self.restarts = 0
+        self.backoff = 0.0
+        self.due = None           # Restart time when dead, else None.
+        self.exitcode = None      # Of last dead process.
+
+    def start(self, config_, inherited):
+        '''
+        Fork a new io_process with a new pipe, sending it config_.
+        inherited are main process pipe ends for other workers.
+        '''
+        self.pipe = _mp.Pipe()
+        self.pipe[1].send(config_)
+        self.process = _mp.Process(target = _io_process,
+                                   args = (self.module_name, self.socks,
+                                           self.pipe, inherited))
+        self.process.daemon = True      # Parked ones mustn't block exit.
+        self.process.start()
+        self.started = time.time()
+        self.due = None
+
+    def sentinel(self):
+        ''' Return fd readable when process is dead, or None. '''
+        return getattr(self.process, 'sentinel', None)
+
+    def died(self, now):
+        ''' Release the dead process, schedule restart. '''
+        self.process.join()
+        self.exitcode = self.process.exitcode
+        for conn in self.pipe:
+            conn.close()
+        if now - self.started >= self.StableTime:
+            self.backoff = 0.0
         else:
-            self._state[host] = (1, status, time.time())
-
-    def onList(self, host):
-        ''' Return True if host is blacklisted i. e., should be blocked.'''
-        if not host in self._state:
-            return False
-        count, oldstate, when = self._state[host]
-        if oldstate:
-            return False
-        if count >= self.FailMax:
-            if time.time() - when < self.BlockTime:
-                return True
-            else:
-                self._state[host] = (1, oldstate, time.time())
-        return False
+            self.backoff = min(max(self.backoff * 2, self.MinBackoff),
+                               self.MaxBackoff)
+        self.due = now + self.backoff
 
 
 class _Section(object):
-    ''' Section representation in _Config._data. '''
+    '''
+    Section representation in _Config._data. Optional attributes have
+    class defaults, covering sections stored by older versions.
+    '''
+
+    dedup = 0             # Repeat suppression window (s), 0 disables.
+    priority = 'normal'   # A ratelimit.FairScheduler.Priorities lane.
 
-    def __init__(self, password, channels):
+    def __init__(self, password, channels, **attrs):
         self.password = password
         self.channels = channels
+        self.__dict__.update(attrs)
 
 
 class _Config(object):
@@ -135,201 +362,713 @@ class _Config(object):
     def __init__(self):
         self.port = config.global_option('port').value
         self.interface = config.global_option('interface').value
+        self.unixsocket = (config.global_option('unixsocket').value,
+                           config.global_option('unixsocketmode').value)
+        self.udpport = config.global_option('udpport').value
+        self.httpport = config.global_option('httpport').value
+        self.httpmaxbody = config.global_option('httpmaxbody').value
         self.privmsg = config.global_option('privmsg').value
+        self.workers = config.global_option('workers').value
+        self.backend = config.global_option('backend').value
+        self.authcache = config.global_option('authcache').value
+        self.blacklist = (config.global_option('failmax').value,
+                          config.global_option('blocktime').value,
+                          config.global_option('subnetmax').value)
+        self.limits = (config.global_option('maxconnections').value,
+                       config.global_option('maxhostconnections').value,
+                       config.global_option('idletimeout').value,
+                       config.global_option('handshaketimeout').value,
+                       config.global_option('hostbuffer').value)
+        self.longlines = (config.global_option('maxlinelength').value,
+                          config.global_option('longlines').value)
+        self.batchwindow = config.global_option('batchwindow').value
+        self.spool = (config.global_option('spoolsize').value,
+                      config.global_option('spoolpolicy').value)
+        self.diskspool = (config.global_option('diskspool').value,
+                          config.global_option('diskspoolsize').value,
+                          config.global_option('diskspoolage').value,
+                          config.global_option('replayrate').value)
+        self.floodlimits = (config.global_option('sectionrate').value,
+                            config.global_option('sectionburst').value,
+                            config.global_option('channelrate').value,
+                            config.global_option('channelburst').value)
+        self.backlog = config.global_option('backlog').value
+        self.ircqueue = config.global_option('ircqueue').value
+        self.overflow = config.global_option('overflow').value
+        self.coalesce = set(config.global_option('coalesce').value)
+        self.metricsport = config.global_option('metricsport').value
+        self.tracing = config.global_option('tracing').value
+        self.slowlog = config.global_option('slowlog').value
         self._path = config.global_option('sectionspath').value
+        self._store = self._open_store(
+            config.global_option('sectionstore').value)
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        del state['_store']         # Only used in main process.
+        return state
+
+    def _open_store(self, kind):
+        '''
+        Open and load the section store, migrating legacy pickled data
+        if present. A bad store is moved aside, not silently dropped.
+        '''
+        logger = log.getPluginLogger('irccat.config')
+        store_ = None
         try:
-            self._data = pickle.load(open(self._path, 'rb'))
-        except IOError:
-            self._data = {}
-            logger = log.getPluginLogger('irccat.config')
-            logger.warning("Can't find stored config, creating empty.")
-            self._dump()
+            store_ = store.open_store(kind, self._path)
+            data = store_.load()
+        except store.StoreError as ex:
+            path = store.store_path(kind, self._path)
+            if not os.path.exists(path):
+                raise                           # E. g., no sqlite3.
+            if store_:
+                store_.close()
+            os.rename(path, path + '.corrupt')
+            logger.error("Bad section store (%s), moved to %s.corrupt"
+                         % (str(ex), path))
+            store_ = store.open_store(kind, self._path)
+            data = {}
+        self._data = dict([(name, _Section(**d)) for name, d in data.items()])
+        if not self._data and os.path.exists(self._path):
+            self._migrate(store_, logger)
+        return store_
+
+    def _migrate(self, store_, logger):
+        ''' Import legacy pickled sections into store_. '''
+        try:
+            with open(self._path, 'rb') as f:
+                self._data = pickle.load(f)
         except Exception:   # Unpickle throws just anything.
+            logger.warning("Bad legacy config %s, not migrated." % self._path)
             self._data = {}
-            logger = log.getPluginLogger('irccat.config')
-            logger.warning("Bad stored config, creating empty.")
-            self._dump()
+            return
+        store_.put_many([(name, section.__dict__)
+                         for name, section in self._data.items()])
+        os.rename(self._path, self._path + '.migrated')
+        logger.info("Migrated %d sections from %s to %s"
+                    % (len(self._data), self._path, store_.path))
 
-    def _dump(self):
-        ''' Update persistent data.'''
-        pickle.dump(self._data, open(self._path, 'wb'))
+    def close(self):
+        ''' Release the section store. '''
+        self._store.close()
 
     def get(self, section_name):
         ''' Return (password, channels) tuple or raise KeyError. '''
         s = self._data[section_name]
         return s.password, s.channels
 
-    def update(self, section_name, password, channels):
-        ''' Store section data for name, creating it if required. '''
-        self._data[section_name] = _Section(password, channels)
-        self._dump()
+    def update(self, section_name, password, channels, **attrs):
+        '''
+        Store section data for name, creating it if required. Other
+        attributes of an existing section are kept unless given in attrs.
+        '''
+        if section_name in self._data:
+            attrs = dict(self._data[section_name].__dict__, **attrs)
+        attrs.update(password = password, channels = channels)
+        self._data[section_name] = _Section(**attrs)
+        self._store.put(section_name, self._data[section_name].__dict__)
+
+    def configure(self, section_name, **attrs):
+        ''' Set attributes of existing section or raise KeyError. '''
+        section = _Section(**self._data[section_name].__dict__)
+        section.__dict__.update(attrs)
+        self._data[section_name] = section
+        self._store.put(section_name, section.__dict__)
+
+    def dedup(self, section_name):
+        ''' Return section's repeat suppression window, 0 if none. '''
+        section = self._data.get(section_name)
+        return section.dedup if section else 0
+
+    def priority(self, section_name):
+        ''' Return section's priority, 'normal' if none. '''
+        section = self._data.get(section_name)
+        return section.priority if section else _Section.priority
 
     def remove(self, section_name):
         ''' Remove existing section or raise KeyError. '''
         del(self._data[section_name])
-        self._dump()
+        self._store.delete(section_name)
 
     def keys(self):
         ''' Return list of section names. '''
         return list(self._data.keys())
 
+    def delta(self, section_name):
+        ''' Return the current state of a section, for apply(). '''
+        return section_name, self._data.get(section_name)
 
-class IrccatProtocol(basic.LineOnlyReceiver):
-    ''' Line protocol: parse line, forward to channel(s). '''
-
-    delimiter = b'\n'
-
-    def __init__(self, config_, blacklist, msg_conn):
-        self.config = config_
-        self.blacklist = blacklist
-        self.msg_conn = msg_conn
-        self.peer = None
-        self.log = log.getPluginLogger('irccat.protocol')
-
-    def connectionMade(self):
-        self.peer = self.transport.getPeer()
-        if self.blacklist.onList(self.peer.host):
-            self.transport.abortConnection()
-
-    def connectionLost(self, reason):            # pylint: disable=W0222
-        self.peer = None
-
-    def lineReceived(self, text):
-        ''' Handle one line of input from client. '''
-
-        def warning(what):
-            ''' Log and register bad input warning. '''
-            if self.peer:
-                what += ' from: ' + str(self.peer.host)
-            self.log.warning(what)
-            if world.testing:
-                self.msg_conn.send((what, ['#test']))
-            self.blacklist.register(self.peer.host, False)
-
-        try:
-            if sys.version_info[0] >= 3:
-                text = text.decode()
-        except UnicodeDecodeError:
-            warning('Invalid encoding: ' + repr(text))
-            return
-
-        try:
-            section, cleartext_pw, data = text.split(';', 2)
-        except ValueError:
-            warning('Illegal format: ' + text)
-            return
-        try:
-            cipher_pw, channels = self.config.get(section)
-        except KeyError:
-            warning("No such section: " + section)
-            return
-        if crypt.crypt(cleartext_pw, cipher_pw) != cipher_pw:
-            warning('Bad password: ' + cleartext_pw)
-            return
-        if not channels:
-            warning('Empty channel list: ' + section)
-        self.log.debug("Sending " + data + " to: " + str(channels))
-        self.msg_conn.send((data, channels))
-        self.blacklist.register(self.peer.host, True)
-
-
-class IrccatFactory(protocol.Factory):
-    ''' Twisted factory producing a Protocol using buildProtocol. '''
-
-    def __init__(self, pipe):
-        self.pipe = pipe
-        self.blacklist = _Blacklist()
-        assert self.pipe[0].poll(), "No initial config!"
-        self.config = self.pipe[0].recv()
-
-    def buildProtocol(self, addr):
-        if self.pipe[0].poll():
-            self.config = self.pipe[0].recv()
-        return IrccatProtocol(self.config, self.blacklist, self.pipe[0])
+    def apply(self, delta):
+        ''' Update a copy of this config using delta(), not persistent. '''
+        section_name, section = delta
+        if section:
+            self._data[section_name] = section
+        else:
+            self._data.pop(section_name, None)
 
 
 class Irccat(callbacks.Plugin):
     '''
     Main plugin.
 
-    Runs the dataflow from TCP port -> irc in a separate thread,
-    governed by twisted's reactor.run(). Commands are executed in
-    main thread. The critical zone is self.config, a _Config instance.
+    Runs the dataflow from TCP port, Unix socket, UDP or HTTP -> irc in
+    a separate thread, fed by io_process(es) running the configured
+    backend. Commands are executed in main thread. The critical zone
+    is self.config, a _Config instance.
     '''
     # pylint: disable=E1101,R0904
 
     threaded = True
     admin = 'owner'       # The capability required to manage data.
+    WarnInterval = 60     # Min time between non-joined channel warnings.
+    PrefixReserve = 100   # Max length of our nick!user@host prefix.
+    TraceMax = 10000      # Max # of traced messages waiting to be sent.
+    SpoolTimeout = 5.0    # Max time reading pipes of stopped io_processes.
+    ParkTimeout = 10.0    # Time sockets and io_processes are kept after die().
+    SuperviseInterval = 1.0  # Liveness check interval, if no sentinel.
+    ErrorDelay = 1.0      # Pause after unexpected error in listener thread.
+    QueueTag = 'irccat'   # Tags our messages in the irc send queues.
 
     def __init__(self, irc):
         callbacks.Plugin.__init__(self, irc)
         self.log = log.getPluginLogger('irccat.irccat')
         self.config = _Config()
 
-        self.pipe = multiprocessing.Pipe()
-        self.pipe[1].send(self.config)
-        self.process = multiprocessing.Process(
-                            target = io_process,
-                            args = (self.config.port, self.config.interface, self.pipe))
-        self.process.start()
+        backend = self.config.backend
+        if backend == 'asyncio' and sys.version_info[0] < 3:
+            self.log.warning("No asyncio, using twisted backend.")
+            backend = 'twisted'
+        self.socks = _listen_sockets(self.config)
+        self.config_lock = threading.Lock()
+        self.worker_state = _worker_state(self.config, _BACKENDS[backend],
+                                          self.socks)
+        self.workers, retired = self._adopt_workers(_unpark_workers())
+        if not self.workers:
+            for i in range(self.config.workers):  # pylint: disable=W0612
+                worker = _Worker(_BACKENDS[backend],
+                                 [(key[0], sock) for key, sock in self.socks])
+                worker.start(self.config, [w.pipe[1] for w in self.workers])
+                self.workers.append(worker)
+        self.pipes = [w.pipe for w in self.workers]  # Dead ones closed.
+        self.processes = [w.process for w in self.workers]
+
+        self.routes = {}
+        self.routes_ircs = 0
+        self.routes_dirty = True
+        self.warned = {}
+        self.scheduler = ratelimit.FairScheduler(self.config.floodlimits,
+                                                 self.config.backlog,
+                                                 self.config.overflow)
+        self.metrics = metrics.Metrics()
+        self.metrics_server = None
+        self.traced = collections.OrderedDict()
+        self.trace_lock = threading.Lock()
+        self.slowlog = metrics.SlowLog(self.config.slowlog)
+        if self.config.metricsport:
+            self.metrics_server = metrics.serve(self.metrics,
+                                                self.config.metricsport)
+        self.diskspool = None
+        path, size, age, rate = self.config.diskspool
+        if path:
+            self.diskspool = diskspool.DiskSpool(path, size * 1024 * 1024,
+                                                 age)
+        self.replay_bucket = ratelimit.TokenBucket(rate, 1, time.time())
+        self.replay_turn = 0
+        self.repeats = ratelimit.RepeatFilter()
+        self.irc_queued = {}
+        self.irc_blocked = False
+        self.irc_held = False
+        if retired:
+            _drain_workers(retired, self._receive, self.SpoolTimeout)
 
         self.listen_abort = False
+        self.wakeup = os.pipe()
         self.thread = threading.Thread(target = self.listener_thread)
+        # A non-daemon thread blocks interpreter exit e. g., on SIGTERM.
+        self.thread.daemon = True
         self.thread.start()
+        # At exit multiprocessing kills the io_processes before world
+        # calls die(), have them spooled before that.
+        self.dead = False
+        self.finalizer = multiprocessing.util.Finalize(
+            None, self.die, kwargs = {'final': True}, exitpriority = 10)
 
     def listener_thread(self):
-        ''' Take messages from process, write them to irc.'''
+        '''
+        Take messages from the io_process(es), write them to irc, and
+        restart io_processes which die. Blocks until there is data in a
+        pipe, a process dies, the scheduler can release queued messages
+        to irc or die() writes to the wakeup pipe.
+        '''
+        replay_due = None
         while not self.listen_abort:
             try:
-                if not self.pipe[1].poll(0.5):
-                    continue
-                msg, channels = self.pipe[1].recv()
-                for channel in channels:
-                    for irc in world.ircs:
-                        if channel in irc.state.channels:
-                            if self.config.privmsg:
-                                irc.queueMsg(ircmsgs.privmsg(channel, msg))
-                            else:
-                                irc.queueMsg(ircmsgs.notice(channel, msg))
-                        else:
-                            self.log.warning(
-                                "Can't write to non-joined channel: " + channel)
-            except EOFError:
-                self.listen_abort = True
-            except Exception:
-                self.log.debug("LISTEN: Exception", exc_info = True)
-                self.listen_abort = True
+                now = time.time()
+                blocked = self._count_irc_queued()
+                due = [d for d in (self.repeats.next_due(now), replay_due,
+                                   self.scheduler.next_due(now, blocked))
+                       if d is not None]
+                due += [w.due - now for w in self.workers if w.due]
+                if [w for w in self.workers if not w.sentinel()]:
+                    due.append(self.SuperviseInterval)
+                timeout = max(min(due), 0) if due else None
+                alive = [w for w in self.workers if not w.due]
+                fds = [w.pipe[1] for w in alive] + \
+                    [w.sentinel() for w in alive if w.sentinel()]
+                readable = select.select(fds + [self.wakeup[0]], [], [],
+                                         timeout)[0]
+                if self.wakeup[0] in readable:
+                    os.read(self.wakeup[0], 512)
+                for worker in alive:
+                    self._read_worker(worker, readable)
+                self._supervise(time.time())
+                for section, channel, msg in \
+                        self.repeats.expired(time.time()):
+                    self.scheduler.put(section, channel, msg, priority =
+                                       self.config.priority(section))
+                self._release(self._count_irc_queued())
+                replay_due = self._replay(time.time())
+            except Exception:                        # pylint: disable=W0703
+                self.log.error("LISTEN: Exception", exc_info = True)
+                time.sleep(self.ErrorDelay)     # Don't spin on a bad state.
         self.log.debug("LISTEN: exiting")
 
-    def die(self, cmd = False):                   # pylint: disable=W0221
-        ''' Tear down reactor thread and die. '''
+    def _read_worker(self, worker, readable):
+        '''
+        Receive all messages from worker's pipe if readable. Release the
+        worker if it's dead, after reading what it sent.
+        '''
+        conn = worker.pipe[1]
+        try:
+            while conn in readable:
+                self._receive(conn.recv())
+                if not conn.poll():
+                    break
+            if worker.sentinel() not in readable and \
+                    (worker.sentinel() or worker.process.is_alive()):
+                return
+            while conn.poll():
+                self._receive(conn.recv())
+        except EOFError:
+            pass
+        worker.died(time.time())
+        self.metrics.inc('restarts')
+        self.log.error("io_process %d died (exit code %s), restarting in"
+                       " %.1fs" % (worker.process.pid, worker.exitcode,
+                                   worker.backoff))
+
+    def _supervise(self, now):
+        ''' Restart dead workers when due. '''
+        for worker in self.workers:
+            if worker.due and worker.due <= now:
+                self._restart(worker)
+
+    def _restart(self, worker):
+        '''
+        Start a new io_process for worker, with the current sections.
+        The listening sockets are kept open by main process, so clients
+        connecting meanwhile wait in the backlog.
+        '''
+        with self.config_lock:
+            worker.start(self.config,
+                         [w.pipe[1] for w in self.workers
+                          if w is not worker and not w.due])
+        worker.restarts += 1
+        self.pipes = [w.pipe for w in self.workers]
+        self.processes = [w.process for w in self.workers]
+        self.log.info("Restarted io_process, pid %d" % worker.process.pid)
+
+    def _invalidate_routes(self):
+        ''' Make next dispatch rebuild the routing index. '''
+        self.routes_dirty = True
+
+    def _build_routes(self):
+        '''
+        Rebuild the routing index: lower-case channel name -> list of
+        irc objects where we are joined to channel.
+        '''
+        self.routes_dirty = False
+        routes = {}
+        for irc in list(world.ircs):
+            # Copies, modified by the driver thread.
+            for channel in list(irc.state.channels):
+                routes.setdefault(ircutils.toLower(channel), []).append(irc)
+        self.routes = routes
+        self.routes_ircs = len(world.ircs)
+
+    def _release(self, blocked):
+        '''
+        Send the messages the scheduler releases, one at a time so that
+        _send() updates the counts used by blocked.
+        '''
+        self.irc_held = False
+        while True:
+            released = self.scheduler.ready(time.time(), 1, blocked)
+            if not released:
+                break
+            section, channel, msg, stamp = released[0]
+            try:
+                self._send(section, channel, msg, stamp)
+            except Exception:                        # pylint: disable=W0703
+                self.metrics.inc('dropped', channel)
+                self.log.error("Can't send to %s: %s" % (channel, msg),
+                               exc_info = True)
+        if not self.irc_held:
+            self.irc_blocked = False
+
+    def _count_irc_queued(self):
+        '''
+        Count our messages in each network's send queue. Return the
+        scheduler's blocked predicate, or None if ircqueue is unlimited.
+        Until nothing is held back outFilter wakes up the listener
+        thread as messages are sent.
+        '''
+        if not self.config.ircqueue:
+            return None
+        if self.routes_dirty or self.routes_ircs != len(world.ircs):
+            self._build_routes()
+        self.irc_blocked = True
+        self.irc_queued = {}
+        for irc in list(world.ircs):
+            queue = irc.queue
+            self.irc_queued[irc] = len(
+                [m for part in (queue.highpriority, queue.normal,
+                                queue.lowpriority)
+                 for m in list(part) if m.tagged(self.QueueTag)])
+        return self._irc_full
+
+    def _irc_full(self, channel):
+        '''
+        Return True if channel is joined on a network with ircqueue of
+        our messages in its send queue.
+        '''
+        for irc in self.routes.get(ircutils.toLower(channel), []):
+            if self.irc_queued.get(irc, 0) >= self.config.ircqueue:
+                self.irc_held = True
+                return True
+        return False
 
-        self.log.debug("Dying...")
-        self.process.terminate()
-        self.listen_abort = True
-        self.thread.join()
-        if not cmd:
+    def _irc_unblocked(self):
+        ''' Wake up listener thread if waiting for room in irc queues. '''
+        if self.irc_blocked and not self.listen_abort:
+            self.irc_blocked = False
+            os.write(self.wakeup[1], b'q')
+
+    def _warn_nonjoined(self, channel):
+        ''' Warn for writes to non-joined channel, at most once/interval. '''
+        now = time.time()
+        when, count = self.warned.get(channel, (0, 0))
+        if now - when < self.WarnInterval:
+            self.warned[channel] = (when, count + 1)
+            return
+        what = "Can't write to non-joined channel: " + channel
+        if count:
+            what += " (%d more messages dropped)" % count
+        self.log.warning(what)
+        self.warned[channel] = (now, 0)
+
+    def _receive(self, message):
+        ''' Handle a message from an io_process. '''
+        kind, data = message
+        if kind == 'metrics':
+            self.metrics.merge(data)
+            return
+        sent, batch = data
+        received = time.time()
+        self.metrics.inc('batches')
+        self.metrics.observe('pipe', None, received - sent)
+        for section, msg, channels, stamp in batch:
+            self.metrics.inc('queued', section)
+            self._schedule(section, msg, channels, (stamp, sent, received))
+
+    def _schedule(self, section, msg, channels, stamp):
+        '''
+        Queue msg for all channels in the flood control scheduler. Lines
+        from coalescing sections are split to fit in an irc message,
+        and joined with other lines for the same channel. Repeated lines
+        are suppressed within the section's dedup window.
+        '''
+        window = self.config.dedup(section)
+        priority = self.config.priority(section)
+        now = time.time()
+        for channel in channels:
+            if not self.repeats.check(section, channel, msg, window, now):
+                self.metrics.inc('repeated', channel)
+                continue
+            limit = 0
+            chunks = [msg]
+            if section in self.config.coalesce:
+                limit = 510 - len('PRIVMSG %s :' % channel) \
+                    - self.PrefixReserve
+                chunks = ratelimit.split_utf8(msg, limit)
+            for chunk in chunks:
+                if not self.scheduler.put(section, channel, chunk, limit,
+                                          stamp, priority):
+                    self.metrics.inc('dropped', channel)
+                    self.log.debug("Backlog full, dropping: %s", chunk)
+
+    def _send(self, section, channel, msg, stamp):
+        '''
+        Write msg to channel on all networks where it's joined. stamp is
+        (time read, time sent by io_process, time received) or None.
+        '''
+        if self.routes_dirty or self.routes_ircs != len(world.ircs):
+            self._build_routes()
+        ircs = self.routes.get(ircutils.toLower(channel))
+        if not ircs and self.diskspool:
+            try:
+                self.diskspool.append(ircutils.toLower(channel), section,
+                                      msg, stamp[0] if stamp else time.time())
+            except (IOError, OSError) as ex:
+                self.metrics.inc('dropped', channel)
+                self.log.error("Can't spool to %s: %s" % (channel, str(ex)))
+                return
+            self.metrics.inc('spooled', channel)
+            return
+        if not ircs:
+            self.metrics.inc('dropped', channel)
+            self._warn_nonjoined(channel)
+            return
+        for irc in ircs:
+            if self.config.privmsg:
+                ircmsg = ircmsgs.privmsg(channel, msg)
+            else:
+                ircmsg = ircmsgs.notice(channel, msg)
+            if self.config.tracing and stamp:
+                self._trace(ircmsg, section, stamp)
+            ircmsg.tag(self.QueueTag)
+            irc.queueMsg(ircmsg)
+            if self.config.ircqueue:
+                self.irc_queued[irc] = self.irc_queued.get(irc, 0) + 1
+        self.metrics.inc('dispatched', channel, len(ircs))
+        if stamp:
+            self.metrics.observe('latency', section, time.time() - stamp[0])
+
+    def _replay(self, now):
+        '''
+        Send a message from the disk spool to a joined channel, if the
+        replay rate permits and no live message is waiting. Channels
+        take turns. Return time until next replay, or None.
+        '''
+        if not self.diskspool or len(self.scheduler):
+            return None
+        if self.routes_dirty or self.routes_ircs != len(world.ircs):
+            self._build_routes()
+        channels = [c for c in self.diskspool.channels() if c in self.routes]
+        if not channels:
+            return None
+        if not self.replay_bucket.ready(now):
+            return self.replay_bucket.delay(now)
+        self.replay_turn = (self.replay_turn + 1) % len(channels)
+        channel = channels[self.replay_turn]
+        try:
+            taken = self.diskspool.take(channel, 1)
+        except (IOError, OSError) as ex:
+            self.metrics.inc('dropped', channel)
+            self.log.error("Can't replay to %s: %s" % (channel, str(ex)))
+            self.replay_bucket.take()
+            return self.replay_bucket.delay(now)
+        for when, section, msg in taken:
+            self.replay_bucket.take()
+            self.metrics.inc('replayed', channel)
+            self._send(section, channel, msg, None)
+        return self.replay_bucket.delay(now)
+
+    def _adopt_workers(self, parked):
+        '''
+        Return (adopted, retired) workers parked by the previous plugin
+        instance. They are adopted if running with the same state, and
+        sent the sections changed since they were parked.
+        '''
+        if not parked:
+            return [], []
+        state, workers, deltas = parked
+        if state != self.worker_state:
+            return [], workers
+        parked_sections = dict(deltas)
+        for name in set(parked_sections) | set(self.config.keys()):
+            delta = self.config.delta(name)
+            if getattr(parked_sections.get(name), '__dict__', None) == \
+                    getattr(delta[1], '__dict__', None):
+                continue
+            for worker in workers:
+                if not worker.due:
+                    worker.pipe[1].send(delta)
+        self.log.debug("Adopted %d io_process(es)" % len(workers))
+        return workers, []
+
+    def _spool_pending(self):
+        '''
+        Save lines waiting for flood control in the disk spool. Lines
+        still in the pipes are left to the next plugin instance, or
+        spooled by _retire_workers() if there is none.
+        '''
+        for section, channel, msg, stamp in self.scheduler.drain():
+            self.diskspool.append(ircutils.toLower(channel), section, msg,
+                                  stamp[0] if stamp else time.time())
+
+    def _trace(self, ircmsg, section, stamp):
+        '''
+        Remember ircmsg queued now, until outFilter sees it. Messages
+        are copied before outFilter, so they are matched by contents.
+        '''
+        key = (ircmsg.command, tuple(ircmsg.args))
+        with self.trace_lock:
+            self.traced.setdefault(key, []).append(
+                (section, stamp, time.time()))
+            while len(self.traced) > self.TraceMax:
+                self.traced.popitem(last = False)
+
+    def outFilter(self, irc, msg):
+        '''
+        Record stage times for traced messages sent to server, wake up
+        listener thread if waiting for room in the irc queues.
+        '''
+        self._irc_unblocked()
+        if not self.traced:
+            return msg
+        key = (msg.command, tuple(msg.args))
+        with self.trace_lock:
+            traces = self.traced.get(key)
+            if not traces:
+                return msg
+            section, stamp, queued = traces.pop(0)
+            if not traces:
+                del self.traced[key]
+        now = time.time()
+        read, sent, received = stamp
+        stages = (sent - read, received - sent, queued - received,
+                  now - queued)
+        section = section or '-'
+        for stage, value in zip(metrics.Stages, stages):
+            if stage != 'pipe':
+                self.metrics.observe(stage, section, value)
+        self.metrics.observe('total', section, now - read)
+        self.slowlog.add(now - read,
+                         (section, msg.args[0], msg.args[1][:60], stages))
+        return msg
+
+    def doJoin(self, irc, msg):
+        '''
+        Update routing index when we join a channel, wake up listener
+        to replay spooled messages.
+        '''
+        if ircutils.strEqual(msg.nick, irc.nick):
+            self._invalidate_routes()
+            if self.diskspool:
+                os.write(self.wakeup[1], b'j')
+
+    def doPart(self, irc, msg):
+        ''' Update routing index when we leave a channel. '''
+        if ircutils.strEqual(msg.nick, irc.nick):
+            self._invalidate_routes()
+
+    def doKick(self, irc, msg):
+        ''' Update routing index when we are kicked from a channel. '''
+        for nick in msg.args[1].split(','):
+            if ircutils.strEqual(nick, irc.nick):
+                self._invalidate_routes()
+
+    def do001(self, irc, msg):
+        ''' Update routing index when connecting to a network. '''
+        self._invalidate_routes()
+
+    def reset(self):
+        '''
+        Update routing index when a network connection is reset, which
+        also empties its send queue.
+        '''
+        self._invalidate_routes()
+        self._irc_unblocked()
+
+    def _update(self, func, section_name, *args, **kwargs):
+        '''
+        Run config method func(section_name, ...), send the updated
+        section to all running io_processes. Serialized with restarts,
+        which send the complete config.
+        '''
+        with self.config_lock:
+            func(section_name, *args, **kwargs)
+            delta = self.config.delta(section_name)
+            for worker in self.workers:
+                if not worker.due:
+                    worker.pipe[1].send(delta)
+
+    def die(self, cmd = False, final = False):    # pylint: disable=W0221
+        '''
+        Tear down reactor thread and die. Unless final, i. e. the bot is
+        stopping, the io_processes are parked for the next instance.
+        '''
+        if not self.dead:
+            self._teardown(final or world.dying)
+        if not cmd and not final:
             callbacks.Plugin.die(self)
 
-    def sectiondata(self, irc, msg, args, section_name, password, channels):
-        """ <section name> <password> <channel[,channel...]>
+    def _teardown(self, final):
+        '''
+        Stop the listener thread, save lines waiting for flood control
+        in the spool. If final, stop the io_processes spooling what they
+        have received, else park them and the sockets.
+        '''
+        self.log.debug("Dying...")
+        self.dead = True
+        self.finalizer.cancel()
+        self.listen_abort = True            # No more restarts.
+        os.write(self.wakeup[1], b'x')
+        self.thread.join()
+        for fd in self.wakeup:
+            os.close(fd)
+        if self.diskspool:
+            self._spool_pending()
+            self.diskspool.close()
+        if final:
+            _retire_workers(self.workers, self.config.diskspool,
+                            self.SpoolTimeout)
+        else:
+            retire = functools.partial(_retire_workers,
+                                       spool = self.config.diskspool,
+                                       timeout = self.SpoolTimeout)
+            _park_workers(self.worker_state, self.workers,
+                          [self.config.delta(n) for n in self.config.keys()],
+                          self.ParkTimeout, retire)
+        for key, sock in self.socks:
+            _park_socket(sock, key[0], key[1], self.ParkTimeout)
+        if self.metrics_server:
+            self.metrics_server.shutdown()
+            self.metrics_server.server_close()
+        self.config.close()
+
+    def sectiondata(self, irc, msg, args, section_name, password, channels,
+                    priority):
+        """ <section name> <password> <channel[,channel...]> [high|normal|low]
 
         Update a section with name, password and a comma-separated list
         of channels which should be connected to this section. Creates
-        new section if it doesn't exist.
+        new section if it doesn't exist. Messages from sections with
+        higher priority are sent first when irc can't keep up; an
+        existing section keeps its priority unless given.
         """
         salts = 'abcdcefghijklmnopqrstauvABCDEFGHIJKLMNOPQRSTUVXYZ123456789'
 
-        salt = random.choice(salts) + random.choice(salts)
-        cipher_pw = crypt.crypt(password, salt)
-        self.config.update(section_name, cipher_pw, channels)
-        self.pipe[1].send(self.config)
+        try:
+            cipher_pw = self.config.get(section_name)[0]
+        except KeyError:
+            cipher_pw = None
+        # An unchanged password keeps its cipher, and thus AUTH sessions.
+        if not cipher_pw or crypt.crypt(password, cipher_pw) != cipher_pw:
+            salt = random.choice(salts) + random.choice(salts)
+            cipher_pw = crypt.crypt(password, salt)
+        attrs = {'priority': priority} if priority else {}
+        self._update(self.config.update, section_name, cipher_pw, channels,
+                     **attrs)
         irc.replySuccess()
 
-    sectiondata = wrap(sectiondata, [admin,
-                                     'somethingWithoutSpaces',
-                                     'somethingWithoutSpaces',
-                                     commalist('validChannel')])
+    sectiondata = wrap(sectiondata,
+                       [admin, 'somethingWithoutSpaces',
+                        'somethingWithoutSpaces', commalist('validChannel'),
+                        optional(('literal',
+                                  ratelimit.FairScheduler.Priorities))])
 
     def sectionkill(self, irc, msg, args, section_name):
         """ <section name>
@@ -338,15 +1077,33 @@ class Irccat(callbacks.Plugin):
         """
 
         try:
-            self.config.remove(section_name)
+            self._update(self.config.remove, section_name)
         except KeyError:
             irc.reply("Error: no such section")
             return
-        self.pipe[1].send(self.config)
         irc.replySuccess()
 
     sectionkill = wrap(sectionkill, [admin, 'somethingWithoutSpaces'])
 
+    def sectiondedup(self, irc, msg, args, section_name, window):
+        """ <section name> <seconds>
+
+        Suppress repeated lines from a section: a line already sent to a
+        channel within <seconds> is not sent again. Instead, a summary
+        "<line> (repeated N times)" is sent when the time has passed.
+        0 disables.
+        """
+        try:
+            self._update(self.config.configure, section_name,
+                         dedup = window)
+        except KeyError:
+            irc.reply("Error: no such section")
+            return
+        irc.replySuccess()
+
+    sectiondedup = wrap(sectiondedup, [admin, 'somethingWithoutSpaces',
+                                       'nonNegativeInt'])
+
     def sectionshow(self, irc, msg, args, section_name):
         """ <section name>
 
@@ -359,6 +1116,12 @@ class Irccat(callbacks.Plugin):
             irc.reply("Error: no such section")
             return
         msg = password + ' ' + ','.join(channels)
+        dedup = self.config.dedup(section_name)
+        if dedup:
+            msg += ' dedup %ds' % dedup
+        priority = self.config.priority(section_name)
+        if priority != _Section.priority:
+            msg += ' priority ' + priority
         irc.reply(msg)
 
     sectionshow = wrap(sectionshow, [admin, 'somethingWithoutSpaces'])
@@ -373,6 +1136,109 @@ class Irccat(callbacks.Plugin):
 
     sectionlist = wrap(sectionlist, [admin])
 
+    def sectionstats(self, irc, msg, args, section_name):
+        """ [section name]
+
+        Show message counters and latencies, for all sections or for
+        the given one.
+        """
+
+        def latency(section):
+            ''' Return latency summary for section. '''
+            hist = self.metrics.histogram('latency', section)
+            return 'p50 %.1fms p99 %.1fms max %.1fms' % (
+                    hist.percentile(0.5) * 1000,
+                    hist.percentile(0.99) * 1000,
+                    hist.max * 1000)
+
+        counts = self.metrics
+        if section_name:
+            try:
+                channels = self.config.get(section_name)[1]
+            except KeyError:
+                irc.reply("Error: no such section")
+                return
+            reply = '%s: sent %d, spool dropped %d, queued %d, latency %s; ' \
+                % (section_name, counts.count('sent', section_name),
+                   counts.count('spooldropped', section_name),
+                   counts.count('queued', section_name),
+                   latency(section_name))
+            reply += ', '.join(['%s: dispatched %d dropped %d' % (
+                                    c, counts.count('dispatched', c),
+                                    counts.count('dropped', c))
+                                for c in channels])
+            irc.reply(reply)
+            return
+        rejected = sorted(counts.labels('rejected').items())
+        rejected = ', '.join(['%s: %d' % r for r in rejected])
+        reply = 'received %d, rejected %d (%s), spool full %d, batches %d,' \
+                ' dispatched %d, dropped %d, pipe p99 %.1fms' % (
+                    counts.count('received'), counts.count('rejected'),
+                    rejected, counts.count('spoolfull'),
+                    counts.count('batches'),
+                    counts.count('dispatched'), counts.count('dropped'),
+                    counts.histogram('pipe').percentile(0.99) * 1000)
+        queued = counts.labels('queued')
+        for section in sorted([s for s in queued.keys() if s]):
+            reply += '; %s: %d lines, %s' % (section, queued[section],
+                                             latency(section))
+        irc.reply(reply)
+
+    sectionstats = wrap(sectionstats, [admin,
+                                       optional('somethingWithoutSpaces')])
+
+    def sectionhealth(self, irc, msg, args):
+        """ <takes no arguments>
+
+        Show whether the relay is up: the io_processes, how often they
+        have been restarted, and the thread relaying their lines to irc.
+        """
+        now = time.time()
+        up = [w for w in self.workers if not w.due]
+        relaying = self.thread.is_alive()
+        if relaying and len(up) == len(self.workers):
+            status = 'ok'
+        elif relaying and up:
+            status = 'degraded'
+        else:
+            status = 'down'
+        reply = '%s: workers %d/%d up, relay %s' % (
+            status, len(up), len(self.workers),
+            'up' if relaying else 'down')
+        for i, worker in enumerate(self.workers):
+            if worker.due:
+                state = 'down (exit code %s), restart in %.1fs' % (
+                    worker.exitcode, max(worker.due - now, 0))
+            else:
+                state = 'pid %d up %ds' % (worker.process.pid,
+                                           now - worker.started)
+            reply += '; worker %d: %s, restarts %d' % (i + 1, state,
+                                                       worker.restarts)
+        irc.reply(reply)
+
+    sectionhealth = wrap(sectionhealth, [admin])
+
+    def sectionslow(self, irc, msg, args):
+        """ <takes no arguments>
+
+        Show the slowest messages since plugin was loaded, and where the
+        time was spent. Requires plugins.irccat.tracing.
+        """
+        if not self.config.tracing:
+            irc.reply("Error: tracing is disabled")
+            return
+        entries = []
+        for total, (section, channel, text, stages) in self.slowlog.entries():
+            slowest = max(zip(stages, metrics.Stages))
+            stagetimes = ' '.join(['%s %.1fms' % (stage, value * 1000)
+                                   for value, stage in zip(stages,
+                                                           metrics.Stages)])
+            entries.append('%.1fms %s %s "%s" (mostly %s: %s)' % (
+                total * 1000, section, channel, text, slowest[1], stagetimes))
+        irc.reply('; '.join(entries) if entries else 'No traced messages')
+
+    sectionslow = wrap(sectionslow, [admin])
+
     def sectionhelp(self, irc, msg, args):
         """ <takes no argument>
 
@@ -0,0 +1,344 @@
+###
+# Copyright (c) 2013, Alec Leamas
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice,
+#     this list of conditions, and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice,
+#     this list of conditions, and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#   * Neither the name of the author of this software nor the name of
+#     contributors to this software may be used to endorse or promote products
+#     derived from this software without specific prior written consent.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+'''
+Flood control: token buckets, a fair scheduler, line coalescing and
+repeat suppression used by the main process before messages are queued
+to irc.
+'''
+
+import collections
+
+from supybot import ircutils
+
+
+def split_utf8(text, limit):
+    ''' Split text in chunks of max limit bytes on utf-8 boundaries. '''
+    data = text if isinstance(text, bytes) else text.encode('utf-8')
+    if len(data) <= limit:
+        return [text]
+    chunks = []
+    while data:
+        end = min(limit, len(data))
+        if end < len(data):
+            while end > 0 and (ord(data[end:end + 1]) & 0xc0) == 0x80:
+                end -= 1
+            end = end or limit
+        chunk, data = data[:end], data[end:]
+        chunks.append(chunk if isinstance(text, bytes)
+                           else chunk.decode('utf-8'))
+    return chunks
+
+
+class TokenBucket(object):
+    ''' Classic token bucket, rate tokens/s up to burst tokens. '''
+
+    def __init__(self, rate, burst, now):
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self.tokens = float(self.burst)
+        self.when = now
+
+    def _refill(self, now):
+        ''' Add tokens for time elapsed since last refill. '''
+        if now > self.when:
+            self.tokens = min(self.burst,
+                              self.tokens + (now - self.when) * self.rate)
+        self.when = now
+
+    def ready(self, now):
+        ''' Return True if there is a token available. '''
+        if self.rate <= 0:
+            return True
+        self._refill(now)
+        return self.tokens >= 1
+
+    def take(self):
+        ''' Consume a token, ready() must have returned True. '''
+        if self.rate > 0:
+            self.tokens -= 1
+
+    def delay(self, now):
+        ''' Return time until next token is available. '''
+        if self.ready(now):
+            return 0
+        return (1 - self.tokens) / self.rate
+
+
+class FairScheduler(object):
+    '''
+    Holds a bounded backlog of (channel, msg) per section and releases
+    messages when both the section's and the channel's token bucket
+    permit. Sections are served round-robin, one message per turn, so
+    a noisy section can't starve the others. Messages for one section
+    are released in order.
+
+    Each section has a priority, and sections with the same priority
+    form a lane. A lane is only served when no higher lane has a
+    message ready, except that a lane passed over StarveLimit times in
+    a row gets the next turn. Thus lower lanes get at least about one
+    message in StarveLimit + 1 also when higher lanes are saturated.
+
+    When a section's backlog is full new messages are dropped. Using
+    the 'summarize' policy a "... N more lines suppressed" message is
+    sent to each affected channel once the backlog is drained.
+
+    Messages put with a limit are coalesced with the last queued
+    message for the same channel, if the result fits in limit bytes.
+
+    Each message carries an opaque stamp, returned by ready(). For
+    coalesced messages it's the stamp of the first one.
+
+    A section whose first message is for a channel blocked by the
+    caller, e. g. because the bot's send queue is full, is passed over
+    as if not ready.
+    '''
+
+    Separator = ' | '
+
+    Policies = ('drop', 'summarize')
+
+    Priorities = ('high', 'normal', 'low')    # Lanes, served in order.
+
+    StarveLimit = 10      # Max turns a lane with a ready message waits.
+
+    def __init__(self, limits, backlog, policy):
+        self.section_rate, self.section_burst, \
+            self.channel_rate, self.channel_burst = limits
+        self.backlog = backlog
+        self.policy = policy
+        self._queues = collections.OrderedDict()
+        self._lanes = {}
+        self._passed = [0] * len(self.Priorities)
+        self._tails = {}
+        self._suppressed = {}
+        self._section_buckets = {}
+        self._channel_buckets = {}
+        self.dropped = 0
+
+    def _bucket(self, buckets, key, rate, burst, now):
+        ''' Return bucket for key, creating it if required. '''
+        try:
+            return buckets[key]
+        except KeyError:
+            buckets[key] = TokenBucket(rate, burst, now)
+            return buckets[key]
+
+    def _coalesce(self, section, channel, msg, limit):
+        ''' Try to append msg to last queued message, return success. '''
+        tail = self._tails.get((section, ircutils.toLower(channel)))
+        if not tail:
+            return False
+        text = tail[1] + self.Separator + msg
+        if len(text.encode('utf-8')) > limit:
+            return False
+        tail[1] = text
+        return True
+
+    def put(self, section, channel, msg, limit = 0, stamp = None,
+            priority = 'normal'):
+        ''' Queue msg for channel, or drop it if backlog is full. '''
+        self._lanes[section] = self.Priorities.index(priority)
+        queue = self._queues.get(section)
+        if queue is None:
+            queue = collections.deque()
+            self._queues[section] = queue
+        if limit and self._coalesce(section, channel, msg, limit):
+            return True
+        if len(queue) >= self.backlog:
+            self.dropped += 1
+            suppressed = self._suppressed.setdefault(section, {})
+            suppressed[channel] = suppressed.get(channel, 0) + 1
+            return False
+        item = [channel, msg, stamp]
+        queue.append(item)
+        if limit:
+            self._tails[(section, ircutils.toLower(channel))] = item
+        return True
+
+    def _summarize(self, section):
+        ''' Queue suppressed lines messages for drained section. '''
+        suppressed = self._suppressed.pop(section, {})
+        if self.policy != 'summarize':
+            return
+        for channel, count in suppressed.items():
+            self._queues[section].append(
+                [channel, '... %d more lines suppressed' % count, None])
+
+    def _head_delay(self, section, now):
+        ''' Return time until first message for section can be sent. '''
+        channel = self._queues[section][0][0]
+        sbucket = self._bucket(self._section_buckets, section,
+                               self.section_rate, self.section_burst, now)
+        cbucket = self._bucket(self._channel_buckets,
+                               ircutils.toLower(channel),
+                               self.channel_rate, self.channel_burst, now)
+        return max(sbucket.delay(now), cbucket.delay(now))
+
+    def _next(self, now, blocked):
+        '''
+        Return (section, queue) to serve next, or None if no message can
+        be sent at now. The first ready section in each lane is a
+        candidate. Warnings use the None section.
+        '''
+        candidates = {}
+        for section in list(self._queues.keys()):
+            if not self._queues[section] and section in self._suppressed:
+                self._summarize(section)
+            if not self._queues[section]:
+                del self._queues[section]
+                del self._lanes[section]
+                continue
+            lane = self._lanes[section]
+            if lane not in candidates \
+                    and self._head_delay(section, now) <= 0 \
+                    and not self._blocked(section, blocked):
+                candidates[lane] = (section, self._queues[section])
+        waiting = sorted(candidates.keys())
+        if not waiting:
+            return None
+        lane = waiting[0]
+        for other in waiting[1:]:
+            if self._passed[other] >= self.StarveLimit:
+                lane = other
+                break
+        for other in range(len(self._passed)):
+            if other == lane or other not in waiting:
+                self._passed[other] = 0
+            elif other > lane:
+                self._passed[other] += 1
+        return candidates[lane]
+
+    def _blocked(self, section, blocked):
+        ''' Return True if blocked(channel) holds back first message. '''
+        return blocked is not None and blocked(self._queues[section][0][0])
+
+    def ready(self, now, limit = None, blocked = None):
+        '''
+        Return list of (section, channel, msg, stamp) to send, at most
+        limit of them unless None. Messages for channels where blocked,
+        unless None, returns True are held back.
+        '''
+        released = []
+        while limit is None or len(released) < limit:
+            candidate = self._next(now, blocked)
+            if candidate is None:
+                break
+            section, queue = candidate
+            item = queue.popleft()
+            channel, msg, stamp = item
+            key = (section, ircutils.toLower(channel))
+            if self._tails.get(key) is item:
+                del self._tails[key]
+            self._section_buckets[section].take()
+            self._channel_buckets[ircutils.toLower(channel)].take()
+            released.append((section, channel, msg, stamp))
+            self._queues[section] = self._queues.pop(section)   # Round-robin.
+        return released
+
+    def drain(self):
+        ''' Remove and return all queued (section, channel, msg, stamp). '''
+        drained = []
+        for section, queue in self._queues.items():
+            drained.extend([(section, c, m, s) for c, m, s in queue])
+        self._queues.clear()
+        self._lanes.clear()
+        self._tails.clear()
+        self._suppressed.clear()
+        return drained
+
+    def next_due(self, now, blocked = None):
+        ''' Return time until ready() might release anything, or None. '''
+        delays = [self._head_delay(section, now)
+                      for section, queue in self._queues.items()
+                      if queue and not self._blocked(section, blocked)]
+        return min(delays) if delays else None
+
+    def __len__(self):
+        return sum([len(q) for q in self._queues.values()])
+
+
+class RepeatFilter(object):
+    '''
+    Suppresses repeated messages. For each (section, channel) the hashes
+    of messages seen within the section's window are kept, oldest first,
+    with a count of suppressed copies. When the window of a message with
+    copies expires a single "<msg> (repeated N times)" summary is
+    released. Each message costs a dict lookup plus amortized expiry.
+    '''
+
+    MaxEntries = 1024     # Max messages remembered per section+channel.
+
+    def __init__(self):
+        self._seen = {}
+        self._released = []
+
+    def _expire(self, key, now):
+        ''' Drop expired entries for key, saving their summaries. '''
+        seen = self._seen[key]
+        while seen:
+            digest, entry = next(iter(seen.items()))
+            if entry[0] > now and len(seen) <= self.MaxEntries:
+                break
+            del seen[digest]
+            expires, count, channel, msg = entry    # pylint: disable=W0612
+            if count:
+                self._released.append(
+                    (key[0], channel, '%s (repeated %d times)' % (msg, count)))
+        if not seen:
+            del self._seen[key]
+
+    def check(self, section, channel, msg, window, now):
+        ''' Return True if msg should be sent, False if it's a repeat. '''
+        if window <= 0:
+            return True
+        key = (section, ircutils.toLower(channel))
+        if key in self._seen:
+            self._expire(key, now)
+        seen = self._seen.setdefault(key, collections.OrderedDict())
+        digest = hash(msg)
+        if digest in seen:
+            seen[digest][1] += 1
+            return False
+        seen[digest] = [now + window, 0, channel, msg]
+        return True
+
+    def expired(self, now):
+        ''' Return list of (section, channel, summary) due at now. '''
+        for key in list(self._seen.keys()):
+            self._expire(key, now)
+        released, self._released = self._released, []
+        return released
+
+    def next_due(self, now):
+        ''' Return time until expired() might release anything, or None. '''
+        due = [next(iter(seen.values()))[0] for seen in self._seen.values()]
+        return max(min(due) - now, 0) if due else None
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
@@ -0,0 +1,253 @@
+###
+# Copyright (c) 2013, Alec Leamas
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice,
+#     this list of conditions, and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice,
+#     this list of conditions, and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#   * Neither the name of the author of this software nor the name of
+#     contributors to this software may be used to endorse or promote products
+#     derived from this software without specific prior written consent.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+'''
+Persistent section storage. Each store maps a section name to a dict
+of section attributes, and writes each change on its own, atomically.
+
+Two backends are available, selected by plugins.irccat.sectionstore:
+
+  - sqlite: A sqlite database, one row per section.
+  - journal: An append-only file with one json record per change,
+    compacted in a background thread when mostly garbage.
+'''
+
+import json
+import os
+import os.path
+import threading
+
+from supybot import log
+
+try:
+    import sqlite3
+except ImportError:
+    sqlite3 = None
+
+
+class StoreError(Exception):
+    ''' Raised when a store can't be opened or read. '''
+
+
+class SqliteStore(object):
+    ''' Sections stored in a sqlite database. '''
+
+    suffix = '.sqlite'
+
+    def __init__(self, path):
+        if not sqlite3:
+            raise StoreError("sqlite3 is not available")
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = None
+        try:
+            self._db = sqlite3.connect(path, check_same_thread = False)
+            with self._db:
+                self._db.execute('CREATE TABLE IF NOT EXISTS sections'
+                                 ' (name TEXT PRIMARY KEY, data TEXT)')
+        except sqlite3.Error as ex:
+            if self._db:
+                self._db.close()
+            raise StoreError(str(ex))
+
+    def load(self):
+        ''' Return dict of all sections. '''
+        with self._lock:
+            try:
+                rows = self._db.execute('SELECT name, data FROM sections')
+                return dict([(name, json.loads(data))
+                             for name, data in rows.fetchall()])
+            except (sqlite3.Error, ValueError) as ex:
+                raise StoreError(str(ex))
+
+    def put(self, name, data):
+        ''' Store data for section name, replacing any existing. '''
+        self.put_many([(name, data)])
+
+    def put_many(self, items):
+        ''' Store a list of (name, data) in a single transaction. '''
+        with self._lock:
+            with self._db:
+                self._db.executemany(
+                    'INSERT OR REPLACE INTO sections VALUES (?, ?)',
+                    [(name, json.dumps(data)) for name, data in items])
+
+    def delete(self, name):
+        ''' Remove section name. '''
+        with self._lock:
+            with self._db:
+                self._db.execute('DELETE FROM sections WHERE name = ?',
+                                 (name,))
+
+    def close(self):
+        ''' Release resources. '''
+        with self._lock:
+            self._db.close()
+
+
+class JournalStore(object):
+    '''
+    Sections stored as a journal, one json record per line and change.
+    Each record is written with a single write() and fsync()'d. A
+    truncated last line after a crash is ignored when loading.
+    '''
+
+    suffix = '.journal'
+    CompactMin = 1000     # Never compact journals smaller than this.
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._data = {}
+        self._records = 0
+        self._compactor = None
+        self._pending = None
+        try:
+            self._file = open(path, 'a')
+        except IOError as ex:
+            raise StoreError(str(ex))
+
+    def load(self):
+        ''' Return dict of all sections. '''
+        data = {}
+        records = 0
+        with open(self.path) as f:
+            lines = f.read().split('\n')
+        for lineno, line in enumerate(lines, 1):
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                if lineno != len(lines):
+                    raise StoreError(
+                        "Bad record at %s:%d" % (self.path, lineno))
+                # Truncated by a crash while writing, drop it.
+                with open(self.path, 'r+') as f:
+                    f.truncate(sum([len(record) + 1 for record in lines[:-1]]))
+                break
+            records += 1
+            if record['data'] is None:
+                data.pop(record['name'], None)
+            else:
+                data[record['name']] = record['data']
+        with self._lock:
+            self._data = data
+            self._records = records
+        return dict(data)
+
+    def _append(self, records):
+        ''' Write records to journal, maybe start compacting. '''
+        text = ''.join([json.dumps(r) + '\n' for r in records])
+        with self._lock:
+            self._file.write(text)
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            for r in records:
+                if r['data'] is None:
+                    self._data.pop(r['name'], None)
+                else:
+                    self._data[r['name']] = r['data']
+            self._records += len(records)
+            if self._pending is not None:
+                self._pending.extend(records)
+            elif self._records > max(self.CompactMin, 2 * len(self._data)):
+                self._pending = []
+                self._compactor = threading.Thread(
+                    target = self._compact, args = (dict(self._data),))
+                self._compactor.daemon = True
+                self._compactor.start()
+
+    def _compact(self, data):
+        '''
+        Replace journal with a snapshot of data + pending records. On
+        errors the journal, which has all records, is kept.
+        '''
+        tmp = self.path + '.tmp'
+        try:
+            with open(tmp, 'w') as f:
+                for name, value in data.items():
+                    f.write(json.dumps({'name': name, 'data': value}) + '\n')
+                with self._lock:
+                    for r in self._pending:
+                        f.write(json.dumps(r) + '\n')
+                    f.flush()
+                    os.fsync(f.fileno())
+                    os.rename(tmp, self.path)
+                    self._file.close()
+                    self._file = open(self.path, 'a')
+                    self._records = len(data) + len(self._pending)
+        except Exception as ex:                      # pylint: disable=W0703
+            log.getPluginLogger('irccat.store').error(
+                "Can't compact %s: %s" % (self.path, str(ex)),
+                exc_info = True)
+        finally:
+            with self._lock:
+                self._pending = None
+
+    def put(self, name, data):
+        ''' Store data for section name, replacing any existing. '''
+        self._append([{'name': name, 'data': data}])
+
+    def put_many(self, items):
+        ''' Store a list of (name, data) in a single write. '''
+        self._append([{'name': n, 'data': d} for n, d in items])
+
+    def delete(self, name):
+        ''' Remove section name. '''
+        self._append([{'name': name, 'data': None}])
+
+    def close(self):
+        ''' Wait for any compacting, release resources. '''
+        if self._compactor:
+            self._compactor.join()
+        with self._lock:
+            self._file.close()
+
+
+Backends = {'sqlite': SqliteStore, 'journal': JournalStore}
+
+
+def store_path(kind, path):
+    '''
+    Return the file used by a store of given kind for path. If path ends
+    with .pickle, as the legacy plugins.irccat.sectionspath, the store's
+    file suffix is used instead.
+    '''
+    if path.endswith('.pickle'):
+        path = path[:-len('.pickle')]
+    return path + Backends[kind].suffix
+
+
+def open_store(kind, path):
+    ''' Return store of given kind for path, see store_path(). '''
+    return Backends[kind](store_path(kind, path))
+
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
@@ -37,21 +37,42 @@
 # pylint: disable=R0904
 
 
+import crypt
+import glob
+import json
 import os
 import os.path
+import pickle
+import shutil
+import signal
 import socket
 import subprocess
+import sys
 
 from supybot.test import *
 
+try:
+    from http.client import HTTPConnection
+except ImportError:
+    from httplib import HTTPConnection
+
 from . import config
+from . import diskspool
+from . import listener
+from . import metrics
+from . import ratelimit
+from . import store
 from . import plugin as irccat
 
 CLIENT = os.path.join(os.path.dirname(__file__), 'irccat')
+UNIXSOCKET = 'test-irccat.sock'
 
 def clear_sections(testcase):
-    if os.path.exists('test-sections.pickle'):
-        os.unlink('test-sections.pickle')
+    parked = irccat._unpark_workers()   # Each test gets new io_processes.
+    if parked:
+        irccat._stop_workers(parked[1])
+    for path in glob.glob('test-sections.*'):
+        os.unlink(path)
     config.global_option('sectionspath').setValue('test-sections.pickle')
     config.global_option('port').setValue(23456)
 
@@ -105,6 +126,175 @@ class IrccatTestCopy(ChannelPluginTestCase):
         self.assertIsNot(result, None)
         self.assertEqual(result.args[1], 'ivar data')
 
+    def testAuth(self):
+        communicate(b'AUTH ivar ivarpw\nline 1\nline;2\n', sendonly=True)
+        self.assertResponse(' ', 'line 1')
+        self.assertResponse(' ', 'line;2')
+
+    def testAuthUpdate(self):
+        s = socket.create_connection(('localhost', 23456))
+        try:
+            s.sendall(b'AUTH ivar ivarpw\nline 1\n')
+            self.assertResponse(' ', 'line 1')
+            self.assertNotError('sectiondata ivar ivarpw2 #test',
+                                private = True)
+            time.sleep(0.1)
+            s.sendall(b'line 2\n')
+            self.assertRegexp(' ', 'Section removed or updated.*')
+        finally:
+            s.close()
+
+    def testAuthSamePw(self):
+        s = socket.create_connection(('localhost', 23456))
+        try:
+            s.sendall(b'AUTH ivar ivarpw\nline 1\n')
+            self.assertResponse(' ', 'line 1')
+            self.assertNotError('sectiondata ivar ivarpw #test high',
+                                private = True)
+            time.sleep(0.1)
+            s.sendall(b'line 2\n')
+            self.assertResponse(' ', 'line 2')
+        finally:
+            s.close()
+
+    def testAuthBadPw(self):
+        communicate(b'AUTH ivar ivarpw22\nline 1\n', sendonly=True)
+        self.assertRegexp(' ', 'Bad password.*')
+        self.assertNoResponse(' ', 1)
+
+    def testReload(self):
+        socks = self.irc.getCallback('Irccat').socks
+        self.assertNotError('reload Irccat', private = True)
+        self.assertEqual(self.irc.getCallback('Irccat').socks, socks)
+        communicate(b'ivar;ivarpw;ivar data\n', sendonly=True)
+        self.assertResponse(' ', 'ivar data')
+
+    def testLean(self):
+        self.assertNotIn('twisted.internet.reactor', sys.modules)
+
+    def testDispatchDelay(self):
+        plugin = self.irc.getCallback('Irccat')
+        queue_msg = self.irc.queueMsg
+        delays = []
+        done = threading.Event()
+
+        def timed_queue_msg(msg):
+            delays.append(time.time() - float(msg.args[1]))
+            queue_msg(msg)
+            done.set()
+
+        self.irc.queueMsg = timed_queue_msg
+        conn = plugin.pipes[0][0]
+        try:
+            for i in range(50):                 # pylint: disable=W0612
+                done.clear()
+                now = time.time()
+                conn.send(('lines', (now, [('ivar', repr(now), ['#test'],
+                                             now)])))
+                self.assertTrue(done.wait(1))
+                self.irc.takeMsg()              # Room in irc queue.
+        finally:
+            self.irc.queueMsg = queue_msg
+        delays.sort()
+        self.assertLess(delays[len(delays) // 2], 0.01)
+
+    def testDispatchError(self):
+        plugin = self.irc.getCallback('Irccat')
+        send = plugin._send
+
+        def failing_send(*args):
+            plugin._send = send
+            raise RuntimeError("Dispatch failure")
+
+        plugin._send = failing_send
+        communicate(b'ivar;ivarpw;line 1\n', sendonly=True)
+        communicate(b'ivar;ivarpw;line 2\n', sendonly=True)
+        self.assertResponse(' ', 'line 2')
+        self.assertTrue(plugin.thread.is_alive())
+
+    def testStats(self):
+        communicate(b'ivar;ivarpw;ivar data\n', sendonly=True)
+        communicate(b'ivar;ivarpw22;ivar data\n', sendonly=True)
+        self.assertResponse(' ', 'ivar data')
+        self.getMsg(' ')
+        time.sleep(1.2)
+        self.assertRegexp('sectionstats', 'received 2, rejected 1'
+                          ' \\(password: 1\\).*ivar: 1 lines', private = True)
+        self.assertRegexp('sectionstats ivar',
+                          'ivar: sent 1, spool dropped 0, queued 1.*'
+                          '#test: dispatched 2',
+                          private = True)
+
+    def testDedup(self):
+        self.assertNotError('sectiondedup ivar 1', private = True)
+        self.assertRegexp('sectionshow ivar', '#test dedup 1s$',
+                          private = True)
+        for i in range(3):
+            communicate(b'ivar;ivarpw;ivar data\n', sendonly=True)
+        self.assertResponse(' ', 'ivar data')
+        self.assertResponse(' ', 'ivar data (repeated 2 times)')
+        self.assertNotError('sectiondata ivar ivarpw #test', private = True)
+        self.assertRegexp('sectionshow ivar', 'dedup 1s$', private = True)
+
+    def _wait_queued(self, section, count):
+        plugin = self.irc.getCallback('Irccat')
+        start = time.time()
+        while plugin.metrics.count('queued', section) < count:
+            self.assertLess(time.time() - start, 2)
+            time.sleep(0.01)
+
+    def testPriority(self):
+        config.global_option('ircqueue').setValue(5)
+        try:
+            self.assertNotError('reload Irccat', private = True)
+            self.assertNotError('sectiondata alert alertpw #test high',
+                                private = True)
+            self.assertRegexp('sectionshow alert', '#test priority high$',
+                              private = True)
+            lines = b''.join([b'line %d\n' % i for i in range(20)])
+            communicate(b'AUTH ivar ivarpw\n' + lines, sendonly=True)
+            self._wait_queued('ivar', 20)
+            communicate(b'alert;alertpw;alert\n', sendonly=True)
+            self._wait_queued('alert', 1)
+            # Five bulk lines fill the irc queue (ircqueue), rest wait.
+            for i in range(5):
+                self.assertResponse(' ', 'line %d' % i)
+            self.assertResponse(' ', 'alert')
+            for i in range(5, 20):
+                self.assertResponse(' ', 'line %d' % i)
+        finally:
+            config.global_option('ircqueue').setValue(0)
+
+    def testIrcQueueOwn(self):
+        config.global_option('ircqueue').setValue(1)
+        try:
+            self.assertNotError('reload Irccat', private = True)
+            plugin = self.irc.getCallback('Irccat')
+            for i in range(3):
+                self.irc.queueMsg(ircmsgs.privmsg('#other', 'other %d' % i))
+            communicate(b'ivar;ivarpw;line 1\n', sendonly=True)
+            communicate(b'ivar;ivarpw;line 2\n', sendonly=True)
+            self._wait_queued('ivar', 2)
+            # Other plugins' messages don't count, one of ours does.
+            time.sleep(0.2)
+            self.assertEqual(plugin.metrics.count('dispatched', '#test'), 1)
+            for i in range(3):
+                self.assertResponse(' ', 'other %d' % i)
+            self.assertResponse(' ', 'line 1')
+            self.assertResponse(' ', 'line 2')
+        finally:
+            config.global_option('ircqueue').setValue(0)
+
+    def testPart(self):
+        self.irc.feedMsg(ircmsgs.part(self.channel, prefix=self.prefix))
+        communicate(b'ivar;ivarpw;ivar data\n', sendonly=True)
+        self.assertNoResponse(' ', 1)
+        self.irc.feedMsg(ircmsgs.join(self.channel, prefix=self.prefix))
+        while self.irc.takeMsg():
+            pass
+        communicate(b'ivar;ivarpw;ivar data\n', sendonly=True)
+        self.assertResponse(' ', 'ivar data')
+
     def testBadFormat(self):
         communicate(b'ivar;ivarpw data\n', sendonly=True)
         self.assertRegexp(' ', 'Illegal format.*')
@@ -118,6 +308,517 @@ class IrccatTestCopy(ChannelPluginTestCase):
         self.assertRegexp(' ', 'No such section.*')
 
 
+def closed(s):
+    ''' Return True if peer closes or aborts connection s. '''
+    s.settimeout(2)
+    try:
+        return s.recv(1024) == b''
+    except socket.timeout:
+        return False
+    except socket.error:
+        return True
+
+
+class _Conformance(object):
+    '''
+    Listener behaviour shared by all backends, run once for each of
+    them by the IrccatTestBackend* subclasses.
+    '''
+    plugins = ('Irccat', 'User')
+    channel = '#test'
+    backend = None
+
+    def setUp(self, nick='test'):      # pylint: disable=W0221
+        clear_sections(self)
+        config.global_option('backend').setValue(self.backend)
+        config.global_option('unixsocket').setValue(UNIXSOCKET)
+        config.global_option('udpport').setValue(23457)
+        config.global_option('httpport').setValue(23458)
+        ChannelPluginTestCase.setUp(self)
+        self.assertNotError('reload Irccat', private = True)
+        self.assertNotError('register suptest suptest', private = True)
+        self.assertNotError('sectiondata ivar ivarpw #test', private = True)
+
+    def tearDown(self):
+        config.global_option('backend').setValue('twisted')
+        config.global_option('failmax').setValue(8)
+        config.global_option('unixsocket').setValue('')
+        config.global_option('udpport').setValue(0)
+        config.global_option('httpport').setValue(0)
+        for name in ('maxhostconnections', 'idletimeout', 'handshaketimeout',
+                     'maxlinelength', 'longlines', 'hostbuffer'):
+            option = config.global_option(name)
+            option.setValue(option._default)        # pylint: disable=W0212
+        ChannelPluginTestCase.tearDown(self)
+
+    def _reload(self, **options):
+        for name, value in options.items():
+            config.global_option(name).setValue(value)
+        self.assertNotError('reload Irccat', private = True)
+
+    def testFraming(self):
+        s = socket.create_connection(('localhost', 23456))
+        try:
+            s.sendall(b'ivar;ivarpw;par')
+            time.sleep(0.1)
+            s.sendall(b'tial\nivar;ivarpw;a;b\nivar;ivarpw;x')
+        finally:
+            s.close()
+        self.assertResponse(' ', 'partial')
+        self.assertResponse(' ', 'a;b')
+        self.assertNoResponse(' ', 1)
+
+    def testLongLine(self):
+        s = socket.create_connection(('localhost', 23456))
+        try:
+            s.sendall(b'ivar;ivarpw;' + b'x' * 16384 + b'\nivar;ivarpw;a\n')
+            self.assertTrue(closed(s))
+        finally:
+            s.close()
+        self.assertNoResponse(' ', 1)
+
+    def testAuth(self):
+        s = socket.create_connection(('localhost', 23456))
+        try:
+            s.sendall(b'AUTH ivar ivarpw\nline;1\nAUTH ivar x\n')
+            self.assertResponse(' ', 'line;1')
+            self.assertResponse(' ', 'AUTH ivar x')
+            self.assertNotError('sectiondata ivar ivarpw2 #test',
+                                private = True)
+            time.sleep(0.1)
+            s.sendall(b'line 2\n')
+            self.assertRegexp(' ', 'Section removed or updated.*')
+            self.assertTrue(closed(s))
+        finally:
+            s.close()
+
+    def testAuthBad(self):
+        for line in [b'AUTH ivar ivarpw22\n', b'AUTH ivar\n']:
+            s = socket.create_connection(('localhost', 23456))
+            try:
+                s.sendall(line + b'line 1\n')
+                self.assertRegexp(' ', '(Bad password|Illegal AUTH).*')
+                self.assertTrue(closed(s))
+            finally:
+                s.close()
+        self.assertNoResponse(' ', 1)
+
+    def testBadLines(self):
+        communicate(b'ivar;ivarpw data\nivar;ivarpw;\xff\nx;y;z\n',
+                    sendonly=True)
+        self.assertRegexp(' ', 'Illegal format.*')
+        self.assertRegexp(' ', 'Invalid encoding.*')
+        self.assertRegexp(' ', 'No such section.*')
+        communicate(b'ivar;ivarpw;ok\n', sendonly=True)
+        self.assertResponse(' ', 'ok')
+
+    def testBlacklist(self):
+        config.global_option('failmax').setValue(2)
+        self.assertNotError('reload Irccat', private = True)
+        communicate(b'ivar;bad;1\nivar;bad;2\n', sendonly=True)
+        self.assertRegexp(' ', 'Bad password.*')
+        self.assertRegexp(' ', 'Bad password.*')
+        time.sleep(0.1)
+        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        try:
+            s.connect(('localhost', 23456))
+            s.sendall(b'ivar;ivarpw;ivar data\n')
+            self.assertTrue(closed(s))
+        except socket.error:
+            pass                                # Reset before recv().
+        finally:
+            s.close()
+        self.assertNoResponse(' ', 1)
+
+    def testStats(self):
+        communicate(b'ivar;ivarpw;ivar data\n', sendonly=True)
+        self.assertResponse(' ', 'ivar data')
+        time.sleep(1.2)
+        self.assertRegexp('sectionstats ivar', 'ivar: sent 1,',
+                          private = True)
+
+    def testUnix(self):
+        s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            s.connect(UNIXSOCKET)
+            s.sendall(b'ivar;ivarpw;line 1\nAUTH ivar ivarpw\nline 2\n')
+        finally:
+            s.close()
+        self.assertResponse(' ', 'line 1')
+        self.assertResponse(' ', 'line 2')
+        # Checked when the io_process is up, it must not change the mode.
+        self.assertEqual(os.stat(UNIXSOCKET).st_mode & 0o777, 0o660)
+
+    def testUnixBlacklist(self):
+        config.global_option('failmax').setValue(1)
+        self.assertNotError('reload Irccat', private = True)
+        s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            s.connect(UNIXSOCKET)
+            s.sendall(b'ivar;bad;1\n')
+        finally:
+            s.close()
+        self.assertRegexp(' ', 'Bad password.* uid:%d' % os.getuid())
+        time.sleep(0.1)
+        s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            s.connect(UNIXSOCKET)
+            s.sendall(b'ivar;ivarpw;ivar data\n')
+            self.assertTrue(closed(s))
+        except socket.error:
+            pass                                # Reset before recv().
+        finally:
+            s.close()
+        self.assertNoResponse(' ', 1)
+
+    def testUdp(self):
+        s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            s.sendto(b'ivar;ivarpw;a', ('127.0.0.1', 23457))
+            self.assertResponse(' ', 'a')
+            s.sendto(b'ivar;ivarpw;b\n', ('127.0.0.1', 23457))
+            self.assertResponse(' ', 'b')
+            s.sendto(b'ivar;ivarpw;c\nivar;ivarpw;d\n', ('127.0.0.1', 23457))
+            self.assertRegexp(' ', 'Multiple lines in datagram.*')
+            s.sendto(b'AUTH ivar ivarpw\n', ('127.0.0.1', 23457))
+            self.assertRegexp(' ', 'AUTH on datagram.*')
+            for i in range(9):                  # Above failmax.
+                s.sendto(b'ivar;bad;d', ('127.0.0.1', 23457))
+                self.assertRegexp(' ', 'Bad password.*127.0.0.1')
+            s.sendto(b'ivar;ivarpw;e', ('127.0.0.1', 23457))
+            self.assertResponse(' ', 'e')       # Not blacklisted.
+        finally:
+            s.close()
+        communicate(b'ivar;ivarpw;f\n', sendonly = True)
+        self.assertResponse(' ', 'f')
+
+    def testTruncate(self):
+        self._reload(maxlinelength = 20, longlines = 'truncate')
+        s = socket.create_connection(('localhost', 23456))
+        try:
+            s.sendall(b'ivar;ivarpw;' + b'x' * 30 + b'\n')
+            s.sendall(b'ivar;ivarpw;' + b'y' * 30)
+            time.sleep(0.1)
+            s.sendall(b'y' * 30 + b'\nivar;ivarpw;a\n')
+        finally:
+            s.close()
+        self.assertResponse(' ', 'x' * 8)
+        self.assertResponse(' ', 'y' * 8)
+        self.assertResponse(' ', 'a')
+
+    def testMaxConnections(self):
+        self._reload(maxhostconnections = 2)
+        socks = [socket.create_connection(('localhost', 23456))
+                 for i in range(3)]
+        try:
+            self.assertTrue(closed(socks[2]))
+            socks[0].sendall(b'ivar;ivarpw;a\n')
+            self.assertResponse(' ', 'a')
+        finally:
+            for s in socks:
+                s.close()
+        time.sleep(0.1)
+        communicate(b'ivar;ivarpw;b\n', sendonly = True)
+        self.assertResponse(' ', 'b')
+
+    def testTimeouts(self):
+        self._reload(handshaketimeout = 1, idletimeout = 4)
+        idle = socket.create_connection(('localhost', 23456))
+        silent = socket.create_connection(('localhost', 23456))
+        try:
+            idle.sendall(b'AUTH ivar ivarpw\n')
+            time.sleep(1)
+            self.assertTrue(closed(silent))
+            idle.sendall(b'a\n')
+            self.assertResponse(' ', 'a')
+            self.assertFalse(closed(idle))      # Handshake was done.
+            time.sleep(1.5)
+            self.assertTrue(closed(idle))
+        finally:
+            idle.close()
+            silent.close()
+
+    def testHostBuffer(self):
+        self._reload(hostbuffer = 100)
+        socks = [socket.create_connection(('localhost', 23456))
+                 for i in range(2)]
+        try:
+            socks[0].sendall(b'ivar;ivarpw;' + b'a' * 50)
+            time.sleep(0.1)
+            socks[1].sendall(b'ivar;ivarpw;' + b'b' * 50)
+            self.assertTrue(closed(socks[1]))
+            socks[0].sendall(b'\n')
+            self.assertResponse(' ', 'a' * 50)
+        finally:
+            for s in socks:
+                s.close()
+
+    def _post(self, conn, body, status):
+        if not isinstance(body, bytes):
+            body = json.dumps(body).encode()
+        conn.request('POST', '/', body,
+                     {'Content-Type': 'application/json'})
+        response = conn.getresponse()
+        self.assertEqual(response.status, status)
+        return json.loads(response.read().decode())
+
+    def testHttp(self):
+        conn = HTTPConnection('localhost', 23458, timeout = 5)
+        try:
+            result = self._post(conn, {'section': 'ivar', 'token': 'ivarpw',
+                                       'lines': ['line 1', 'line 2\nline 3']},
+                                200)
+            self.assertEqual(result, {'lines': 3})
+            sock = conn.sock
+            self._post(conn, {'section': 'ivar', 'token': 'ivarpw',
+                              'lines': ['line 4']}, 200)
+            self.assertIs(conn.sock, sock)          # Kept alive.
+        finally:
+            conn.close()
+        for i in range(1, 5):
+            self.assertResponse(' ', 'line %d' % i)
+
+    def testHttpBad(self):
+        for body, status in [
+                ({'section': 'ivar', 'token': 'bad', 'lines': ['x']}, 403),
+                ({'section': 'ivar', 'token': 'ivarpw', 'lines': 'x'}, 400),
+                ({'section': u'\ud800', 'token': 'x', 'lines': ['x']}, 400),
+                ({'section': 'ivar', 'token': 'ivarpw',
+                  'lines': [u'\ud800']}, 400),
+                (b'{"section": "ivar"', 400),
+                (b'x' * 1048577, 413)]:
+            conn = HTTPConnection('localhost', 23458, timeout = 5)
+            try:
+                self._post(conn, body, status)
+                self.assertIs(conn.sock, None)      # Closed by server.
+            finally:
+                conn.close()
+            self.assertRegexp(' ', '(Bad password|Illegal webhook|Too large)')
+        conn = HTTPConnection('localhost', 23458, timeout = 5)
+        try:
+            conn.request('GET', '/')
+            self.assertEqual(conn.getresponse().status, 405)
+        finally:
+            conn.close()
+        self.assertRegexp(' ', 'Bad HTTP method.*')
+        self.assertNoResponse(' ', 1)
+
+
+class IrccatTestBackendTwisted(_Conformance, ChannelPluginTestCase):
+    backend = 'twisted'
+
+
+class IrccatTestBackendAsyncio(_Conformance, ChannelPluginTestCase):
+    backend = 'asyncio'
+
+
+class IrccatTestWorkers(ChannelPluginTestCase):
+    plugins = ('Irccat', 'User')
+    channel = '#test'
+
+    def setUp(self, nick='test'):      # pylint: disable=W0221
+        clear_sections(self)
+        config.global_option('workers').setValue(3)
+        ChannelPluginTestCase.setUp(self)
+        self.assertNotError('reload Irccat', private = True)
+        self.assertNotError('register suptest suptest', private = True)
+        self.assertNotError('sectiondata ivar ivarpw #test', private = True)
+
+    def tearDown(self):
+        config.global_option('workers').setValue(1)
+        ChannelPluginTestCase.tearDown(self)
+
+    def testWorkers(self):
+        self.assertEqual(len(self.irc.getCallback('Irccat').processes), 3)
+        for i in range(10):
+            communicate(b'ivar;ivarpw;data %d\n' % i, sendonly=True)
+        received = set()
+        for i in range(10):
+            received.add(self.getMsg(' ').args[1])
+        self.assertEqual(received, set(['data %d' % i for i in range(10)]))
+
+
+class IrccatTestSupervisor(ChannelPluginTestCase):
+    plugins = ('Irccat', 'User')
+    channel = '#test'
+
+    def setUp(self, nick='test'):      # pylint: disable=W0221
+        clear_sections(self)
+        ChannelPluginTestCase.setUp(self)
+        self.assertNotError('reload Irccat', private = True)
+        self.assertNotError('register suptest suptest', private = True)
+        self.assertNotError('sectiondata ivar ivarpw #test', private = True)
+
+    def testRestart(self):
+        plugin = self.irc.getCallback('Irccat')
+        self.assertRegexp('sectionhealth', '^ok: workers 1/1 up',
+                          private = True)
+        sent = {}
+        done = threading.Event()
+
+        def sender():
+            i = 0
+            while not done.is_set():
+                sent['line %d' % i] = time.time()
+                try:
+                    communicate(b'ivar;ivarpw;line %d\n' % i, sendonly=True)
+                except socket.error:
+                    pass
+                i += 1
+                time.sleep(0.01)
+
+        thread = threading.Thread(target = sender)
+        thread.start()
+        downtime = None
+        try:
+            time.sleep(0.5)
+            killed = time.time()
+            os.kill(plugin.processes[0].pid, signal.SIGKILL)
+            while downtime is None and time.time() < killed + 10:
+                msg = self.irc.takeMsg()
+                if msg is None:
+                    time.sleep(0.01)
+                elif sent.get(msg.args[1], 0) > killed:
+                    downtime = time.time() - killed
+        finally:
+            done.set()
+            thread.join()
+        self.assertIsNot(downtime, None)
+        self.assertLess(downtime, 2.0)
+        self.assertEqual(plugin.metrics.count('restarts'), 1)
+        idle = time.time()
+        while time.time() - idle < 0.2:        # Drain lines still queued.
+            if self.irc.takeMsg():
+                idle = time.time()
+            else:
+                time.sleep(0.01)
+        self.assertRegexp('sectionhealth', '^ok: .* restarts 1',
+                          private = True)
+        self.assertNotError('sectiondata ivar ivarpw2 #test', private = True)
+        time.sleep(0.1)
+        communicate(b'ivar;ivarpw2;after restart\n', sendonly=True)
+        self.assertResponse(' ', 'after restart')
+
+    def testAdopt(self):
+        process = self.irc.getCallback('Irccat').processes[0]
+        self.assertNotError('sectiondata ivar ivarpw2 #test', private = True)
+        self.assertNotError('reload Irccat', private = True)
+        self.assertIs(self.irc.getCallback('Irccat').processes[0], process)
+        communicate(b'ivar;ivarpw2;adopted\n', sendonly=True)
+        self.assertResponse(' ', 'adopted')
+        option = config.global_option('maxlinelength')
+        option.setValue(100)
+        try:
+            self.assertNotError('reload Irccat', private = True)
+        finally:
+            option.setValue(option._default)        # pylint: disable=W0212
+        self.assertIsNot(self.irc.getCallback('Irccat').processes[0],
+                         process)
+        self.assertFalse(process.is_alive())
+        communicate(b'ivar;ivarpw2;not adopted\n', sendonly=True)
+        self.assertResponse(' ', 'not adopted')
+
+
+class IrccatTestDiskSpool(ChannelPluginTestCase):
+    plugins = ('Irccat', 'User')
+    channel = '#test'
+
+    def setUp(self, nick='test'):      # pylint: disable=W0221
+        clear_sections(self)
+        shutil.rmtree('test-spool', True)
+        config.global_option('diskspool').setValue('test-spool')
+        ChannelPluginTestCase.setUp(self)
+        self.assertNotError('reload Irccat', private = True)
+        self.assertNotError('register suptest suptest', private = True)
+        self.assertNotError('sectiondata ivar ivarpw #test,#later',
+                            private = True)
+
+    def tearDown(self):
+        config.global_option('diskspool').setValue('')
+        ChannelPluginTestCase.tearDown(self)
+        shutil.rmtree('test-spool', True)
+
+    def _replayed(self):
+        ''' Join #later, return text of first message sent there. '''
+        self.irc.feedMsg(ircmsgs.join('#later', prefix=self.prefix))
+        while True:
+            msg = self.irc.takeMsg() or self.getMsg(' ')
+            if msg.command == 'NOTICE' and msg.args[0] == '#later':
+                return msg.args[1]
+
+    def testReplay(self):
+        communicate(b'ivar;ivarpw;spooled data\n', sendonly=True)
+        self.assertResponse(' ', 'spooled data')
+        time.sleep(0.2)
+        self.assertEqual(self._replayed(), 'spooled data')
+
+    def testReload(self):
+        communicate(b'ivar;ivarpw;spooled data\n', sendonly=True)
+        self.assertResponse(' ', 'spooled data')
+        time.sleep(0.2)
+        self.assertNotError('reload Irccat', private = True)
+        self.assertEqual(self._replayed(), 'spooled data')
+
+    def testShutdown(self):
+        option = config.global_option('batchwindow')
+        option.setValue(60000)
+        try:
+            self.assertNotError('reload Irccat', private = True)
+        finally:
+            option.setValue(option._default)        # pylint: disable=W0212
+        communicate(b'ivar;ivarpw;batched data\n', sendonly=True)
+        self.assertNoResponse(' ', 0.5)     # Still in the io_process.
+        plugin = self.irc.getCallback('Irccat')
+        process = plugin.processes[0]
+        plugin.finalizer()                  # Bot exits.
+        self.assertFalse(process.is_alive())
+        self.assertNotError('reload Irccat', private = True)
+        self.assertEqual(self._replayed(), 'batched data')
+
+    def testSpoolError(self):
+        plugin = self.irc.getCallback('Irccat')
+
+        def failing_append(*args):
+            raise OSError(28, 'No space left on device')
+
+        plugin.diskspool.append = failing_append
+        communicate(b'ivar;ivarpw;lost data\n', sendonly=True)
+        self.assertResponse(' ', 'lost data')
+        communicate(b'ivar;ivarpw;more data\n', sendonly=True)
+        self.assertResponse(' ', 'more data')
+        self.assertTrue(plugin.thread.is_alive())
+        self.assertEqual(plugin.metrics.count('dropped', '#later'), 2)
+
+
+class IrccatTestTracing(ChannelPluginTestCase):
+    plugins = ('Irccat', 'User')
+    channel = '#test'
+
+    def setUp(self, nick='test'):      # pylint: disable=W0221
+        clear_sections(self)
+        config.global_option('tracing').setValue(True)
+        ChannelPluginTestCase.setUp(self)
+        self.assertNotError('reload Irccat', private = True)
+        self.assertNotError('register suptest suptest', private = True)
+        self.assertNotError('sectiondata ivar ivarpw #test', private = True)
+
+    def tearDown(self):
+        config.global_option('tracing').setValue(False)
+        ChannelPluginTestCase.tearDown(self)
+
+    def testSlow(self):
+        self.assertResponse('sectionslow', 'No traced messages',
+                            private = True)
+        communicate(b'ivar;ivarpw;ivar data\n', sendonly=True)
+        self.assertResponse(' ', 'ivar data')
+        self.assertRegexp('sectionslow',
+                          '^[0-9.]+ms ivar #test "ivar data" \\(mostly'
+                          ' [a-z]+: listener [0-9.]+ms pipe',
+                          private = True)
+        plugin = self.irc.getCallback('Irccat')
+        self.assertEqual(plugin.metrics.histogram('total', 'ivar').total, 1)
+
+
 class IrccatTestIrccat(ChannelPluginTestCase):
     plugins = ('Irccat', 'User')
     channel = '#test'
@@ -142,6 +843,31 @@ class IrccatTestIrccat(ChannelPluginTestCase):
         p.communicate(b'ivarpw\n')
         self.assertResponse(' ', 'ivar data')
 
+    def testIrccatAuth(self):
+        cmd = 'IRCCAT_PASSWORD=ivarpw %s -a localhost 23456 ivar'
+        p = subprocess.Popen(cmd % CLIENT, shell = True,
+                             stdin = subprocess.PIPE)
+        p.communicate(b'ivar data\nmore data\n')
+        self.assertResponse(' ', 'ivar data')
+        self.assertResponse(' ', 'more data')
+
+    def testIrccatFollow(self):
+        cmd = 'IRCCAT_PASSWORD=ivarpw %s -f localhost 23456 ivar'
+        p = subprocess.Popen(cmd % CLIENT, shell = True,
+                             stdin = subprocess.PIPE)
+        p.communicate(b'ivar data\nmore data')
+        self.assertResponse(' ', 'ivar data')
+        self.assertResponse(' ', 'more data')
+
+    def testIrccatBatch(self):
+        path = os.path.join(conf.supybot.directories.data(), 'batch.txt')
+        with open(path, 'w') as f:
+            f.write('ivar data\nmore data\n')
+        cmd = 'IRCCAT_PASSWORD=ivarpw %s -a -b %s localhost 23456 ivar'
+        subprocess.check_call(cmd % (CLIENT, path), shell = True)
+        self.assertResponse(' ', 'ivar data')
+        self.assertResponse(' ', 'more data')
+
     def testIrccatBadCmdline(self):
         cmd = 'IRCCAT_PASSWORD=ivarpw %s' \
               ' localhost 23456'
@@ -183,6 +909,31 @@ class IrccatTestData(PluginTestCase):
         self.assertResponse('sectionkill tore', 'Error: no such section')
 
 
+class _Process(object):
+    pid = 4711
+    exitcode = -9
+
+    def join(self):
+        pass
+
+
+class WorkerTest(SupyTestCase):
+
+    def testBackoff(self):
+        worker = irccat._Worker('twistedio', [])
+        worker.process = _Process()
+        delays = []
+        for now in (100.0, 101.0, 102.0, 103.0):
+            worker.started = now - 1
+            worker.pipe = (_Conn(), _Conn())
+            worker.died(now)
+            delays.append(worker.due - now)
+        self.assertEqual(delays, [0.5, 1.0, 2.0, 4.0])
+        worker.started = 0.0
+        worker.died(200.0)                      # Was up for a long time.
+        self.assertEqual(worker.due, 200.0)
+
+
 class BlacklistTest(SupyTestCase):
 
     def setUp(self):
@@ -190,7 +941,7 @@ class BlacklistTest(SupyTestCase):
         self.blacklist = None
 
     def testBlock(self):
-        self.blacklist = irccat._Blacklist()    # pylint: disable=W0212
+        self.blacklist = listener.Blacklist()
         self.blacklist.FailMax = 5
         self.blacklist.BlockTime = 0.2
 
@@ -207,5 +958,412 @@ class BlacklistTest(SupyTestCase):
             self.blacklist.register(host, False)
         self.assertTrue(self.blacklist.onList(host))
 
+    def testSubnet(self):
+        self.blacklist = listener.Blacklist(2, 10, 4)
+        for host in ['10.0.0.1', '10.0.0.2', '10.0.1.3', '10.0.0.4']:
+            self.blacklist.register(host, False)
+            self.blacklist.register(host, False)
+        self.assertFalse(self.blacklist.onList('10.0.0.5'))
+        self.blacklist.register('10.0.0.6', False)
+        self.blacklist.register('10.0.0.6', False)
+        self.assertTrue(self.blacklist.onList('10.0.0.5'))
+        self.assertFalse(self.blacklist.onList('10.0.1.5'))
+
+    def testBounded(self):
+        self.blacklist = listener.Blacklist(2, 10)
+        self.blacklist.MaxHosts = 100
+        for i in range(1000):
+            self.blacklist.register('10.%d.%d.1' % (i // 256, i % 256), False)
+        self.assertEqual(len(self.blacklist), 100)
+        self.blacklist.register('10.0.0.1', True)
+
+
+class AuthCacheTest(SupyTestCase):
+
+    def testVerify(self):
+        cache = listener.AuthCache(2)
+        cipher = crypt.crypt('pw', 'ab')
+        self.assertTrue(cache.verify('s1', 'pw', cipher))
+        self.assertFalse(cache.verify('s1', 'bad', cipher))
+        self.assertEqual(len(cache), 1)
+        self.assertTrue(cache.verify('s1', 'pw', cipher))
+        self.assertFalse(cache.verify('s1', 'pw', crypt.crypt('pw2', 'ab')))
+
+    def testEvict(self):
+        cache = listener.AuthCache(2)
+        cipher = crypt.crypt('pw', 'ab')
+        for section in ['s1', 's2', 's3']:
+            cache.verify(section, 'pw', cipher)
+        self.assertEqual(len(cache), 2)
+        cache.clear()
+        self.assertEqual(len(cache), 0)
+
+    def testDisabled(self):
+        cache = listener.AuthCache(0)
+        self.assertTrue(cache.verify('s1', 'pw', crypt.crypt('pw', 'ab')))
+        self.assertEqual(len(cache), 0)
+
+
+class DiskSpoolTest(SupyTestCase):
+
+    def setUp(self):
+        SupyTestCase.setUp(self)
+        shutil.rmtree('test-spool', True)
+
+    def tearDown(self):
+        shutil.rmtree('test-spool', True)
+        SupyTestCase.tearDown(self)
+
+    def testReplay(self):
+        spool = diskspool.DiskSpool('test-spool', 100000, 3600)
+        for i in range(100):
+            spool.append('#a', 'sec', 'msg %d' % i, time.time())
+        self.assertEqual(spool.channels(), ['#a'])
+        self.assertEqual([m for w, s, m in spool.take('#a', 2)],
+                         ['msg 0', 'msg 1'])
+        spool.close()
+        spool = diskspool.DiskSpool('test-spool', 100000, 3600)
+        self.assertEqual(spool.take('#a', 1)[0][2], 'msg 2')
+        self.assertEqual(len(spool.take('#a', 1000)), 97)
+        self.assertEqual(spool.channels(), [])
+
+    def testLimits(self):
+        spool = diskspool.DiskSpool('test-spool', 4000, 3600)
+        for i in range(1000):
+            spool.append('#a', 'sec', 'msg %d' % i, time.time())
+        taken = spool.take('#a', 1000)
+        self.assertLess(len(taken), 300)
+        self.assertEqual(taken[-1][2], 'msg 999')
+        spool.append('#b', 'sec', 'old', time.time() - 7200)
+        spool.append('#b', 'sec', 'new', time.time())
+        self.assertEqual([m for w, s, m in spool.take('#b', 10)], ['new'])
+
+
+class StoreTest(SupyTestCase):
+
+    def setUp(self):
+        SupyTestCase.setUp(self)
+        clear_sections(self)
+
+    def tearDown(self):
+        clear_sections(self)
+        SupyTestCase.tearDown(self)
+
+    def testStores(self):
+        for kind in ['sqlite', 'journal']:
+            store_ = store.open_store(kind, 'test-sections.pickle')
+            store_.put('s1', {'password': 'pw1', 'channels': ['#a']})
+            store_.put_many([('s2', {'password': 'pw2', 'channels': []}),
+                             ('s3', {'password': 'pw3', 'channels': []})])
+            store_.delete('s3')
+            store_.close()
+            store_ = store.open_store(kind, 'test-sections.pickle')
+            self.assertEqual(store_.load(),
+                             {'s1': {'password': 'pw1', 'channels': ['#a']},
+                              's2': {'password': 'pw2', 'channels': []}})
+            store_.close()
+
+    def testJournalCrash(self):
+        store_ = store.open_store('journal', 'test-sections')
+        store_.put('s1', {'password': 'pw1', 'channels': ['#a']})
+        store_.close()
+        with open('test-sections.journal', 'a') as f:
+            f.write('{"name": "s2", "da')
+        store_ = store.open_store('journal', 'test-sections')
+        self.assertEqual(list(store_.load().keys()), ['s1'])
+        store_.put('s3', {'password': 'pw3', 'channels': ['#a']})
+        self.assertEqual(sorted(store_.load().keys()), ['s1', 's3'])
+        store_.close()
+
+    def testCorrupt(self):
+        config.global_option('sectionspath').setValue('test-sections.pickle')
+        for kind in ['sqlite', 'journal']:
+            config.global_option('sectionstore').setValue(kind)
+            path = store.store_path(kind, 'test-sections.pickle')
+            with open(path, 'w') as f:
+                f.write('garbage\n' * 100)
+            config_ = irccat._Config()          # pylint: disable=W0212
+            self.assertEqual(config_.keys(), [])
+            config_.update('ivar', 'pw', ['#a'])
+            config_.close()
+            self.assertTrue(os.path.exists(path + '.corrupt'))
+            config_ = irccat._Config()          # pylint: disable=W0212
+            self.assertEqual(config_.get('ivar'), ('pw', ['#a']))
+            config_.close()
+        config.global_option('sectionstore').setValue('sqlite')
+
+    def testJournalCompact(self):
+        store_ = store.open_store('journal', 'test-sections')
+        store_.CompactMin = 10
+        for i in range(100):
+            store_.put('s%d' % (i % 3), {'password': str(i), 'channels': []})
+        store_.close()
+        with open('test-sections.journal') as f:
+            self.assertLess(len(f.readlines()), 25)
+        store_ = store.open_store('journal', 'test-sections')
+        self.assertEqual(store_.load()['s0']['password'], '99')
+        store_.close()
+
+    def testJournalCompactError(self):
+        store_ = store.open_store('journal', 'test-sections')
+        store_.CompactMin = 10
+        os.mkdir('test-sections.journal.tmp')      # Compacting fails.
+        try:
+            for i in range(20):
+                store_.put('s%d' % (i % 3), {'password': str(i),
+                                             'channels': []})
+            store_._compactor.join()                # pylint: disable=W0212
+            self.assertIsNone(store_._pending)      # pylint: disable=W0212
+        finally:
+            os.rmdir('test-sections.journal.tmp')
+        store_.put('s0', {'password': '20', 'channels': []})
+        store_.close()
+        with open('test-sections.journal') as f:
+            self.assertLess(len(f.readlines()), 10)
+        store_ = store.open_store('journal', 'test-sections')
+        self.assertEqual(store_.load()['s0']['password'], '20')
+        store_.close()
+
+    def testMigrate(self):
+        config.global_option('sectionspath').setValue('test-sections.pickle')
+        with open('test-sections.pickle', 'wb') as f:
+            pickle.dump({'ivar': irccat._Section('pw', ['#a'])}, f)
+        irccat._Config().close()                # pylint: disable=W0212
+        self.assertFalse(os.path.exists('test-sections.pickle'))
+        config_ = irccat._Config()              # pylint: disable=W0212
+        self.assertEqual(config_.get('ivar'), ('pw', ['#a']))
+        config_.close()
+
+
+class MetricsTest(SupyTestCase):
+
+    def testHistogram(self):
+        hist = metrics.Histogram()
+        for value in [0.0002] * 98 + [0.02, 0.2]:
+            hist.observe(value)
+        self.assertEqual(hist.percentile(0.5), 0.0005)
+        self.assertEqual(hist.percentile(0.99), 0.05)
+        self.assertEqual(hist.percentile(1), 0.2)
+        self.assertEqual(hist.max, 0.2)
+
+    def testMerge(self):
+        io_metrics = metrics.Metrics()
+        io_metrics.inc('rejected', 'password')
+        io_metrics.inc('sent', 'ivar', 3)
+        main_metrics = metrics.Metrics()
+        main_metrics.observe('latency', 'ivar', 0.002)
+        main_metrics.merge(io_metrics.take())
+        self.assertEqual(io_metrics.counters, {})
+        self.assertEqual(main_metrics.count('sent', 'ivar'), 3)
+        text = main_metrics.prometheus()
+        self.assertIn('irccat_rejected_total{reason="password"} 1', text)
+        self.assertIn('irccat_latency_seconds_bucket{section="ivar",'
+                      'le="0.005"} 1', text)
+
+    def testEscape(self):
+        metrics_ = metrics.Metrics()
+        metrics_.inc('sent', 'a"b\\c\nd')
+        self.assertIn('irccat_sent_total{section="a\\"b\\\\c\\nd"} 1',
+                      metrics_.prometheus())
+
+    def testServe(self):
+        metrics_ = metrics.Metrics()
+        metrics_.inc('received', None, 7)
+        server = metrics.serve(metrics_, 23457)
+        try:
+            s = socket.create_connection(('127.0.0.1', 23457))
+            s.sendall(b'GET /metrics HTTP/1.0\r\n\r\n')
+            reply = b''
+            while True:
+                data = s.recv(4096)
+                if not data:
+                    break
+                reply += data
+            s.close()
+        finally:
+            server.shutdown()
+            server.server_close()
+        self.assertIn(b'irccat_received_total 7', reply)
+
+
+class _Conn(object):
+
+    def __init__(self):
+        self.sent = []
+
+    def send(self, obj):
+        kind, (when, batch) = obj              # pylint: disable=W0612
+        self.sent.append(batch)
+
+    def close(self):
+        pass
+
+
+class _Timer(object):
+
+    def __init__(self, delay, func):
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class BatcherTest(SupyTestCase):
+
+    def testNoWindow(self):
+        conn = _Conn()
+        batcher = listener.Batcher(conn, 0, _Timer)
+        batcher.send(('a', ['#test']))
+        self.assertEqual(conn.sent, [[('a', ['#test'])]])
+
+    def testBatch(self):
+        conn = _Conn()
+        batcher = listener.Batcher(conn, 10000, _Timer)
+        batcher.MaxBatch = 3
+        for msg in ['a', 'b', 'c', 'd']:
+            batcher.send((msg, ['#test']))
+        self.assertEqual(len(conn.sent), 1)
+        self.assertEqual([m for m, c in conn.sent[0]], ['a', 'b', 'c'])
+        batcher.flush()
+        self.assertEqual(conn.sent[1], [('d', ['#test'])])
+        batcher.flush()
+        self.assertEqual(len(conn.sent), 2)
+
+
+class _BlockingConn(object):
+
+    def __init__(self):
+        self.sent = []
+        self.proceed = threading.Event()
+
+    def send(self, obj):
+        self.proceed.wait()
+        self.sent.append(obj)
+
+
+class SpoolTest(SupyTestCase):
+
+    def testHighWater(self):
+        conn = _BlockingConn()
+        full = threading.Event()
+        drained = threading.Event()
+        spool = listener.Spool(conn, 4, full.set, drained.set)
+        spool.send(('lines', (0, ['a', 'b'])))
+        spool.send(('metrics', ({}, {})))
+        self.assertFalse(full.is_set())
+        spool.send(('lines', (0, ['c', 'd'])))
+        self.assertTrue(full.is_set())
+        self.assertFalse(drained.is_set())
+        conn.proceed.set()
+        self.assertTrue(drained.wait(1))
+        spool.close()
+        self.assertEqual(len(conn.sent), 3)
+        self.assertEqual(spool.lines, 0)
+        self.assertFalse(spool.full)
+
+
+class FloodControlTest(SupyTestCase):
+
+    def testBucket(self):
+        bucket = ratelimit.TokenBucket(2, 2, 100.0)
+        for i in [1, 2]:                        # pylint: disable=W0612
+            self.assertTrue(bucket.ready(100.0))
+            bucket.take()
+        self.assertFalse(bucket.ready(100.0))
+        self.assertAlmostEqual(bucket.delay(100.0), 0.5)
+        self.assertTrue(bucket.ready(100.5))
+
+    def testFair(self):
+        scheduler = ratelimit.FairScheduler((1, 2, 0, 1), 100, 'drop')
+        for i in range(20):
+            scheduler.put('noisy', '#a', 'noise %d' % i)
+        scheduler.put('quiet', '#b', 'alert')
+        released = scheduler.ready(0.0)
+        self.assertEqual([m for s, c, m, t in released],
+                         ['noise 0', 'alert', 'noise 1'])
+        self.assertAlmostEqual(scheduler.next_due(0.0), 1)
+        self.assertEqual(len(scheduler.ready(1.0)), 1)
+
+    def testPriority(self):
+        scheduler = ratelimit.FairScheduler((0, 1, 0, 1), 100, 'drop')
+        for i in range(30):
+            scheduler.put('bulk', '#a', 'bulk %d' % i, priority = 'low')
+        scheduler.put('alert', '#b', 'alert', priority = 'high')
+        released = [m for s, c, m, t in scheduler.ready(0.0, 2)]
+        self.assertEqual(released, ['alert', 'bulk 0'])
+        for i in range(40):
+            scheduler.put('alert', '#b', 'alert %d' % i, priority = 'high')
+        released = [m for s, c, m, t in scheduler.ready(0.0)]
+        alerts = ['alert %d' % i for i in range(10)]
+        self.assertEqual(released[:12], alerts + ['bulk 1', 'alert 10'])
+        self.assertEqual(released[21], 'bulk 2')
+        self.assertEqual(len(released), 69)
+        self.assertEqual(released[-1], 'bulk 29')
+
+    def testBlocked(self):
+        scheduler = ratelimit.FairScheduler((0, 1, 0, 1), 100, 'drop')
+        for i in range(3):
+            scheduler.put('full', '#a', 'full %d' % i, priority = 'high')
+            scheduler.put('open', '#b', 'open %d' % i)
+
+        def blocked(channel):
+            return channel == '#a'
+
+        released = [m for s, c, m, t in scheduler.ready(0.0, None, blocked)]
+        self.assertEqual(released, ['open 0', 'open 1', 'open 2'])
+        self.assertEqual(scheduler.next_due(0.0, blocked), None)
+        self.assertEqual(scheduler.next_due(0.0), 0)
+        self.assertEqual(len(scheduler.ready(0.0)), 3)
+
+    def testSummarize(self):
+        scheduler = ratelimit.FairScheduler((0, 1, 0, 1), 2, 'summarize')
+        for i in range(5):
+            scheduler.put('s', '#a', 'line %d' % i)
+        released = [m for s, c, m, t in scheduler.ready(0.0)]
+        self.assertEqual(released,
+                         ['line 0', 'line 1', '... 3 more lines suppressed'])
+        self.assertEqual(scheduler.next_due(0.0), None)
+
+    def testCoalesce(self):
+        scheduler = ratelimit.FairScheduler((0, 1, 0, 1), 10, 'drop')
+        for msg in ['a', 'b', 'c', 'd']:
+            scheduler.put('s', '#a', msg, 9)
+            scheduler.put('s', '#b', msg, 9)
+        released = [(c, m) for s, c, m, t in scheduler.ready(0.0)]
+        self.assertEqual(released, [('#a', 'a | b | c'), ('#b', 'a | b | c'),
+                                    ('#a', 'd'), ('#b', 'd')])
+
+    def testCasemapping(self):
+        scheduler = ratelimit.FairScheduler((0, 1, 1, 1), 10, 'drop')
+        scheduler.put('s', '#a[', 'a')
+        scheduler.put('t', '#A{', 'b')
+        self.assertEqual(len(scheduler.ready(0.0)), 1)    # Same channel.
+        self.assertEqual(scheduler.next_due(0.0), 1)
+        repeats = ratelimit.RepeatFilter()
+        self.assertTrue(repeats.check('s', '#a[', 'x', 10, 0.0))
+        self.assertFalse(repeats.check('s', '#A{', 'x', 10, 1.0))
+
+    def testRepeats(self):
+        repeats = ratelimit.RepeatFilter()
+        self.assertEqual([repeats.check('s', '#a', 'x', 10, t)
+                          for t in (0.0, 1.0, 2.0)], [True, False, False])
+        self.assertTrue(repeats.check('s', '#b', 'x', 10, 3.0))
+        self.assertTrue(repeats.check('s', '#a', 'y', 10, 3.0))
+        self.assertTrue(repeats.check('s', '#a', 'x', 0, 3.0))
+        self.assertEqual(repeats.expired(5.0), [])
+        self.assertEqual(repeats.next_due(5.0), 5.0)
+        self.assertEqual(repeats.expired(10.0),
+                         [('s', '#a', 'x (repeated 2 times)')])
+        self.assertEqual(repeats.expired(13.0), [])
+        self.assertEqual(repeats.next_due(13.0), None)
+        self.assertTrue(repeats.check('s', '#a', 'x', 10, 13.0))
+
+    def testSplit(self):
+        self.assertEqual(ratelimit.split_utf8(u'abc', 3), [u'abc'])
+        self.assertEqual(ratelimit.split_utf8(u'abcde', 2),
+                         [u'ab', u'cd', u'e'])
+        chunks = ratelimit.split_utf8(u'a\u00e5\u00e4\u00f6', 4)
+        self.assertEqual(chunks, [u'a\u00e5', u'\u00e4\u00f6'])
+
 #
 # vim:set shiftwidth=4 tabstop=4 expandtab textwidth=79:
@@ -0,0 +1,218 @@
+###
+# Copyright (c) 2013, Alec Leamas
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice,
+#     this list of conditions, and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice,
+#     this list of conditions, and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#   * Neither the name of the author of this software nor the name of
+#     contributors to this software may be used to endorse or promote products
+#     derived from this software without specific prior written consent.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+'''
+twisted listener backend, the default: runs listener.Listener and
+listener.Client on the twisted reactor. Imported only in the
+io_process, the main process never loads twisted.
+'''
+
+import os
+import signal
+import stat
+
+from twisted.internet import error, interfaces, reactor, protocol, task
+from zope.interface import implementer
+
+from supybot import log
+
+from . import listener
+
+
+def _stop_reactor():
+    ''' Stop reactor, unless already stopped by e. g., SIGTERM. '''
+    try:
+        reactor.stop()
+    except error.ReactorNotRunning:
+        pass
+
+
+def io_process(socks, pipe, inherited = ()):
+    '''
+    Run the twisted-governed data flow from the listening socks, a list
+    of (kind, socket), -> irc. inherited are main process pipe ends
+    forked into this process, closed so that a dead main process is
+    seen as EOF on pipe.
+    '''
+    # pylint: disable=E1101
+
+    for conn in [pipe[1]] + list(inherited):
+        conn.close()
+    logger = log.getPluginLogger('irccat.io')
+    logger.debug("Starting IO process on %s"
+                 % ', '.join([str(s[1].getsockname()) for s in socks]))
+    factory = IrccatFactory(pipe)
+    for kind, sock in socks:
+        if kind == 'udp':
+            port = reactor.adoptDatagramPort(sock.fileno(), sock.family,
+                                             IrccatDatagrams(factory),
+                                             IrccatDatagrams.MaxPacket)
+        else:
+            if kind == 'unix':
+                path = sock.getsockname()
+                mode = stat.S_IMODE(os.stat(path).st_mode)
+            port = reactor.adoptStreamPort(
+                sock.fileno(), sock.family,
+                _HttpFactory(factory) if kind == 'http' else factory)
+        port.socket.setblocking(False)  # Adopted socket gets default timeout.
+        if kind == 'unix':
+            os.chmod(path, mode)        # Adopting makes it world writable.
+            # Shutdown would unlink the path, still used by main process.
+            reactor.addSystemEventTrigger('before', 'shutdown',
+                                          port.stopReading)
+        sock.close()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, lambda *args: reactor.callFromThread(
+                                                _stop_reactor))
+    try:
+        reactor.run(installSignalHandlers = False)
+    except Exception as ex:                          # pylint: disable=W0703
+        logger.error("Exception in io_process: " + str(ex), exc_info = True)
+    factory.flush()
+    logger.info(" io_process: exiting")
+
+
+class IrccatProtocol(listener.Client, protocol.Protocol):
+    ''' The twisted transport for a listener.Client. '''
+
+    def __init__(self, factory):
+        listener.Client.__init__(self, factory)
+        self.factory = factory
+
+    def connectionMade(self):
+        self.opened(listener.peer_host(self.transport.getHandle()))
+
+    def connectionLost(self, reason):            # pylint: disable=W0222
+        self.closed()
+
+    def dataReceived(self, data):
+        self.data_received(data)
+
+    def abort(self):
+        self.transport.abortConnection()
+
+    def close(self):
+        self.transport.loseConnection()
+
+    def pause(self):
+        self.transport.pauseProducing()
+
+    def resume(self):
+        self.transport.resumeProducing()
+
+    def write(self, data):
+        self.transport.write(data)
+
+
+class IrccatHttpProtocol(listener.HttpClient, IrccatProtocol):
+    ''' The twisted transport for a listener.HttpClient. '''
+
+    def __init__(self, factory):
+        listener.HttpClient.__init__(self, factory)
+        self.factory = factory
+
+
+class IrccatDatagrams(listener.Datagrams, protocol.DatagramProtocol):
+    ''' The twisted UDP transport for listener.Datagrams. '''
+
+    MaxPacket = 65535
+
+    def startProtocol(self):
+        self.started()
+
+    def stopProtocol(self):
+        self.closed()
+
+    def datagramReceived(self, data, addr):    # pylint: disable=W0221
+        self.datagram_received(data, addr[0])
+
+    def pause(self):
+        self.transport.stopReading()
+
+    def resume(self):
+        self.transport.startReading()
+
+
+@implementer(interfaces.IReadDescriptor)
+class _ConfigReader(object):
+    '''
+    Reactor reader applying section updates from main process as soon
+    as they arrive. Stops the reactor if main process goes away.
+    '''
+
+    def __init__(self, factory):
+        self.factory = factory
+
+    def fileno(self):
+        ''' Return the pipe's file descriptor. '''
+        return self.factory.pipe[0].fileno()
+
+    def doRead(self):
+        ''' Apply all pending updates. '''
+        if not self.factory.read_config():
+            reactor.removeReader(self)
+            _stop_reactor()
+
+    def connectionLost(self, reason):
+        ''' Required by IReadDescriptor, never invoked. '''
+
+    def logPrefix(self):
+        ''' Required by IReadDescriptor. '''
+        return 'irccat.config'
+
+
+class _HttpFactory(protocol.Factory):
+    ''' Produces IrccatHttpProtocol for the listener on the HTTP port. '''
+
+    def __init__(self, listener_):
+        self.listener = listener_
+
+    def buildProtocol(self, addr):
+        return IrccatHttpProtocol(self.listener)
+
+
+class IrccatFactory(listener.Listener, protocol.Factory):
+    '''
+    Twisted factory producing a Protocol using buildProtocol, running
+    the listener.Listener on the reactor.
+    '''
+
+    def __init__(self, pipe):
+        listener.Listener.__init__(self, pipe)
+        reactor.addReader(_ConfigReader(self))
+        task.LoopingCall(self.tick).start(self.TickInterval, now = False)
+
+    def call_later(self, delay, func):
+        return reactor.callLater(delay, func)
+
+    def call_from_thread(self, func):
+        reactor.callFromThread(func)
+
+    def buildProtocol(self, addr):
+        return IrccatProtocol(self)